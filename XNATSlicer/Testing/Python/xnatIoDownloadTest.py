@@ -0,0 +1,271 @@
+__author__ = "Sunil Kumar (kumar.sunil.p@gmail.com)"
+__copyright__ = "Copyright 2014, Washington University in St. Louis"
+__credits__ = ["Sunil Kumar", "Steve Pieper", "Dan Marcus"]
+__license__ = "XNAT Software License Agreement " + \
+              "(see: http://xnat.org/about/license.php_)"
+__version__ = "2.1.1"
+__maintainer__ = "Rick Herrick"
+__email__ = "herrickr@mir.wustl.edu"
+__status__ = "Production"
+
+"""
+Segmented downloads of Xnat.io through the download queue.
+
+A local stand-in XNAT server serves files with byte ranges, and drops the
+first response of one range halfway through.  Large files queued with
+'segments' must arrive whole, fetched as ranges; small ones are streamed
+as usual.  A segment that fails for good stops the others, and a later 
+download resumes every range where it stopped.
+
+Run it in Slicer's python (it needs Slicer's 'qt'):
+
+    Slicer --no-main-window --python-script xnatIoDownloadTest.py
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import http.server
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'XnatSlicerLib', 'ext', 'Xnat'))
+from Xnat import *
+
+
+
+class StandInXnat(http.server.ThreadingHTTPServer):
+    """
+    Serves FILES with 'Accept-Ranges: bytes' and records the ranges asked
+    for.  The first response for the range starting at DROP_AT is cut
+    short.  Issues no session token, so Xnat.io stays on Basic auth.
+    """
+
+    FILES = {
+        '/data/archive/projects/P/resources/Slicer/files/big.mrb':
+            os.urandom(4 * 1024 * 1024),
+        '/data/archive/projects/P/resources/Slicer/files/small.mrb':
+            os.urandom(1000),
+        '/data/archive/projects/P/resources/Slicer/files/huge.mrb':
+            os.urandom(16 * 1024 * 1024),
+    }
+    DROP_AT = 1024 * 1024
+
+    #
+    # Responses are sent in THROTTLE_CHUNK pieces, THROTTLE_DELAY seconds
+    # apart, when 'throttled'.
+    #
+    THROTTLE_CHUNK = 256 * 1024
+    THROTTLE_DELAY = 0.05
+    FAIL_DELAY = 0.1
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.daemon_threads = True
+        self.lock = threading.Lock()
+        self.ranges = []
+        self.dropped = False
+        #
+        # Ranges starting at 'failAt' always get a 500, FAIL_DELAY seconds
+        # late.
+        #
+        self.failAt = None
+        self.throttled = False
+
+    @property
+    def host(self):
+        return 'http://127.0.0.1:%i'%(self.server_address[1])
+
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_HEAD(self):
+        data = self.server.FILES.get(self.path)
+        self.send_response(200 if data else 404)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(data or b'')))
+        self.end_headers()
+
+    def do_GET(self):
+        data = self.server.FILES.get(self.path)
+        if data is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start, end = 0, len(data) - 1
+        if 'Range' in self.headers:
+            first, last = self.headers['Range'].split('=')[1].split('-')
+            start, end = int(first), int(last or end)
+            with self.server.lock:
+                self.server.ranges.append((self.path, start, end))
+                drop = start == self.server.DROP_AT and \
+                       not self.server.dropped
+                self.server.dropped = self.server.dropped or drop
+            if start == self.server.failAt:
+                time.sleep(self.server.FAIL_DELAY)
+                self.send_response(500)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %i-%i/%i'%(start, end,
+                                                                len(data)))
+        else:
+            drop = False
+            self.send_response(200)
+        body = data[start:end + 1]
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if drop:
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        if not self.server.throttled:
+            self.wfile.write(body)
+            return
+        try:
+            for i in range(0, len(body), self.server.THROTTLE_CHUNK):
+                self.wfile.write(body[i:i + self.server.THROTTLE_CHUNK])
+                time.sleep(self.server.THROTTLE_DELAY)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+
+class XnatIoDownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInXnat()
+        threading.Thread(target = self.server.serve_forever,
+                         daemon = True).start()
+        self.xnatIo = Xnat.io(self.server.host, 'user', 'password')
+        self.xnatIo.SEGMENT_MIN_SIZE = 1024 * 1024
+        self.dstDir = tempfile.mkdtemp()
+        self.failures = []
+        self.xnatIo.onEvent('downloadFailed',
+                            lambda *args: self.failures.append(args))
+
+    def tearDown(self):
+        self.xnatIo.shutdown()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dstDir, ignore_errors = True)
+
+    def __download(self, path, segments, failing = False):
+        dst = os.path.join(self.dstDir, os.path.basename(path))
+        self.xnatIo.addToDownloadQueue(path, dst, segments)
+        self.xnatIo.startDownloadQueue()
+        if failing:
+            self.assertEqual(len(self.failures), 1)
+            self.assertFalse(os.path.exists(dst))
+            return
+        self.assertEqual(self.failures, [])
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), self.server.FILES[path])
+        self.assertFalse(os.path.exists(dst + self.xnatIo.PART_SUFFIX))
+        return [r for r in self.server.ranges if r[0] == path]
+
+    def test_largeFileInSegments(self):
+        path = '/data/archive/projects/P/resources/Slicer/files/big.mrb'
+        ranges = self.__download(path, 4)
+        #
+        # Four segments, plus the rest of the dropped one.
+        #
+        self.assertTrue(self.server.dropped)
+        self.assertEqual(len(ranges), 5)
+        self.assertEqual(sorted(set(start for p, start, end in ranges \
+                                    if start % (1024 * 1024) == 0)),
+                         [0, 1024 * 1024, 2 * 1024 * 1024, 3 * 1024 * 1024])
+        #
+        # The dropped range is asked again, from what was written of it.
+        #
+        retried = [r for r in ranges if r[1] >= StandInXnat.DROP_AT and \
+                   r[1] < 2 * 1024 * 1024]
+        self.assertEqual(len(retried), 2)
+        self.assertEqual(retried[1][2], 2 * 1024 * 1024 - 1)
+
+    def test_smallFileStreamed(self):
+        path = '/data/archive/projects/P/resources/Slicer/files/small.mrb'
+        self.assertEqual(self.__download(path, 4), [])
+
+    def test_largeFileWithoutSegments(self):
+        path = '/data/archive/projects/P/resources/Slicer/files/big.mrb'
+        self.assertEqual(self.__download(path, None), [])
+
+    def test_segmentsResumeStreamedPart(self):
+        path = '/data/archive/projects/P/resources/Slicer/files/big.mrb'
+        written = 1536 * 1024
+        partPath = os.path.join(self.dstDir, 'big.mrb') + \
+                   self.xnatIo.PART_SUFFIX
+        with open(partPath, 'wb') as f:
+            f.write(self.server.FILES[path][:written])
+        with open(partPath + '.json', 'w') as f:
+            json.dump({'url': Xnat.path.makeXnatUrl(self.xnatIo.host, path),
+                       'etag': '"v1"', 'lastModified': None,
+                       'bytes': written}, f)
+        #
+        # The streamed bytes are kept; the rest is split in segments.
+        #
+        ranges = self.__download(path, 4)
+        self.assertEqual(min(start for p, start, end in ranges), written)
+        self.assertEqual(len(set(start for p, start, end in ranges)), 4)
+
+    def test_failedSegmentStopsSiblings(self):
+        path = '/data/archive/projects/P/resources/Slicer/files/huge.mrb'
+        half = len(self.server.FILES[path]) // 2
+        partPath = os.path.join(self.dstDir, 'huge.mrb') + \
+                   self.xnatIo.PART_SUFFIX
+
+        #
+        # The first range fails for good, which stops the second well 
+        # before the server is done sending it.
+        #
+        self.server.failAt = 0
+        self.server.throttled = True
+        began = time.time()
+        self.__download(path, 2, failing = True)
+        self.assertLess(time.time() - began, 
+                        half / StandInXnat.THROTTLE_CHUNK * 
+                        StandInXnat.THROTTLE_DELAY)
+        with open(partPath + '.json') as f:
+            ranges = json.load(f)['ranges']
+        self.assertEqual(ranges[0], [0, half - 1, 0])
+        start, end, written = ranges[1]
+        self.assertEqual(start, half)
+        self.assertGreater(written, 0)
+        self.assertLess(written, half)
+
+        #
+        # The next download resumes the second range where it stopped.
+        #
+        self.failures = []
+        self.server.failAt = None
+        self.server.throttled = False
+        del self.server.ranges[:]
+        ranges = self.__download(path, 2)
+        self.assertEqual(sorted(start for p, start, end in ranges), 
+                         [0, half + written])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+__author__ = "Sunil Kumar (kumar.sunil.p@gmail.com)"
+__copyright__ = "Copyright 2014, Washington University in St. Louis"
+__credits__ = ["Sunil Kumar", "Steve Pieper", "Dan Marcus"]
+__license__ = "XNAT Software License Agreement " + \
+              "(see: http://xnat.org/about/license.php_)"
+__version__ = "2.1.1"
+__maintainer__ = "Rick Herrick"
+__email__ = "herrickr@mir.wustl.edu"
+__status__ = "Production"
+
+"""
+Stress test of a single Xnat.io shared by many threads.
+
+A local stand-in XNAT server answers session, listing and file requests,
+and expires the session token every so often.  Many threads then list
+folders, look up file sizes and invalidate the JSON cache through the same
+Xnat.io.  Every result must belong to the uri it was asked for, and no
+request may fail.
+
+Run it in Slicer's python (it needs Slicer's 'qt'):
+
+    Slicer --no-main-window --python-script xnatIoThreadingTest.py
+"""
+
+import os
+import sys
+import json
+import threading
+import unittest
+import http.server
+import concurrent.futures
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'XnatSlicerLib', 'ext', 'Xnat'))
+from Xnat import *
+
+
+
+class StandInXnat(http.server.ThreadingHTTPServer):
+    """
+    Answers just enough of the XNAT REST API for Xnat.io.  Every listing
+    tells where it came from, so crossed results can be spotted.  The
+    session token changes every TOKEN_LIFETIME requests.
+    """
+
+    TOKEN_LIFETIME = 50
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.daemon_threads = True
+        self.lock = threading.Lock()
+        self.token = None
+        self.tokenUses = 0
+        self.logins = 0
+        self.served = 0
+
+    @property
+    def host(self):
+        return 'http://127.0.0.1:%i'%(self.server_address[1])
+
+    @staticmethod
+    def fileSize(path):
+        """
+        @return: The size listed for the file at 'path'.
+        @rtype: integer
+        """
+        return sum(path.encode()) * 7 + len(path)
+
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def __send(self, status, body = b'', contentType = 'text/plain'):
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path.split('?')[0] != '/data/JSESSION':
+            return self.__send(404)
+        with self.server.lock:
+            self.server.logins += 1
+            self.server.token = 'TOKEN%i'%(self.server.logins)
+            self.server.tokenUses = 0
+            token = self.server.token
+        self.__send(200, token.encode())
+
+    def do_DELETE(self):
+        self.__send(200)
+
+    def do_GET(self):
+        #
+        # Token checks.  An expired token gets a 401, like XNAT.
+        #
+        with self.server.lock:
+            cookie = self.headers.get('Cookie', '')
+            if self.server.token and \
+               not 'JSESSIONID=' + self.server.token in cookie:
+                return self.__send(401)
+            self.server.tokenUses += 1
+            self.server.served += 1
+            if self.server.tokenUses >= self.server.TOKEN_LIFETIME:
+                self.server.token = 'EXPIRED'
+
+        path = self.path.split('?')[0]
+        for prefix in ['/data/archive', '/data']:
+            if path.startswith(prefix + '/'):
+                path = path[len(prefix):]
+                break
+        if path.endswith('/files'):
+            rows = [{'Name': name,
+                     'Size': str(StandInXnat.fileSize(path + '/' + name)),
+                     'URI': '/data' + path + '/' + name} \
+                    for name in ['1.dcm', '2.dcm', 'sub/1.dcm']]
+        else:
+            rows = [{'ID': path.rsplit('/', 1)[-1] + '_%i'%(i),
+                     'label': path, 'URI': '/data' + path + '/%i'%(i)} \
+                    for i in range(3)]
+        body = json.dumps({'ResultSet': {'Result': rows}}).encode()
+        self.__send(200, body, 'application/json')
+
+
+
+class XnatIoThreadingTest(unittest.TestCase):
+
+    THREADS = 16
+    ROUNDS = 25
+
+    def setUp(self):
+        self.server = StandInXnat()
+        threading.Thread(target = self.server.serve_forever,
+                         daemon = True).start()
+        self.xnatIo = Xnat.io(self.server.host, 'user', 'password')
+
+    def tearDown(self):
+        self.xnatIo.shutdown()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __work(self, worker):
+        """
+        The calls of one thread.  Each listing is checked against the uri
+        it was asked for.
+        """
+        for i in range(self.ROUNDS):
+            #
+            # Half of the uris are shared with other threads, so their
+            # requests get coalesced.
+            #
+            n = worker if i % 2 else i % 4
+            filesUri = '/projects/P/subjects/S%i/experiments/E%i/'%(n, i) + \
+                       'scans/1/resources/DICOM/files'
+            contents = self.xnatIo.getFolder(filesUri)
+            self.assertIsNotNone(contents, filesUri)
+            for row in contents:
+                self.assertIn(filesUri, row['URI'])
+                self.assertEqual(self.xnatIo.getFileSize(row['URI'])['bytes'],
+                                 int(row['Size']))
+
+            experimentsUri = '/projects/P/subjects/S%i/experiments'%(n)
+            contents = self.xnatIo.getFolder(experimentsUri,
+                                             metadata = ['label'])
+            self.assertIsNotNone(contents, experimentsUri)
+            self.assertEqual(set(contents['label']), set([experimentsUri]))
+
+            if i % 10 == worker % 10:
+                self.xnatIo.invalidateJsonCache(experimentsUri)
+
+    def test_sharedInstance(self):
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers = self.THREADS) as executor:
+            futures = [executor.submit(self.__work, worker) \
+                       for worker in range(self.THREADS)]
+            for future in futures:
+                future.result()
+
+        #
+        # Same-named files of different scans and folders keep their own
+        # sizes.
+        #
+        for n in range(self.THREADS):
+            for name in ['1.dcm', 'sub/1.dcm']:
+                uri = '/data/projects/P/subjects/S%i/experiments/E1/'%(n) + \
+                      'scans/1/resources/DICOM/files/' + name
+                self.assertIsNotNone(self.xnatIo.getTrackedFile(uri), uri)
+                self.assertEqual(self.xnatIo.getFileSize(uri)['bytes'],
+                                 StandInXnat.fileSize(uri[5:]))
+
+        #
+        # The token expired several times, but each expiry was renewed by
+        # one login only: every token but the last served its full 
+        # TOKEN_LIFETIME.
+        #
+        self.assertTrue(self.xnatIo.authenticated)
+        self.assertGreater(self.server.logins, 1)
+        self.assertLessEqual(self.server.logins, 1 + self.server.served // 
+                             StandInXnat.TOKEN_LIFETIME)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -57,6 +57,9 @@ from XnatSlicerUtils import *
 from SettingsFile import *
 from Timer import *
 from Error import *
+from MetadataStore import *
+from DownloadCache import *
+from DicomPathIndex import *
 
 # module - ui
 from Viewer import *
@@ -268,6 +271,8 @@ class XnatSlicerWidget:
       """
       self.__initSettingsFile()
       self.__initSettings()
+      self.__initDownloadCache()
+      self.__initDicomPathIndex()
       self.__initLoginMenu()
       self.__initSearchBar()
       self.__initView()
@@ -301,6 +306,34 @@ class XnatSlicerWidget:
                     XnatSlicerGlobals.LOCAL_URIS['settings'], self)
       
 
+    def __initDownloadCache(self):
+      """
+      """
+      try:
+        self.DownloadCache = DownloadCache()
+        self.Settings['CACHE'].setDownloadCache(self.DownloadCache)
+      except Exception as e:
+        print("Unable to open the download cache: %s"%(str(e)))
+        self.DownloadCache = None
+        
+
+
+    def __initDicomPathIndex(self):
+      """
+      """
+      try:
+        self.DicomPathIndex = DicomPathIndex()
+        #
+        # Build the index in the background before the first load needs it.
+        #
+        if slicer.dicomDatabase:
+          self.DicomPathIndex.sync(slicer.dicomDatabase)
+      except Exception as e:
+        print("Unable to open the DICOM path index: %s"%(str(e)))
+        self.DicomPathIndex = None
+
+
+
     def __initNodeDetails(self):
       """
       """
@@ -481,6 +514,8 @@ class XnatSlicerWidget:
         # Search Bar event.
         #
         self.SearchBar.connect(self.View.searchEntered)
+        self.SearchBar.connectTextEdited(self.View.searchAsYouType)
+        self.SearchBar.connectDebounced(self.View.searchDebounced)
 
 
 
@@ -562,8 +597,10 @@ class XnatSlicerWidget:
           return
         
         #--------------------
-        # Init XnatIo.
+        # Init XnatIo (stopping the previous one's request threads).
         #--------------------
+        if self.XnatIo:
+            self.XnatIo.shutdown()
         self.XnatIo = Xnat.io(\
         self.SettingsFile.getAddress(self.LoginMenu.hostDropdown.currentText), 
                     self.LoginMenu.usernameLine.text,
@@ -571,6 +608,15 @@ class XnatSlicerWidget:
 
         self.XnatIo.onEvent('jsonError', self.__jsonError)        
 
+        #--------------------
+        # Persist listings per host and user for warm starts.
+        #--------------------
+        try:
+            self.XnatIo.metadataStore = MetadataStore(self.XnatIo.host, 
+                                                      self.XnatIo.username)
+        except Exception as e:
+            print("Metadata store unavailable: %s"%(str(e)))
+
         #--------------------
         # Begin communicator
         #--------------------
@@ -1059,6 +1105,11 @@ class XnatSlicerWidget:
       """
       isFontChange = args and 'FONT_SIZE_CHANGED' in args
       isHostChange = args and self.Settings['HOSTS'].__class__.__name__ in args
+      #
+      # Metadata settings decide the columns (restoring the settings file
+      # may change them too).
+      #
+      isColumnChange = not args or 'MetadataEditorSetting' in args
 
       #MokaUtils.debug.lf(args[0])
       for key, Setting in self.Settings.items():
@@ -1069,6 +1120,8 @@ class XnatSlicerWidget:
         self.NodeDetails.updateFromSettings()
 
       if hasattr(self, 'View'):
+        if isColumnChange:
+          self.View.onColumnSettingsChanged()
         self.View.updateFromSettings()
 
       if hasattr(self, 'LoginMenu') and isHostChange: 
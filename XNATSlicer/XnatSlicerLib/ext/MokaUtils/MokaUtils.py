@@ -397,7 +397,7 @@ class MokaUtils(object):
 
 
         @staticmethod 
-        def extractAllFiles(fromFile, toDir):
+        def extractAllFiles(fromFile, toDir, onExtracted = None):
             """
             Extracts files within a zip and writes them to a directory,
             disregarding the directory structure within the zip file.
@@ -408,6 +408,10 @@ class MokaUtils(object):
             @param toDir: The dst directory of the file to decompress. 
                 Disregards the file structure in 'fromFile'.
             @type dst: string
+
+            @param onExtracted: Called with the path of each file once it 
+                has been written.
+            @type onExtracted: function
             """
             toDir = os.path.normpath(toDir)
 
@@ -427,8 +431,16 @@ class MokaUtils(object):
                         pass
 
                     dstFile = os.path.join(toDir, filename)
+                    #
+                    # Replace, rather than rewrite, existing files: they
+                    # may share their data with others through hardlinks.
+                    #
+                    if os.path.lexists(dstFile):
+                        os.remove(dstFile)
                     with open(dstFile, 'wb') as f:
                         shutil.copyfileobj(source, f)
+                    if onExtracted:
+                        onExtracted(dstFile)
 
 
 
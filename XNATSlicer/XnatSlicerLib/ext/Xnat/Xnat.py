@@ -14,8 +14,13 @@ import os
 import sys
 import base64
 import json
+import time
+import queue
 import requests
 import threading
+import collections
+import concurrent.futures
+import xml.sax.saxutils
 
 
 class Xnat(object):
@@ -94,7 +99,138 @@ class Xnat(object):
             'jsonError'
         ] 
 
-        def __init__(self, host, username, password):
+        #
+        # Default number of parallel transfers run by 'startDownloadQueue'.
+        #
+        MAX_CONCURRENT_DOWNLOADS = 4
+
+        #
+        # How often, in milliseconds, events raised on worker threads 
+        # outside of a download queue (e.g. the JSON errors of background
+        # listings) are run on the owner thread.
+        #
+        EVENT_INTERVAL = 100
+
+        #
+        # Global cap on simultaneous transfers across every Xnat.io
+        # instance, regardless of their individual settings.
+        #
+        GLOBAL_DOWNLOAD_LIMIT = 8
+
+        #
+        # The slots of GLOBAL_DOWNLOAD_LIMIT, shared by every instance.
+        #
+        __downloadSlots = threading.BoundedSemaphore(GLOBAL_DOWNLOAD_LIMIT)
+
+        #
+        # Suffix of in-progress downloads.  See '__getFile_requests'.  The
+        # sidecar of a '.part' file is rewritten once PART_STATE_BYTES more
+        # bytes or PART_STATE_INTERVAL seconds have passed since the last 
+        # write, and when the transfer stops.
+        #
+        PART_SUFFIX = '.part'
+        PART_STATE_BYTES = 16 * 1024 * 1024
+        PART_STATE_INTERVAL = 2.0
+
+        #
+        # Segmented downloads: files of at least SEGMENT_MIN_SIZE bytes are
+        # split into byte ranges fetched in parallel.  Each segment is 
+        # retried up to SEGMENT_RETRIES times.  See 'getFile'.
+        #
+        SEGMENT_MIN_SIZE = 64 * 1024 * 1024
+        SEGMENT_RETRIES = 3
+
+        #
+        # Endpoint that issues and invalidates session tokens.
+        #
+        JSESSION_URI = '/data/JSESSION'
+
+        #
+        # Number of threads of the shared REST request executor.
+        #
+        REQUEST_WORKERS = 8
+
+        #
+        # JSON response cache: at most JSON_CACHE_SIZE listings are kept 
+        # (least recently used evicted first).  Listings younger than 
+        # JSON_CACHE_TTL seconds are served without a request; older ones
+        # are revalidated with a conditional GET.  See 'getJsonAsync'.
+        #
+        JSON_CACHE_SIZE = 256
+        JSON_CACHE_TTL = 30
+
+        #
+        # Identical JSON GETs share one request: while it runs, and for 
+        # COALESCE_WINDOW seconds after it finishes, whatever its outcome.
+        # See 'getJsonAsync'.
+        #
+        COALESCE_WINDOW = 1.0
+
+        #
+        # How long (in seconds) a server search answers narrower searches 
+        # from the local index.  See 'search'.
+        #
+        SEARCH_TERM_TTL = 120
+
+        #
+        # The levels a server search can narrow locally.  Projects also 
+        # match on their PI, which XML search results don't carry, so they
+        # are always searched on the host.
+        #
+        LOCAL_SEARCH_LEVELS = ['subjects', 'experiments']
+
+        #
+        # The XML search of each level: the root element, the display 
+        # fields to return (as REST listing column, field ID) and the
+        # schema fields matched with 'LIKE'.  See '__searchXml'.
+        #
+        SEARCH_URI = '/data/search?format=json'
+        SEARCH_ELEMENTS = [
+            {'level': 'projects',
+             'element': 'xnat:projectData',
+             'fields': [('ID', 'ID'), ('secondary_ID', 'SECONDARY_ID'),
+                        ('name', 'NAME'), ('description', 'DESCRIPTION')],
+             'criteria': ['ID', 'secondary_ID', 'name', 'description', 
+                          'PI/firstname', 'PI/lastname']},
+            {'level': 'subjects',
+             'element': 'xnat:subjectData',
+             'fields': [('ID', 'SUBJECT_ID'), ('label', 'SUBJECT_LABEL'),
+                        ('project', 'PROJECT')],
+             'criteria': ['ID', 'label']},
+            {'level': 'experiments',
+             'element': 'xnat:mrSessionData',
+             'fields': [('ID', 'SESSION_ID'), ('label', 'LABEL'), 
+                        ('project', 'PROJECT'), ('date', 'DATE'),
+                        ('subject_ID', 'SUBJECT_ID'), 
+                        ('subject_label', 'SUBJECT_LABEL')],
+             'criteria': ['ID', 'label']},
+            {'level': 'experiments',
+             'element': 'xnat:petSessionData',
+             'fields': [('ID', 'SESSION_ID'), ('label', 'LABEL'), 
+                        ('project', 'PROJECT'), ('date', 'DATE'),
+                        ('subject_ID', 'SUBJECT_ID'), 
+                        ('subject_label', 'SUBJECT_LABEL')],
+             'criteria': ['ID', 'label']},
+        ]
+
+        #
+        # The experiment columns of a project hierarchy snapshot.  See 
+        # 'getProjectHierarchy'.
+        #
+        HIERARCHY_COLUMNS = ['ID', 'label', 'subject_ID', 'subject_label', 
+                             'xsiType', 'date', 'insert_date', 'project', 
+                             'URI']
+
+        #
+        # Listings of these levels are requested with a 'columns' query 
+        # argument made from the metadata asked of 'getFolder'.  Tags that
+        # aren't listing columns are left out of it.
+        #
+        PROJECTION_LEVELS = ['subjects', 'experiments']
+        PROJECTION_SKIP_TAGS = ['totalRecords']
+
+        def __init__(self, host, username, password, 
+                     maxConcurrentDownloads = None):
             """ 
             Initializes the internal variables. 
 
@@ -107,15 +243,41 @@ class Xnat(object):
 
             @param password: The password for the XNAT host.
             @type password: string        
+
+            @param maxConcurrentDownloads: The number of parallel transfers 
+                to run from the download queue.  Defaults to 
+                MAX_CONCURRENT_DOWNLOADS.
+            @type maxConcurrentDownloads: integer
             """
             
             self.downloadQueue = []        
+            self.__queueLock = threading.RLock()
+            self.maxConcurrentDownloads = maxConcurrentDownloads or \
+                                          self.MAX_CONCURRENT_DOWNLOADS
+            #
+            # Default number of byte-range segments per large file (1 = 
+            # off).  Loaders ask for segments per transfer, see 
+            # 'addToDownloadQueue'.
+            #
+            self.downloadSegments = 1
+
+
+            #-------------------
+            # Events raised by download workers are queued here and 
+            # run on the thread that owns this instance (the UI thread).
+            #-------------------
+            self.__ownerThread = threading.current_thread()
+            self.__pendingEvents = queue.Queue()
+            self.__eventTimer = qt.QTimer()
+            self.__eventTimer.setInterval(self.EVENT_INTERVAL)
+            self.__eventTimer.connect('timeout()', self.__runPendingEvents)
+            self.__eventTimer.start()
 
 
             #-------------------
             # Set relevant variables (all required)
             #-------------------
-            self.projectCache = None
+            self.__projectCache = None
             self.host = host if host.endswith('/') else host + '/'
             self.username = username
             self.password = password
@@ -124,12 +286,13 @@ class Xnat(object):
                 
 
             #-------------------
-            # Make tracking dictionary for download modal.
+            # Guards the indexes shared by every caller ('fileDict', 
+            # 'projectCache') and the event callback lists.
             #-------------------
-            self.downloadTracker = {
-                'totalDownloadSize': {'bytes': None, 'MB': None},
-                'downloadedSize': {'bytes': None, 'MB': None},
-            }
+            self.__stateLock = threading.RLock()
+            self.eventCallbacks__ = {}
+            for eventType in self.EVENT_TYPES:
+                self.eventCallbacks__[str(eventType)] = []
 
 
             #-------------------
@@ -140,8 +303,57 @@ class Xnat(object):
             self.auth = (self.username, self.password)
             self.session = requests.Session()
             self.session.auth = self.auth
-            self.fileDict = {}
-            self.response = None
+            self.__fileDict = {}
+
+
+            #-------------------
+            # Trade the credentials for a session token so the server 
+            # doesn't re-verify the password on every request.
+            #-------------------
+            self.__authLock = threading.Lock()
+            self.__jsessionId = None
+            self.__login()
+
+
+            #-------------------
+            # Long-lived executor that runs every REST call.  See 
+            # 'requestAsync' and 'getJsonAsync'.
+            #-------------------
+            self.__requestPool = concurrent.futures.ThreadPoolExecutor(
+                max_workers = self.REQUEST_WORKERS, 
+                thread_name_prefix = 'XnatIo')
+
+
+            #-------------------
+            # JSON response cache, keyed by user and normalized url.
+            #-------------------
+            self.__jsonCache = collections.OrderedDict()
+            self.__jsonCacheLock = threading.Lock()
+            self.__jsonCacheStats = {'hits': 0, 'misses': 0, 
+                                     'revalidated': 0, 'coalesced': 0, 
+                                     'reused': 0}
+            self.__flights = {}
+
+
+            #-------------------
+            # Optional persistent store of listings (see 'getFolder').  It 
+            # needs 'load(url)', 'save(url, result)' and 'invalidate(url)'.
+            #-------------------
+            self.metadataStore = None
+
+
+            #-------------------
+            # Local index of every listing and search result (see 
+            # 'searchLocal').  'search' remembers its terms for 
+            # SEARCH_TERM_TTL seconds: a later query containing one of them 
+            # can only match rows the earlier search already returned.
+            #-------------------
+            self.searchIndex = Xnat.index()
+            self.__xmlSearchSupported = True
+            self.__projectionSupported = True
+            self.__searchTerms = {}
+            self.__folderPool = concurrent.futures.ThreadPoolExecutor(
+                max_workers = 2, thread_name_prefix = 'XnatIoFolder')
 
             # Popups
             self.exceptionPopup = qt.QMessageBox()
@@ -150,7 +362,120 @@ class Xnat(object):
 
 
 
-        def getFolder(self, folderUris, metadata = None, queryArgs = None):   
+        @property
+        def projectCache(self):
+            """
+            The contents of the last 'projects' listing, or None.  Reset
+            (set to None) to force a refetch.
+            """
+            with self.__stateLock:
+                return self.__projectCache
+
+
+
+        @projectCache.setter
+        def projectCache(self, projectCache):
+            with self.__stateLock:
+                self.__projectCache = projectCache
+
+
+
+        @property
+        def authenticated(self):
+            """ 
+            Whether the host has accepted the credentials (i.e. issued a 
+            session token).
+            """
+            return self.__jsessionId is not None
+
+
+
+        @property
+        def fileDict(self):
+            """
+            A snapshot of the tracked files, keyed by their path below the
+            resource's 'files' folder (see 'Xnat.path.getFilesPath').  Each
+            key holds the files listed with that path, by their url.
+            """
+            with self.__stateLock:
+                return dict((key, dict(rows)) for key, rows in \
+                            self.__fileDict.items())
+
+
+
+        def getTrackedFile(self, _uri):
+            """ 
+            Returns the listing entry of a file seen by 'getFolder' or
+            'getExperimentFiles'.  Files of other resources can share the
+            path below their 'files' folder, so the entry listed under 
+            '_uri' is returned.
+
+            @param _uri: The file URI to look up.
+            @type _uri: string
+
+            @return: The file's metadata, or None if it isn't tracked.
+            @rtype: dict
+            """
+            with self.__stateLock:
+                rows = self.__fileDict.get(Xnat.path.getFilesPath(_uri), {})
+                trackedFile = rows.get(self.__getTrackedUrl(_uri))
+                if not trackedFile and None in rows and len(rows) == 1:
+                    #
+                    # Listings without URIs can't tell resources apart.
+                    #
+                    trackedFile = rows[None]
+                return trackedFile
+
+
+
+        def __getTrackedUrl(self, _uri):
+            """
+            @param _uri: A file URI.
+            @type _uri: string
+
+            @return: The url that 'fileDict' holds the file under.
+            @rtype: string
+            """
+            return Xnat.path.normalizeUrl(
+                Xnat.path.makeXnatUrl(self.host, _uri.split('?')[0]))
+
+
+
+        def __trackFile(self, fileRow):
+            """
+            Adds a row of a 'files' listing to 'fileDict'.  The caller holds
+            '__stateLock'.
+
+            @param fileRow: The row.
+            @type fileRow: dict
+            """
+            if 'URI' in fileRow:
+                key = Xnat.path.getFilesPath(fileRow['URI'])
+                url = self.__getTrackedUrl(fileRow['URI'])
+            else:
+                key, url = fileRow['Name'], None
+            self.__fileDict.setdefault(key, {})[url] = fileRow
+
+
+
+        @staticmethod
+        def makeDownloadTracker():
+            """ 
+            Returns a new size tracking dictionary for a single transfer.
+
+            @rtype: dict
+            """
+            return {
+                'totalDownloadSize': {'bytes': 0, 'MB': None},
+                'downloadedSize': {'bytes': 0, 'MB': None},
+            }
+
+
+
+
+        def getFolder(self, folderUris, metadata = None, queryArgs = None,
+                      fromStore = False, byUri = False, cancelToken = None,
+                      store = False):   
             """ 
             Returns the contents of a given folder provided in the arguments
             'folderUris'.  Returns an object based on the 'metadata' argument
@@ -160,6 +485,8 @@ class Xnat(object):
             For instance, to get projects only the user has access to, the URI 
             needs to be appended with '?accessible=True'.
 
+            All of the folders are requested at once.
+
             @param folderUris: A string or list of URIs to retrieve the 
                 contents from.
             @type folderUris: string | list.<string>
@@ -173,15 +500,33 @@ class Xnat(object):
                 See XNAT documentation for more details.  Default is no suffix. 
             @type queryArgs: string | list.<string>
 
+            @param fromStore: Read the contents from 'metadataStore' instead
+                of the host.  Returns None if any folder isn't stored.
+            @type fromStore: boolean
+
+            @param byUri: Return the contents of each folder separately, in
+                a dict keyed by the given 'folderUris'.  Default is the 
+                contents of all folders merged.
+            @type byUri: boolean
+
+            @param cancelToken: Set to abandon the requests (see 
+                'gatherJson').  The return is then None.
+            @type cancelToken: threading.Event
+
+            @param store: Keep the listings in 'metadataStore', for 
+                'fromStore' to read at a later login.  Only meant for the 
+                listings read that way.
+            @type store: boolean
+
+            Listings of the PROJECTION_LEVELS only return the 'metadata' 
+            columns (see '__projectColumns').  If the host rejects that, 
+            the full listings are requested instead, from then on.
+
             @return: A list of dicts describing the contents of the folders, 
                 with metadata as keys.
             @rtype: list.<dict>
             """
 
-            returnContents = {}
-
-
-
             #-------------------- 
             # Force the relevant argumets to lists
             #-------------------- 
@@ -193,44 +538,46 @@ class Xnat(object):
 
 
             #-------------------- 
-            # Acquire contents via 'self.__getJson'
+            # Acquire contents via 'self.gatherJson'
             #-------------------- 
-            contents = []
+            requestUris = []
+            projectedUris = []
             for folderUri in folderUris:
 
                 #
                 # Apply query arguments, if any.
                 #
+                requestUri = folderUri
                 if queryArgs:
-                    folderUri = Xnat.path.applyQueryArguments(folderUri, 
+                    requestUri = Xnat.path.applyQueryArguments(requestUri, 
                                                               queryArgs)
+                requestUri = Xnat.path.makeXnatUrl(self.host, requestUri)
+                requestUris.append(requestUri)
+                projectedUris.append(self.__projectColumns(requestUri, 
+                                Xnat.index.getLevel(folderUri), metadata))
 
 
-                #
-                # Get the JSON
-                #
-                folderUri = Xnat.path.makeXnatUrl(self.host, folderUri)
-                json = self.__getJson(folderUri)
-
-                #
-                # If json is null we have a login error.
-                # Return out.
-                #
-                if json == None:
-                    return None
-                #
-                # Otherwise, concatenate to rest of contents.
-                #
-                contents =  contents + json
+            #
+            # Get the JSON of every folder at once.
+            #
+            if fromStore:
+                jsons = [self.__getStoredJson(uri) for uri in projectedUris]
+            else:
+                jsons = self.__gatherProjected(projectedUris, requestUris, 
+                                               cancelToken)
+
+            #
+            # If any json is null we have a login error.
+            # Return out.
+            #
+            if None in jsons:
+                return None
+            if store and not fromStore:
+                self.__storeJson(folderUris, requestUris, metadata, jsons)
+            contents = []
+            for json in jsons:
+                contents.extend(json)
 
-                #
-                # If we want the projects, store projects in a dictionary. 
-                # 'self.projectCache' is reset if the user logs into a new 
-                # host or logs in a again.
-                #
-                if folderUri.endswith('/projects'):
-                    self.projectCache = contents
-                #print(f"CONTENTS {contents}")
             #-------------------- 
             # Exit out if there are non-Json or XML values.
             #-------------------- 
@@ -243,34 +590,26 @@ class Xnat(object):
             # Get other attributes with the contents 
             # for metadata tracking.
             #-------------------- 
-            for content in contents:
-                if metadata:
-                    for metadataTag in metadata:
-                        if metadataTag in content:
-                            #
-                            # Create the object attribute if not there.
-                            #
-                            if not metadataTag in returnContents:
-                                returnContents[metadataTag] = []
-                            returnContents[metadataTag].append(\
-                                                    content[metadataTag])
-                else:
-                    returnContents = contents
+            returnContents = self.__filterMetadata(contents, metadata)
+
 
 
             #-------------------- 
-            # Track projects and files in global dict
+            # Track projects and files in global dict.
+            # 'self.projectCache' is reset if the user logs into a new 
+            # host or logs in a again.
             #-------------------- 
-            for folderUri in folderUris:
-                folderUri = folderUri.replace('//', '/')
-                if folderUri.endswith('/files'):
-                    for content in contents:
-                        # create a tracker in the fileDict
-                        #print(f"\n\nCONTENT {content} {folderUri}")
-                        self.fileDict[content['Name']] = content
-                    #print("%s %s"%(, self.fileDict))
-                elif folderUri.endswith('/projects'):
-                    self.projectCache = returnContents
+            for folderUri, json in zip(folderUris, jsons):
+                self.searchIndex.add(Xnat.index.getLevel(folderUri), json)
+            with self.__stateLock:
+                for folderUri, json in zip(folderUris, jsons):
+                    folderUri = folderUri.replace('//', '/')
+                    if folderUri.endswith('/files'):
+                        for content in json:
+                            # create a tracker in the fileDict
+                            self.__trackFile(content)
+                    elif folderUri.endswith('/projects'):
+                        self.__projectCache = returnContents
 
 
 
@@ -278,12 +617,390 @@ class Xnat(object):
             # Return the contents of the folder as a
             # dictionary of lists
             #-------------------- 
+            if byUri:
+                return dict((folderUri, self.__filterMetadata(json, metadata)) 
+                            for folderUri, json in zip(folderUris, jsons))
+            return returnContents
+
+
+
+
+        def __filterMetadata(self, contents, metadata):
+            """ 
+            Regroups folder contents as lists per metadata tag.
+
+            @param contents: The 'ResultSet' 'Result' rows of a folder.
+            @type contents: list.<dict>
+
+            @param metadata: The metadata tags to keep.  Defaults to all of 
+                them, in which case 'contents' is returned as it is.
+            @type metadata: list.<string>
+
+            @return: The metadata lists, keyed by tag.
+            @rtype: dict
+            """
+            if not metadata:
+                return contents or {}
+            returnContents = {}
+            for content in contents:
+                for metadataTag in metadata:
+                    if metadataTag in content:
+                        #
+                        # Create the object attribute if not there.
+                        #
+                        if not metadataTag in returnContents:
+                            returnContents[metadataTag] = []
+                        returnContents[metadataTag].append(\
+                                                    content[metadataTag])
             return returnContents
 
 
 
 
-        def getFile(self, _src, _dst): 
+        def getFolderAsync(self, *args, **kwargs):
+            """ 
+            Runs 'getFolder' in the background.  Takes the same arguments.
+
+            @return: A future that resolves to the 'getFolder' result.
+            @rtype: concurrent.futures.Future
+            """
+            return self.__folderPool.submit(self.getFolder, *args, **kwargs)
+
+
+
+
+        def __projectColumns(self, url, level, metadata):
+            """ 
+            Adds a 'columns' query argument to a listing url, so that the 
+            listing only has the given metadata (plus what 'searchIndex' 
+            and the listing uris need).
+
+            @param url: The full XNAT url of the listing.
+            @type url: string
+
+            @param level: The XNAT level listed by the url.
+            @type level: string
+
+            @param metadata: The metadata tags wanted from the listing.
+                None for all of them.
+            @type metadata: list.<string>
+
+            @return: The url, projected if the level is one of the 
+                PROJECTION_LEVELS and the host accepts projections.
+            @rtype: string
+            """
+            if not metadata or not self.__projectionSupported or \
+               not level in self.PROJECTION_LEVELS or 'columns=' in url:
+                return url
+            columns = []
+            for tag in ['ID', 'URI'] + list(Xnat.index.SEARCH_TAGS[level]) + \
+                list(metadata):
+                if not tag in columns and \
+                   not tag in self.PROJECTION_SKIP_TAGS:
+                    columns.append(tag)
+            return url + ('&' if '?' in url else '?') + 'columns=' + \
+                ','.join(columns)
+
+
+
+
+        def __gatherProjected(self, projectedUris, requestUris, 
+                              cancelToken = None):
+            """ 
+            'gatherJson' for listings projected by '__projectColumns'.  A 
+            projected listing that fails is retried in full, by itself.  
+            Projection is only turned off for the session if the host 
+            rejected the 'columns' argument (HTTP 400) and the full listing
+            then succeeded: other failures (403, 404, timeouts...) don't
+            say anything about projections.
+
+            @param projectedUris: The uris to request.
+            @type projectedUris: list.<string>
+
+            @param requestUris: The same uris, unprojected.
+            @type requestUris: list.<string>
+
+            @param cancelToken: See 'gatherJson'.
+            @type cancelToken: threading.Event
+
+            @return: The JSON results, in the order of the uris.  Failed 
+                (or cancelled) entries are None.
+            @rtype: list.<list.<dict>>
+            """
+            futures = [self.getJsonAsync(uri) for uri in projectedUris]
+            if not self.__waitFutures(futures, cancelToken):
+                return [None] * len(futures)
+
+            jsons = []
+            for projectedUri, requestUri, future in zip(projectedUris, 
+                                                        requestUris, futures):
+                if projectedUri == requestUri or future.cancelled() or \
+                   future.exception() is None:
+                    jsons.append(self.__jsonResult(future))
+                    continue
+                print("Column projection failed: requesting the full " + 
+                      "listing instead.")
+                json = self.gatherJson([requestUri], cancelToken)[0]
+                response = getattr(future.exception(), 'response', None)
+                if json is not None and response is not None and \
+                   response.status_code == 400:
+                    print("'%s' doesn't support column projection."%(
+                        self.host))
+                    self.__projectionSupported = False
+                jsons.append(json)
+            return jsons
+
+
+
+
+        def getProjectHierarchy(self, projectId, cancelToken = None, 
+                                subjectMetadata = None, 
+                                experimentMetadata = None):
+            """ 
+            Returns the subjects of a project and the image experiments of 
+            every one of them, from two requests (the project's subjects and
+            all of its experiments) instead of one per subject.
+
+            @param projectId: The ID of the project.
+            @type projectId: string
+
+            @param cancelToken: Set to abandon the requests (see 
+                'gatherJson').
+            @type cancelToken: threading.Event
+
+            @param subjectMetadata: The metadata tags to get of the 
+                subjects.  Defaults to the default tags of the level.
+            @type subjectMetadata: list.<string>
+
+            @param experimentMetadata: The metadata tags to get of the 
+                experiments, besides the HIERARCHY_COLUMNS.  Defaults to the
+                default tags of the level.
+            @type experimentMetadata: list.<string>
+
+            The experiments listing is projected like those of 'getFolder'
+            (see '__projectColumns'), so it is retried in full if the 
+            projection fails.  If it can't be had at all, the project's 
+            subjects are listed on their own with 'getFolder', and 
+            'experiments' is None.
+
+            @return: None if the subjects couldn't be listed or the requests
+                were cancelled.  Otherwise a dict with 'subjects', the 
+                'getFolder' contents of the project's subjects, and 
+                'experiments', the 'getFolder' contents of each subject's 
+                experiments keyed by both the subject label and ID (or None).
+            @rtype: dict
+            """
+            subjectMetadata = subjectMetadata or \
+                              Xnat.metadata.getTagsByLevel('subjects')
+            experimentMetadata = experimentMetadata or \
+                                 Xnat.metadata.getTagsByLevel('experiments')
+            projectUri = '/projects/' + projectId
+            subjectsUrl = Xnat.path.makeXnatUrl(self.host, 
+                                                projectUri + '/subjects')
+            experimentColumns = list(self.HIERARCHY_COLUMNS) + \
+                [tag for tag in experimentMetadata \
+                 if not tag in self.HIERARCHY_COLUMNS and \
+                 not tag in self.PROJECTION_SKIP_TAGS]
+            experimentsUrl = Xnat.path.makeXnatUrl(self.host, 
+                Xnat.path.applyQueryArguments(projectUri + '/experiments', 
+                                              ['imagesonly']))
+            projectedUrls = [
+                self.__projectColumns(subjectsUrl, 'subjects', 
+                                      subjectMetadata),
+                self.__projectColumns(experimentsUrl, 'experiments', 
+                                      experimentColumns)]
+            jsons = self.__gatherProjected(projectedUrls, 
+                                           [subjectsUrl, experimentsUrl],
+                                           cancelToken)
+            if self.__isSet(cancelToken):
+                return None
+            if None in jsons:
+                #
+                # The subjects don't depend on the experiments: list them
+                # as usual (from the JSON cache, if they were had above).
+                #
+                print("Unable to get the hierarchy of '%s': listing its "%(
+                    projectId) + "subjects only.")
+                subjects = self.getFolder(projectUri + '/subjects', 
+                                          subjectMetadata, 
+                                          cancelToken = cancelToken)
+                if subjects == None:
+                    return None
+                return {'subjects': subjects, 'experiments': None}
+            subjects, experiments = jsons
+            self.searchIndex.add('subjects', subjects)
+            self.searchIndex.add('experiments', experiments)
+
+
+
+            #-------------------- 
+            # Group the experiments by subject.  Subjects without 
+            # experiments get an empty listing.
+            #-------------------- 
+            bySubject = {}
+            for subject in subjects:
+                bySubject[subject.get('ID')] = []
+            for experiment in experiments:
+                bySubject.setdefault(experiment.get('subject_ID'), []).\
+                    append(experiment)
+
+            hierarchy = {'subjects': self.__filterMetadata(subjects, 
+                                                           subjectMetadata),
+                         'experiments': {}}
+            labels = dict((subject.get('ID'), subject.get('label')) 
+                          for subject in subjects)
+            for experiment in experiments:
+                labels.setdefault(experiment.get('subject_ID'), 
+                                  experiment.get('subject_label'))
+            for subjectId, subjectExperiments in bySubject.items():
+                contents = self.__filterMetadata(subjectExperiments, 
+                                                 experimentMetadata)
+                hierarchy['experiments'][subjectId] = contents
+                if labels.get(subjectId):
+                    hierarchy['experiments'][labels[subjectId]] = contents
+            return hierarchy
+
+
+
+
+        def getExperimentFiles(self, experimentUri, cancelToken = None):
+            """ 
+            Lists the files of every scan of an experiment in one request 
+            ('scans/ALL/files').  If the host can't do that, the scans are 
+            listed and then all of their files at once.  The files are 
+            tracked like those listed by 'getFolder'.
+
+            @param experimentUri: The uri of the experiment.
+            @type experimentUri: string
+
+            @param cancelToken: Set to abandon the requests (see 
+                'gatherJson').
+            @type cancelToken: threading.Event
+
+            @return: The file listing rows of each scan with files, keyed by 
+                scan ID in scan order, or None if the listing failed.
+            @rtype: collections.OrderedDict
+            """
+            scansUri = experimentUri.rstrip('/') + '/scans'
+            #
+            # Failures aren't reported here: they fall back to the scans.
+            #
+            future = self.getJsonAsync(scansUri + '/ALL/files')
+            files = None
+            if self.__waitFutures([future], cancelToken):
+                try:
+                    files = future.result()
+                except Exception as e:
+                    print("Failed to list all scan files of '%s': %s"%(
+                        experimentUri, str(e)))
+
+            scanFiles = collections.OrderedDict()
+            if files != None:
+                for fileRow in files:
+                    fileUri = fileRow.get('URI', '')
+                    if '/scans/' in fileUri:
+                        scanId = fileUri.split('/scans/', 1)[1].split('/')[0]
+                        scanFiles.setdefault(scanId, []).append(fileRow)
+            else:
+                if self.__isSet(cancelToken):
+                    return None
+                scans = self.gatherJson([Xnat.path.makeXnatUrl(self.host, 
+                                                               scansUri)], 
+                                        cancelToken)[0]
+                if scans == None:
+                    return None
+                scanIds = [scan['ID'] for scan in scans if 'ID' in scan]
+                jsons = self.gatherJson([Xnat.path.makeXnatUrl(self.host, 
+                                    scansUri + '/' + scanId + '/files') \
+                                         for scanId in scanIds], cancelToken)
+                if None in jsons:
+                    return None
+                for scanId, json in zip(scanIds, jsons):
+                    if json:
+                        scanFiles[scanId] = json
+
+            with self.__stateLock:
+                for rows in scanFiles.values():
+                    for fileRow in rows:
+                        if 'Name' in fileRow:
+                            self.__trackFile(fileRow)
+            return scanFiles
+
+
+
+
+        def getProjectHierarchyAsync(self, *args, **kwargs):
+            """ 
+            Runs 'getProjectHierarchy' in the background.  Takes the same 
+            arguments.
+
+            @return: A future that resolves to the 'getProjectHierarchy' 
+                result.
+            @rtype: concurrent.futures.Future
+            """
+            return self.__folderPool.submit(self.getProjectHierarchy, 
+                                            *args, **kwargs)
+
+
+
+
+        def __getStoredJson(self, url):
+            """ 
+            Reads a listing from 'metadataStore'.
+
+            @param url: The full XNAT url of the listing.
+            @type url: string
+
+            @return: The stored listing, or None.
+            @rtype: list.<dict>
+            """
+            if not self.metadataStore:
+                return None
+            try:
+                return self.metadataStore.load(Xnat.path.normalizeUrl(
+                    Xnat.path.makeXnatUrl(self.host, 
+                                          Xnat.path.applyJsonFormat(url))))
+            except Exception as e:
+                print("Failed to read stored listing: %s"%(str(e)))
+
+
+
+
+        def __storeJson(self, folderUris, requestUris, metadata, jsons):
+            """ 
+            Writes listings to 'metadataStore' under the urls that 
+            '__getStoredJson' reads them from.  The urls are projected 
+            again, as the listings may have been had without projection.
+
+            @param folderUris: The listed folders.
+            @type folderUris: list.<string>
+
+            @param requestUris: The full XNAT urls of the listings.
+            @type requestUris: list.<string>
+
+            @param metadata: The metadata tags of the listings.
+            @type metadata: list.<string>
+
+            @param jsons: The listings.
+            @type jsons: list.<list.<dict>>
+            """
+            if not self.metadataStore:
+                return
+            for folderUri, requestUri, json in zip(folderUris, requestUris,
+                                                   jsons):
+                url = self.__projectColumns(requestUri, 
+                            Xnat.index.getLevel(folderUri), metadata)
+                try:
+                    self.metadataStore.save(Xnat.path.normalizeUrl(
+                        Xnat.path.makeXnatUrl(self.host, 
+                                    Xnat.path.applyJsonFormat(url))), json)
+                except Exception as e:
+                    print("Failed to store listing: %s"%(str(e)))
+
+
+
+
+        def getFile(self, _src, _dst, segments = None): 
             """ 
             Downloads a file from a given XNAT host.
 
@@ -292,21 +1009,36 @@ class Xnat(object):
 
             @param _dst: The local dst to download to.
             @type: string
+
+            @param segments: The number of byte ranges to fetch in parallel
+                for a file of known size (at least SEGMENT_MIN_SIZE bytes)
+                on a server that supports ranges.  Other files are streamed
+                as usual.  Defaults to 'self.downloadSegments'.
+            @type segments: integer
             """
 
             #--------------------
-            # Reset total size of downloads for all files
+            # Every transfer tracks its own sizes so that parallel
+            # downloads don't clobber each other's progress.
             #-------------------------
-            self.downloadTracker['totalDownloadSize']['bytes'] = 0
-            self.downloadTracker['downloadedSize']['bytes'] = 0
-            downloadFolders = []
+            tracker = self.makeDownloadTracker()
 
             #-------------------------
             # Remove existing dst files from their local URI
             #-------------------------
             if os.path.exists(_dst):
                 os.remove(_dst)
-            self.__getFile_requests(_src, _dst)
+
+            #-------------------------
+            # Segmented mode, if asked for and possible.
+            #-------------------------
+            segments = segments or self.downloadSegments
+            if segments > 1:
+                segmentable = self.__getSegmentableSize(_src)
+                if segmentable:
+                    return self.__getFile_segmented(_src, _dst, tracker, 
+                                                    segments, *segmentable)
+            self.__getFile_requests(_src, _dst, tracker)
 
 
 
@@ -364,11 +1096,11 @@ class Xnat(object):
             @rtype: integer
             """            
             totalBytes = 0
-            fileName = os.path.basename(_uri)
 
-            if fileName in self.fileDict:
+            trackedFile = self.getTrackedFile(_uri)
+            if trackedFile:
                 # Get size from fileDict log if it exists
-                totalBytes = int(self.fileDict[fileName]['Size'])
+                totalBytes = int(trackedFile['Size'])
             elif '/scans' in _uri:
                 # Add all files for scan if it is a scan uri
                 files = self.__getJson(_uri.replace('zip', 'json'))
@@ -398,6 +1130,7 @@ class Xnat(object):
             _dst = str(Xnat.path.cleanUri(_dst)).encode('ascii', 'ignore')
             #print(f"fXNAT 2 {_dst} \n\n")
             response = self.__httpsRequest('PUT', _dst)
+            self.invalidateJsonCache(_dst)
             return response
 
 
@@ -444,6 +1177,7 @@ class Xnat(object):
                 response = self.__httpsRequest('PUT', _dst, files={'file': f}, 
                     headers={'Content-Type': 'application/octet-stream'}, stream=True)
 
+            self.invalidateJsonCache(_dst)
             return response
 
 
@@ -457,6 +1191,7 @@ class Xnat(object):
             """
             print("Deleting '%s'"%(_uri))
             response =  self.__httpsRequest('DELETE', _uri, '')
+            self.invalidateJsonCache(_uri)
 
 
 
@@ -478,7 +1213,7 @@ class Xnat(object):
             #-------------------- 
             # Query logged files before checking
             #-------------------- 
-            if (os.path.basename(_uri) in self.fileDict):
+            if self.getTrackedFile(_uri):
                 return True
 
 
@@ -496,62 +1231,355 @@ class Xnat(object):
 
 
 
-        def search(self, searchString):
+        def searchAsync(self, searchString, cancelToken = None):
+            """ 
+            Runs 'search' in the background.
+
+            @param searchString: The search query string.
+            @type searchString: string
+
+            @param cancelToken: Set to abandon the search.  See 'search'.
+            @type cancelToken: threading.Event
+
+            @return: A future that resolves to the 'search' result.
+            @rtype: concurrent.futures.Future
+            """
+            return self.__folderPool.submit(self.search, searchString, 
+                                            cancelToken)
+
+
+
+
+        def search(self, searchString, cancelToken = None):
             """ 
             Utilizes the XNAT search query function
             on all three XNAT levels (projects, subjects and experiments) 
             based on the provided 'searchString' argument.  Searches through 
             the available columns as described below. CASE INSENSITIVE.
 
+            Each level is searched with a single XML search ('__searchXml').
+            Hosts that don't accept XML searches get one wildcard REST query
+            per column instead ('__searchRest').  Queries that contain the 
+            term of a recent search are answered from 'searchIndex' for 
+            LOCAL_SEARCH_LEVELS, and from the host for the other levels.
+
             @param searchString: The search query string.
             @type searchString: string
 
+            @param cancelToken: Set to abandon the search: requests that 
+                haven't started are cancelled, and responses still in 
+                flight are ignored.
+            @type cancelToken: threading.Event
+
             @return: A dictionary of the results where the key is the XNAT 
-                level (projec, subject or experiment).
+                level (projec, subject or experiment).  None if the search 
+                was cancelled.
             @rtype: dict.<string, string>
             """
-            resultsDict = {}
+            levels = ['projects', 'subjects', 'experiments']
 
 
 
             #-------------------- 
-            # Projects, subjects, experiments
+            # Answer locally if a recent search covers this one.
             #-------------------- 
-            levelTags = {}
-            levelTags['projects'] = ['ID', 
-                                     'secondary_ID',
-                                     'name', 'pi_firstname', 
-                                     'pi_lastname', 
-                                     'description']
-            levelTags['subjects'] = ['ID', 'label']
-            levelTags['experiments'] = ['ID', 'label']
+            localResults = self.__searchCovered(searchString, 
+                                                self.LOCAL_SEARCH_LEVELS)
+            hostLevels = levels if localResults is None else \
+                         [level for level in levels \
+                          if level not in self.LOCAL_SEARCH_LEVELS]
 
 
 
             #-------------------- 
-            # Looping through all of the levels,
-            # constructing a searchQuery for each based
-            # on the relevant columns.
-            #--------------------       
-            levels = ['projects', 'subjects', 'experiments']
-            for level in levels:
-                resultsDict[level] = []
-                for levelTag in levelTags[level]:
-                    searchStr = '/%s?%s=*%s*'%(level, levelTag, searchString)
-                    #
-                    # Experiments: only search folders with images
-                    #
-                    if level == 'experiments':
-                        searchStr2 = searchStr + '&xsiType=xnat:mrSessionData'
-                        searchStr = searchStr + '&xsiType=xnat:petSessionData'
-                        resultsDict[level] = resultsDict[level] + \
-                                             self.__getJson(searchStr2)
-                    resultsDict[level] = resultsDict[level] + \
-                                         self.__getJson(searchStr)
-
+            # Query the host.
+            #-------------------- 
+            resultsDict = None
+            complete = False
+            if self.__xmlSearchSupported:
+                resultsDict = self.__searchXml(searchString, hostLevels, 
+                                               cancelToken)
+                complete = resultsDict is not None
+            if resultsDict is None and not self.__isSet(cancelToken):
+                resultsDict, complete = self.__searchRest(searchString, 
+                                                          hostLevels, 
+                                                          cancelToken)
+            if self.__isSet(cancelToken):
+                return None
 
 
-            return resultsDict
+
+            #-------------------- 
+            # Index the results.  Only remember the term if every
+            # query succeeded.
+            #-------------------- 
+            for level, result in resultsDict.items():
+                self.searchIndex.add(level, result)
+            if complete:
+                with self.__stateLock:
+                    self.__searchTerms[searchString.strip().lower()] = \
+                                                                time.time()
+
+            if localResults is not None:
+                resultsDict.update(localResults)
+            return resultsDict
+
+
+
+
+        def __searchXml(self, searchString, levels, cancelToken = None):
+            """ 
+            Searches the elements of SEARCH_ELEMENTS at 'levels' with one 
+            'xdat:search' request each, all sent at once.  The columns of a level are 
+            OR'ed together with 'LIKE' criteria.  Marks the host as not
+            supporting XML searches if it rejects them.
+
+            @param searchString: The search query string.
+            @type searchString: string
+
+            @param levels: The levels to search.
+            @type levels: list.<string>
+
+            @param cancelToken: See 'search'.
+            @type cancelToken: threading.Event
+
+            @return: The results by level, in the shape of the REST 
+                listings, or None if the search failed or was cancelled.
+            @rtype: dict.<string, list.<dict>>
+            """
+            elements = [element for element in self.SEARCH_ELEMENTS \
+                        if element['level'] in levels]
+            futures = []
+            for element in elements:
+                futures.append(self.requestAsync('POST', self.SEARCH_URI, 
+                        body = self.__makeSearchXml(element, searchString),
+                        headers = {'Content-Type': 'text/xml'}))
+            if not self.__waitFutures(futures, cancelToken):
+                return None
+
+            resultsDict = dict((element['level'], []) for element \
+                               in elements)
+            for element, future in zip(elements, futures):
+                try:
+                    r = future.result()
+                except Exception as e:
+                    print("XML search failed: %s"%(str(e)))
+                    return None
+                try:
+                    if r.status_code != 200:
+                        raise ValueError("HTTP %i"%(r.status_code))
+                    rows = r.json()['ResultSet']['Result']
+                except Exception as e:
+                    print("XML search not supported by '%s' (%s). "%(
+                        self.host, str(e)) + "Using REST queries.")
+                    self.__xmlSearchSupported = False
+                    return None
+                for row in rows:
+                    resultsDict[element['level']].append(
+                        self.__mapSearchRow(element, row))
+            return resultsDict
+
+
+
+
+        def __makeSearchXml(self, element, searchString):
+            """ 
+            Compiles an 'xdat:search' for one of SEARCH_ELEMENTS.
+
+            @param element: The SEARCH_ELEMENTS entry.
+            @type element: dict
+
+            @param searchString: The search query string.
+            @type searchString: string
+
+            @return: The XML of the search.
+            @rtype: string
+            """
+            rootElement = element['element']
+            value = xml.sax.saxutils.escape('%' + searchString.strip() + '%')
+            searchXml = '<?xml version="1.0" encoding="UTF-8"?>\n' + \
+                '<xdat:search allow-diff-columns="0" secure="false" ' + \
+                'brief-description="XNATSlicer search" ' + \
+                'xmlns:xdat="http://nrg.wustl.edu/security" ' + \
+                'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n' + \
+                '<xdat:root_element_name>%s</xdat:root_element_name>\n'%(
+                    rootElement)
+            for sequence, (key, fieldId) in enumerate(element['fields']):
+                searchXml += '<xdat:search_field>' + \
+                    '<xdat:element_name>%s</xdat:element_name>'%(
+                        rootElement) + \
+                    '<xdat:field_ID>%s</xdat:field_ID>'%(fieldId) + \
+                    '<xdat:sequence>%i</xdat:sequence>'%(sequence) + \
+                    '<xdat:type>string</xdat:type>' + \
+                    '<xdat:header>%s</xdat:header>'%(key) + \
+                    '</xdat:search_field>\n'
+            searchXml += '<xdat:search_where method="OR">\n'
+            for schemaField in element['criteria']:
+                searchXml += '<xdat:criteria override_value_formatting="0">' + \
+                    '<xdat:schema_field>%s/%s</xdat:schema_field>'%(
+                        rootElement, schemaField) + \
+                    '<xdat:comparison_type>LIKE</xdat:comparison_type>' + \
+                    '<xdat:value>%s</xdat:value>'%(value) + \
+                    '</xdat:criteria>\n'
+            searchXml += '</xdat:search_where>\n</xdat:search>'
+            return searchXml
+
+
+
+
+        def __mapSearchRow(self, element, row):
+            """ 
+            Renames the columns of an XML search result row to those of the 
+            REST listings (e.g. 'subject_label'), and adds 'xsiType' and 
+            'URI'.
+
+            @param element: The SEARCH_ELEMENTS entry searched.
+            @type element: dict
+
+            @param row: The search result row.
+            @type row: dict
+
+            @return: The row as a REST listing would have it.
+            @rtype: dict
+            """
+            mapped = {}
+            for key, fieldId in element['fields']:
+                for column in (fieldId.lower(), key, key.lower()):
+                    if column in row:
+                        mapped[key] = row[column]
+                        break
+            mapped['xsiType'] = element['element']
+            mapped['URI'] = '/data/%s/%s'%(element['level'], 
+                                           mapped.get('ID', ''))
+            return mapped
+
+
+
+
+        def __searchRest(self, searchString, levels, cancelToken = None):
+            """ 
+            Searches with one wildcard REST query per column of each level, 
+            all sent at once.
+
+            @param searchString: The search query string.
+            @type searchString: string
+
+            @param levels: The levels to search.
+            @type levels: list.<string>
+
+            @param cancelToken: See 'search'.
+            @type cancelToken: threading.Event
+
+            @return: The results by level, and whether every query 
+                succeeded.
+            @rtype: tuple
+            """
+            resultsDict = {}
+
+
+
+            #-------------------- 
+            # Projects, subjects, experiments
+            #-------------------- 
+            levelTags = {}
+            levelTags['projects'] = ['ID', 
+                                     'secondary_ID',
+                                     'name', 'pi_firstname', 
+                                     'pi_lastname', 
+                                     'description']
+            levelTags['subjects'] = ['ID', 'label']
+            levelTags['experiments'] = ['ID', 'label']
+
+
+
+            #-------------------- 
+            # Looping through all of the levels,
+            # constructing a searchQuery for each based
+            # on the relevant columns.
+            #--------------------       
+            searchStrs = []
+            for level in levels:
+                for levelTag in levelTags[level]:
+                    searchStr = '/%s?%s=*%s*'%(level, levelTag, searchString)
+                    #
+                    # Experiments: only search folders with images
+                    #
+                    if level == 'experiments':
+                        searchStrs.append((level, searchStr + 
+                                           '&xsiType=xnat:mrSessionData'))
+                        searchStr = searchStr + '&xsiType=xnat:petSessionData'
+                    searchStrs.append((level, searchStr))
+
+
+
+            #-------------------- 
+            # Run all of the queries at once, then gather them by level.
+            #-------------------- 
+            results = self.gatherJson([searchStr for level, searchStr \
+                                       in searchStrs], cancelToken)
+            for level in levels:
+                resultsDict[level] = []
+            for (level, searchStr), result in zip(searchStrs, results):
+                if result:
+                    resultsDict[level].extend(result)
+
+
+
+            return resultsDict, None not in results
+
+
+
+
+        def searchLocal(self, searchString):
+            """ 
+            Searches 'searchIndex', i.e. all of the metadata retrieved so 
+            far, without querying the host.  CASE INSENSITIVE.
+
+            @param searchString: The search query string.
+            @type searchString: string
+
+            @return: A dictionary of the results where the key is the XNAT 
+                level (projects, subjects, experiments, scans or files).
+            @rtype: dict.<string, list.<dict>>
+            """
+            return self.searchIndex.query(searchString)
+
+
+
+
+        def __searchCovered(self, searchString, levels):
+            """ 
+            Answers a search from 'searchIndex' if a search for a substring 
+            of it ran within SEARCH_TERM_TTL seconds (every match of the new
+            query is a match of the earlier one).
+
+            @return: The results by level, or None if the host must be 
+                queried.
+            @rtype: dict.<string, list.<dict>>
+            """
+            searchString = searchString.strip().lower()
+            now = time.time()
+            with self.__stateLock:
+                covered = any(term in searchString for term, searched \
+                              in self.__searchTerms.items() \
+                              if now - searched < self.SEARCH_TERM_TTL)
+            if not covered:
+                return None
+
+            resultsDict = self.searchIndex.query(searchString, levels)
+            #
+            # Rows only seen in listings lack the parent columns that 
+            # search results carry.
+            #
+            requiredTags = {'subjects': ['project'], 
+                            'experiments': ['project', 'subject_ID', 
+                                            'subject_label']}
+            for level, rows in resultsDict.items():
+                for row in rows:
+                    for tag in requiredTags.get(level, []):
+                        if tag not in row:
+                            return None
+            return resultsDict
 
 
 
@@ -572,18 +1600,10 @@ class Xnat(object):
             @raise: Error if 'eventKey' argument is not a valid event type.
             """
 
-            #-------------------- 
-            # Construct callback dict if it doesn't exist.
-            #--------------------
-            if not hasattr(self, 'eventCallbacks__'):
-                self.eventCallbacks__ = {}
-                for eventType in self.EVENT_TYPES:
-                    self.eventCallbacks__[str(eventType)] = []
-
-
             if not eventKey in self.EVENT_TYPES:
                 raise Exception("Xnat.io (onEvent): invalid event type '%s'"%(eventKey))
-            self.eventCallbacks__[eventKey].append(callback)
+            with self.__stateLock:
+                self.eventCallbacks__[eventKey].append(callback)
 
 
 
@@ -608,11 +1628,10 @@ class Xnat(object):
             if not event in self.EVENT_TYPES:
                 raise Exception("XnatIo (onEvent): invalid event type '%s'"%(\
                                                                     event))
-            if not hasattr(self, 'eventCallbacks__'):
-                print('self has no attribute eventCallbacks__')
-                return
+            with self.__stateLock:
+                callbacks = list(self.eventCallbacks__[event])
 
-            for callback in self.eventCallbacks__[event]:
+            for callback in callbacks:
                 #print(f"EVENT CALLBACK {event}")
                 callback(*args)
 
@@ -629,8 +1648,9 @@ class Xnat(object):
             @type eventKey: string
             """
             if not eventKey:
-                for key in self.eventCallbacks__:
-                    self.eventCallbacks__[key] = []
+                with self.__stateLock:
+                    for key in self.eventCallbacks__:
+                        self.eventCallbacks__[key] = []
                 return
 
             if not eventKey in self.EVENT_TYPES:
@@ -638,12 +1658,13 @@ class Xnat(object):
                                             self.__class__.__name__, eventKey))
 
             else:
-                self.eventCallbacks__[eventKey] = []
+                with self.__stateLock:
+                    self.eventCallbacks__[eventKey] = []
 
 
 
 
-        def addToDownloadQueue(self, _src, _dst):
+        def addToDownloadQueue(self, _src, _dst, segments = None):
             """
             Adds a file to the download queue.
 
@@ -652,8 +1673,14 @@ class Xnat(object):
 
             @param _dst: The local dst to download to.
             @type: string
+
+            @param segments: The number of byte ranges to fetch the file in
+                (see 'getFile').  Defaults to 'self.downloadSegments'.
+            @type segments: integer
             """
-            self.downloadQueue.append({'src': _src, 'dst': _dst})
+            with self.__queueLock:
+                self.downloadQueue.append({'src': _src, 'dst': _dst, 
+                                           'segments': segments})
 
 
 
@@ -662,7 +1689,8 @@ class Xnat(object):
             Clears the download queue.
             """
             #print("CLEAR DOWNLOAD QUEUE")
-            self.downloadQueue = []
+            with self.__queueLock:
+                self.downloadQueue = []
             self.clearEvents()
 
 
@@ -671,19 +1699,132 @@ class Xnat(object):
         def startDownloadQueue(self):
             """
             Begins the the download queue.
+
+            Up to 'self.maxConcurrentDownloads' transfers run in parallel
+            on worker threads (further bounded by GLOBAL_DOWNLOAD_LIMIT).
+            This method blocks until every transfer has finished, failed or
+            been cancelled, running the per-transfer event callbacks on the
+            calling thread as they arrive.
             """
 
-            self.runEventCallbacks('downloadQueueStarted') 
-            while len(self.downloadQueue):
-                if self.downloadQueue[0]['dst'] != None:
-                    self.getFile(self.downloadQueue[0]['src'], 
-                                 self.downloadQueue[0]['dst'])
-            self.runEventCallbacks('downloadQueueFinished') 
+            self.runEventCallbacks('downloadQueueStarted')
+            with self.__queueLock:
+                transfers = [dl for dl in self.downloadQueue \
+                             if dl['dst'] != None]
+
+            if len(transfers):
+                workerCount = min(self.maxConcurrentDownloads, len(transfers))
+                with concurrent.futures.ThreadPoolExecutor(
+                        max_workers = workerCount) as executor:
+                    futures = [executor.submit(self.__runTransfer,
+                                               dl['src'], dl['dst'], 
+                                               dl.get('segments')) \
+                               for dl in transfers]
+                    self.__pumpEvents(futures)
+
+            self.runEventCallbacks('downloadQueueFinished')
             self.clearDownloadQueue()
 
 
 
 
+        def __runTransfer(self, _src, _dst, segments = None):
+            """
+            Worker-thread body of a single queued transfer.  Holds one of
+            the global download slots for the duration of the transfer.
+
+            @param _src: The source XNAT URL to download from.
+            @type: string
+
+            @param _dst: The local dst to download to.
+            @type: string
+
+            @param segments: See 'getFile'.
+            @type segments: integer
+            """
+            with self.__downloadSlots:
+                #
+                # Skip transfers cancelled while waiting for a slot.
+                #
+                if not self.inDownloadQueue(_src):
+                    return
+                try:
+                    self.getFile(_src, _dst, segments)
+                except Exception as e:
+                    self.removeFromDownloadQueue(_src)
+                    print("\nFailed to download '%s'.  Error: %s"%(_src,
+                                                                  str(e)))
+                    self.__emit('downloadFailed', _src, _dst, str(e))
+
+
+
+
+        def __emit(self, event, *args):
+            """
+            Runs the callbacks of 'event' immediately when called from the
+            thread that owns this instance, otherwise queues the event to be
+            run by '__pumpEvents', or by '__runPendingEvents' when no 
+            download queue is running.  Callbacks are usually UI updates, 
+            which must not run on worker threads.
+
+            @param event: The event descriptor.  Refer to self.EVENT_TYPES.
+            @type event: string
+
+            @param *args: The arguments of the event callbacks.
+            """
+            if threading.current_thread() is self.__ownerThread:
+                self.runEventCallbacks(event, *args)
+            else:
+                self.__pendingEvents.put((event, args))
+
+
+
+
+        def __pumpEvents(self, futures, interval = 0.05):
+            """
+            Runs the events queued by download workers until all of the
+            provided futures are done.  Keeps the Qt event loop alive while
+            the workers are waiting on the network.
+
+            @param futures: The transfer futures to wait on.
+            @type futures: list.<concurrent.futures.Future>
+
+            @param interval: The maximum time in seconds to wait for an event
+                before processing Qt events.
+            @type interval: float
+            """
+            while True:
+                allDone = all(future.done() for future in futures)
+                try:
+                    event, args = self.__pendingEvents.get(
+                        timeout = 0 if allDone else interval)
+                except queue.Empty:
+                    if allDone:
+                        return
+                    qt.QApplication.processEvents()
+                    continue
+                self.runEventCallbacks(event, *args)
+
+
+
+
+        def __runPendingEvents(self):
+            """
+            Runs the events queued by worker threads so far.  Called on the
+            owner thread every EVENT_INTERVAL milliseconds, so that events
+            raised by background requests are run as they come rather than 
+            with the next download queue.
+            """
+            while True:
+                try:
+                    event, args = self.__pendingEvents.get_nowait()
+                except queue.Empty:
+                    return
+                self.runEventCallbacks(event, *args)
+
+
+
+
 
         def inDownloadQueue(self, _src):
             """
@@ -696,9 +1837,10 @@ class Xnat(object):
             @return: boolean
             @rtype: string
             """
-            for dl in self.downloadQueue:
-                if _src in dl['src']:
-                    return True
+            with self.__queueLock:
+                for dl in self.downloadQueue:
+                    if _src in dl['src']:
+                        return True
             return False
 
 
@@ -711,10 +1853,11 @@ class Xnat(object):
             @param _src: The source XNAT URL to remove from the download queue.
             @type: string
             """
-            for dl in self.downloadQueue:
-                if _src in dl['src']:
-                    self.downloadQueue.pop(self.downloadQueue.index(dl))
-                    return
+            with self.__queueLock:
+                for dl in self.downloadQueue:
+                    if _src in dl['src']:
+                        self.downloadQueue.remove(dl)
+                        return
 
 
 
@@ -746,16 +1889,21 @@ class Xnat(object):
             # Clear queue if there is nothing
             # left in it.
             #-------------------- 
-            if len(self.downloadQueue) == 0:
+            with self.__queueLock:
+                queueEmpty = len(self.downloadQueue) == 0
+            if queueEmpty:
                 self.clearDownloadQueue()
 
 
 
 
 
-        def __httpsRequest(self, method, _uri, body='', files=None, headers={}, stream=False):
+        def requestAsync(self, method, _uri, body='', files=None, headers={}, 
+                         stream=False):
             """ 
-            Makes httpsRequests to an XNAT host.
+            Non-blocking counterpart of '__httpsRequest'.  Schedules the 
+            request on the long-lived request executor and returns 
+            immediately.
 
             @param method: The request method to run ('GET', 'PUT', 'POST', 
                 'DELETE').
@@ -768,9 +1916,13 @@ class Xnat(object):
                 empty string.
             @type: string
 
-            @param headerAdditions: The additional header dictionary to add 
+            @param headers: The additional header dictionary to add 
                 to the request.
             @type: dict
+
+            @return: A future that resolves to the requests.Response, or 
+                raises the exception of the failed request.
+            @rtype: concurrent.futures.Future
             """
 
             #-------------------- 
@@ -781,31 +1933,560 @@ class Xnat(object):
             if (body):
                 print(body)
 
-            #-------------------- 
-            # Conduct REST call
-            #-------------------- 
-            # self.__requests_worker(method, url, body, files, headers, stream)
-            t = threading.Thread(
-                target=self.__requests_worker, 
-                args=(method, url, body, files, headers, stream,))
-            t.start()
-            t.join()
-                
-            return self.response
+            return self.__requestPool.submit(self.__requests_worker, method, 
+                                             url, body, files, headers, stream)
+
+
+
+
+        def getJsonAsync(self, _uri):
+            """ 
+            Non-blocking counterpart of '__getJson'.
+
+            @param _uri: The xnat uri to retrieve the JSON object from.
+            @type _uri: string
+
+            Listings fetched less than JSON_CACHE_TTL seconds ago are 
+            returned from the response cache without touching the network.
+            A request for a listing that is already being fetched, or whose
+            fetch finished less than COALESCE_WINDOW seconds ago, shares 
+            that fetch (and its parse) instead of making another one.
+
+            @return: A future that resolves to the 'ResultSet' 'Result' list
+                of the JSON response.  If the response cannot be read as 
+                JSON, the future raises an exception with the offending 
+                response attached as its 'response' attribute.
+            @rtype: concurrent.futures.Future
+            """
+            xnatUrl = Xnat.path.makeXnatUrl(self.host, 
+                                            Xnat.path.applyJsonFormat(_uri))
+            cached = self.__getCachedJson(xnatUrl, fresh = True)
+            if cached is not None:
+                future = concurrent.futures.Future()
+                future.set_result(cached)
+                return future
+
+            key = (self.username, Xnat.path.normalizeUrl(xnatUrl))
+            with self.__jsonCacheLock:
+                flight = self.__flights.get(key)
+                if flight and flight['finished'] and \
+                   time.time() - flight['finished'] > self.COALESCE_WINDOW:
+                    flight = None
+                leader = flight is None
+                if leader:
+                    print(f"GET XNAT URL: {xnatUrl}")
+                    flight = {'future': self.__requestPool.submit(
+                        self.__json_worker, xnatUrl), 'finished': None}
+                    self.__flights[key] = flight
+                else:
+                    self.__jsonCacheStats['reused' if flight['finished'] \
+                                          else 'coalesced'] += 1
+
+            #
+            # Outside of the lock: the callback runs at once if the fetch
+            # is already done, and '__landFlight' takes the lock.
+            #
+            if leader:
+                flight['future'].add_done_callback(
+                    lambda future: self.__landFlight(key, flight))
+                return flight['future']
+            return self.__joinFlight(flight['future'], xnatUrl)
+
+
+
+
+        def __landFlight(self, key, flight):
+            """ 
+            Marks a shared JSON fetch (see 'getJsonAsync') as finished, and 
+            forgets the fetches whose COALESCE_WINDOW has passed.  Cancelled
+            fetches are forgotten at once.
+
+            @param key: The user and normalized url of the fetch.
+            @type key: tuple
+
+            @param flight: The fetch.
+            @type flight: dict
+            """
+            with self.__jsonCacheLock:
+                now = time.time()
+                flight['finished'] = now
+                if flight['future'].cancelled() and \
+                   self.__flights.get(key) is flight:
+                    del self.__flights[key]
+                for otherKey, other in list(self.__flights.items()):
+                    if other['finished'] and \
+                       now - other['finished'] > self.COALESCE_WINDOW:
+                        del self.__flights[otherKey]
+
+
+
+
+        def __joinFlight(self, future, xnatUrl):
+            """ 
+            Returns a future that resolves to a copy of the rows of a shared
+            JSON fetch, so that callers can't alter each other's results.  
+            If the shared fetch gets cancelled by the caller that started 
+            it, the listing is fetched again.
+
+            @param future: The future of the shared fetch.
+            @type future: concurrent.futures.Future
+
+            @param xnatUrl: The full XNAT url of the listing.
+            @type xnatUrl: string
+
+            @rtype: concurrent.futures.Future
+            """
+            joined = concurrent.futures.Future()
+            def onDone(future):
+                if joined.cancelled():
+                    return
+                if future.cancelled():
+                    self.getJsonAsync(xnatUrl).add_done_callback(onDone)
+                    return
+                #
+                # From here on the joined future can't be cancelled.
+                #
+                if not joined.set_running_or_notify_cancel():
+                    return
+                try:
+                    result = future.result()
+                except Exception as e:
+                    joined.set_exception(e)
+                    return
+                joined.set_result([dict(row) for row in result])
+            future.add_done_callback(onDone)
+            return joined
+
+
+        def invalidateJsonCache(self, _uri = None):
+            """ 
+            Drops cached JSON listings affected by a change to '_uri': the 
+            listings of '_uri' itself, of anything beneath it, and of its 
+            parent folders, in memory and in 'metadataStore'.  The rows 
+            beneath '_uri' leave 'searchIndex', and searches go back to the 
+            host.  Called by 'putFile', 'putFolder' and 'delete'.
+
+            @param _uri: The XNAT uri that changed.  Defaults to None, which
+                clears the entire cache.
+            @type _uri: string
+            """
+            changed = None
+            if _uri is not None:
+                changed = Xnat.path.normalizeUrl(
+                    Xnat.path.makeXnatUrl(self.host, _uri)).split('?')[0]
+            self.searchIndex.discard(changed)
+            with self.__stateLock:
+                self.__searchTerms.clear()
+            if self.metadataStore:
+                try:
+                    self.metadataStore.invalidate(changed)
+                except Exception as e:
+                    print("Failed to invalidate stored listings: %s"%(str(e)))
+
+            with self.__jsonCacheLock:
+                #
+                # Fetches started before the change may have missed it.
+                #
+                self.__flights.clear()
+                if changed is None:
+                    self.__jsonCache.clear()
+                    return
+                for key in list(self.__jsonCache):
+                    cachedPath = key[1].split('?')[0]
+                    if changed.startswith(cachedPath) or \
+                       cachedPath.startswith(changed):
+                        del self.__jsonCache[key]
+
+
+
+
+        def getJsonCacheStats(self):
+            """ 
+            Returns the counters of the JSON response cache.  'hits' were 
+            served from the cache outright, 'revalidated' were confirmed 
+            unchanged by the server (304), and 'misses' were downloaded in 
+            full.  'coalesced' joined an identical fetch in progress and 
+            'reused' one that had just finished (see 'getJsonAsync'); 
+            'saved' is the requests spared by both.
+
+            @return: The cache counters, plus the current 'size'.
+            @rtype: dict
+            """
+            with self.__jsonCacheLock:
+                stats = dict(self.__jsonCacheStats)
+                stats['size'] = len(self.__jsonCache)
+            stats['saved'] = stats['coalesced'] + stats['reused']
+            return stats
+
+
+
+
+        def __getCachedJson(self, url, fresh = False):
+            """ 
+            Looks up a listing in the JSON response cache.
+
+            @param url: The full XNAT url of the listing.
+            @type url: string
+
+            @param fresh: Only return listings younger than JSON_CACHE_TTL, 
+                counting them as hits.
+            @type fresh: boolean
+
+            @return: A copy of the cached result when 'fresh', otherwise the
+                cache entry itself.  None if there is no suitable entry.
+            @rtype: list.<dict> | dict
+            """
+            key = (self.username, Xnat.path.normalizeUrl(url))
+            with self.__jsonCacheLock:
+                entry = self.__jsonCache.get(key)
+                if entry is None:
+                    return None
+                self.__jsonCache.move_to_end(key)
+                if not fresh:
+                    return entry
+                if time.time() - entry['time'] > self.JSON_CACHE_TTL:
+                    return None
+                self.__jsonCacheStats['hits'] += 1
+                return [dict(row) for row in entry['result']]
+
+
+
+
+        def __cacheJson(self, url, response, result):
+            """ 
+            Stores a listing in the JSON response cache, evicting the least 
+            recently used listings beyond JSON_CACHE_SIZE.  Responses without
+            validators are cached too; they are refetched once stale.
+
+            @param url: The full XNAT url of the listing.
+            @type url: string
+
+            @param response: The response the listing was read from.
+            @type response: requests.Response
+
+            @param result: The parsed 'ResultSet' 'Result' list.
+            @type result: list.<dict>
+            """
+            key = (self.username, Xnat.path.normalizeUrl(url))
+            with self.__jsonCacheLock:
+                self.__jsonCache[key] = {
+                    'result': result,
+                    'time': time.time(),
+                    'etag': response.headers.get('ETag'),
+                    'lastModified': response.headers.get('Last-Modified')
+                }
+                self.__jsonCache.move_to_end(key)
+                while len(self.__jsonCache) > self.JSON_CACHE_SIZE:
+                    self.__jsonCache.popitem(last = False)
+
+
+
+
+        def gatherJson(self, _uris, cancelToken = None):
+            """ 
+            Requests the JSON of every uri in '_uris' at once and waits for 
+            all of them.
+
+            @param _uris: The xnat uris to retrieve the JSON objects from.
+            @type _uris: list.<string>
+
+            @param cancelToken: Set to stop waiting and cancel the requests 
+                that haven't started.
+            @type cancelToken: threading.Event
+
+            @return: The JSON results, in the order of '_uris'.  Failed 
+                (or cancelled) entries are None.
+            @rtype: list.<list.<dict>>
+            """
+            futures = [self.getJsonAsync(_uri) for _uri in _uris]
+            if not self.__waitFutures(futures, cancelToken):
+                return [None] * len(futures)
+            return [self.__jsonResult(future) for future in futures]
+
+
+
+
+        def __waitFutures(self, futures, cancelToken, interval = 0.05):
+            """ 
+            Waits for every future unless 'cancelToken' gets set, in which 
+            case the futures that haven't started are cancelled.
+
+            @param futures: The futures to wait on.
+            @type futures: list.<concurrent.futures.Future>
+
+            @param cancelToken: The cancel token, or None to just wait.
+            @type cancelToken: threading.Event
+
+            @return: Whether all of the futures completed.
+            @rtype: boolean
+            """
+            if cancelToken is None:
+                concurrent.futures.wait(futures)
+                return True
+            pending = set(futures)
+            while pending and not cancelToken.is_set():
+                done, pending = concurrent.futures.wait(pending, 
+                                                        timeout = interval)
+            if cancelToken.is_set():
+                for future in futures:
+                    future.cancel()
+                return False
+            return True
+
+
+
+
+        @staticmethod
+        def __isSet(cancelToken):
+            """ 
+            @return: Whether a (possibly None) cancel token is set.
+            @rtype: boolean
+            """
+            return cancelToken is not None and cancelToken.is_set()
+
+
+
+
+        def shutdown(self):
+            """ 
+            Invalidates the session token and stops the request executor.  
+            Pending requests are abandoned; the instance should not be used 
+            afterwards.
+            """
+            self.__eventTimer.stop()
+            self.logout()
+            self.__folderPool.shutdown(wait = False, cancel_futures = True)
+            self.__requestPool.shutdown(wait = False, cancel_futures = True)
+
+
+
+
+        def logout(self):
+            """ 
+            Invalidates the session token on the server, if there is one.
+            """
+            with self.__authLock:
+                if not self.__jsessionId:
+                    return
+                try:
+                    self.session.delete(Xnat.path.makeXnatUrl(self.host, 
+                                                    self.JSESSION_URI))
+                except Exception as e:
+                    print("Failed to end XNAT session: %s"%(str(e)))
+                self.session.cookies.clear()
+                self.__jsessionId = None
+
+
+
+
+        def __login(self):
+            """ 
+            Obtains a JSESSION token from the host with the Basic 
+            credentials and switches the session over to it.  Servers that 
+            don't issue one (or rejected credentials) leave the session on 
+            Basic auth, so login errors surface as they always have.
+
+            @return: Whether a token was obtained.
+            @rtype: boolean
+            """
+            url = Xnat.path.makeXnatUrl(self.host, self.JSESSION_URI)
+            try:
+                r = requests.post(url, auth = self.auth)
+            except Exception as e:
+                print("XNAT session token request failed: %s"%(str(e)))
+                return False
+
+            token = r.text.strip()
+            if r.status_code != 200 or not token or '<' in token:
+                return False
+
+            self.session.cookies.clear()
+            self.session.cookies.set('JSESSIONID', token)
+            self.session.auth = None
+            self.__jsessionId = token
+            return True
+
+
+
+
+        def __reauthenticate(self, staleToken):
+            """ 
+            Renews an expired session token.  Only the first of several 
+            threads that hit the same expired token logs in again.
+
+            @param staleToken: The token the failed request was sent with.
+            @type staleToken: string
+
+            @return: Whether the request should be retried.
+            @rtype: boolean
+            """
+            with self.__authLock:
+                if self.__jsessionId != staleToken:
+                    return True
+                print("XNAT session expired.  Re-authenticating.")
+                if self.__login():
+                    return True
+                #
+                # Fall back to Basic auth if a new token can't be had.
+                #
+                self.session.cookies.clear()
+                self.session.auth = self.auth
+                self.__jsessionId = None
+                return True
+
+
+
+
+        def __httpsRequest(self, method, _uri, body='', files=None, headers={}, stream=False):
+            """ 
+            Makes httpsRequests to an XNAT host.  Synchronous wrapper around
+            'requestAsync'.
+
+            @param method: The request method to run ('GET', 'PUT', 'POST', 
+                'DELETE').
+            @type: string
+
+            @param _uri: The XNAT uri to run the request on.
+            @type: string      
+
+            @param body: The body contents of the request.  Defaults to an 
+                empty string.
+            @type: string
+
+            @param headerAdditions: The additional header dictionary to add 
+                to the request.
+            @type: dict
+
+            @return: The response, or None if the request failed.
+            @rtype: requests.Response
+            """
+            future = self.requestAsync(method, _uri, body, files, headers, 
+                                       stream)
+            try:
+                return future.result()
+            except Exception as e:
+                self.__requestFailed(e)
             
 
+
         def __requests_worker(self, method, url, body, files, headers, stream):
+            """ 
+            Runs a single REST call on a request executor thread.  A 401 on
+            a token-authenticated request renews the token and retries the 
+            request once.
+
+            @return: The response of the request.
+            @rtype: requests.Response
+            """
+            token = self.__jsessionId
+            r = self.__send(method, url, body, files, headers, stream)
+            if r.status_code == 401 and token and \
+               self.__reauthenticate(token):
+                r.close()
+                for f in (files or {}).values():
+                    if hasattr(f, 'seek'):
+                        f.seek(0)
+                r = self.__send(method, url, body, files, headers, stream)
+            return r
+
+
+
+        def __send(self, method, url, body, files, headers, stream):
+            """ 
+            Sends a single request on the shared session.
+
+            @return: The response of the request.
+            @rtype: requests.Response
+            """
+            if method == 'POST':
+                return self.session.post(url, data=body or None, 
+                                         headers=headers)
+            elif method == 'GET':
+                return self.session.get(url, stream=stream, headers=headers)
+            elif method == 'PUT':
+                return self.session.put(url, files=files, stream=stream)
+            elif method == 'DELETE':
+                return self.session.delete(url)
+            elif method == 'HEAD':
+                return self.session.head(url, headers=headers, 
+                                         allow_redirects=True)
+
+
+
+        def __json_worker(self, url):
+            """ 
+            Runs a GET and parses the XNAT JSON result set on a request 
+            executor thread, so that concurrent listings are parsed in 
+            parallel too.  Stale cached listings are revalidated with 
+            'If-None-Match' / 'If-Modified-Since', so an unchanged listing 
+            costs a 304 and no parsing.
+
+            @return: The 'ResultSet' 'Result' list of the response.
+            @rtype: list.<dict>
+            """
+            entry = self.__getCachedJson(url)
+            headers = {}
+            if entry:
+                if entry['etag']:
+                    headers['If-None-Match'] = entry['etag']
+                if entry['lastModified']:
+                    headers['If-Modified-Since'] = entry['lastModified']
+
+            r = self.__requests_worker('GET', url, '', None, headers, False)
+            if r.status_code == 304 and entry:
+                with self.__jsonCacheLock:
+                    entry['time'] = time.time()
+                    self.__jsonCacheStats['revalidated'] += 1
+                return [dict(row) for row in entry['result']]
+
             try:
-                if method == 'POST':
-                    self.response = self.session.post(url, headers=headers)
-                elif method == 'GET':
-                    self.response = self.session.get(url, stream=stream)
-                elif method == 'PUT':
-                    self.response = self.session.put(url, files=files, stream=stream)
-                elif method == 'DELETE':
-                    self.response = self.session.delete(url)
+                result = r.json()['ResultSet']['Result']
             except Exception as e:
-                print(e)
+                e.response = r
+                raise
+
+            with self.__jsonCacheLock:
+                self.__jsonCacheStats['misses'] += 1
+            if r.status_code == 200:
+                self.__cacheJson(url, r, [dict(row) for row in result])
+            return result
+
+
+
+        def __jsonResult(self, future):
+            """ 
+            Waits on a 'getJsonAsync' future, reporting failures the way 
+            '__getJson' always has.
+
+            @param future: The future returned by 'getJsonAsync'.
+            @type future: concurrent.futures.Future
+
+            @return: The JSON result, or None if it failed.
+            @rtype: list.<dict>
+            """
+            try:
+                return future.result()
+            except Exception as e:
+                if not hasattr(e, 'response'):
+                    self.__requestFailed(e)
+                    return
+                if threading.current_thread() is self.__ownerThread:
+                    self.exceptionPopup.setText(str(e))
+                self.__emit('jsonError', self.host.encode(),
+                            self.username.encode(), e.response)
+
+
+
+        def __requestFailed(self, e):
+            """ 
+            Reports a failed request.  The exception popup is only shown when
+            on the thread that owns this instance.
+
+            @param e: The exception raised by the request.
+            @type e: Exception
+            """
+            print(e)
+            if threading.current_thread() is self.__ownerThread:
                 self.exceptionPopup.setText(str(e))
                 self.exceptionPopup.show()
 
@@ -828,10 +2509,13 @@ class Xnat(object):
             @type message: string
             """
             self.removeFromDownloadQueue(_src)
-            dstFile.close()
-            os.remove(dstFile.name)
+            if hasattr(dstFile, 'close'):
+                dstFile.close()
+                dstFile = dstFile.name
+            if dstFile and os.path.exists(dstFile):
+                os.remove(dstFile)
             print("\nFailed to download '%s'.  Error: %s"%(_src, message))
-            self.runEventCallbacks('downloadFailed', _src, _dst, message)
+            self.__emit('downloadFailed', _src, _dst, message)
 
 
 
@@ -992,103 +2676,583 @@ class Xnat(object):
             # Get the content size, first by checking log, then by reading 
             # header
             #-------------------- 
-            self.downloadTracker['downloadedSize']['bytes'] = 0   
-            self.downloadTracker['totalDownloadSize'] = \
-                                                self.getFileSize(xnatUrl)
-            if not self.downloadTracker['totalDownloadSize']['bytes']:
+            tracker = self.makeDownloadTracker()
+            tracker['totalDownloadSize'] = self.getFileSize(xnatUrl)
+            if not tracker['totalDownloadSize']['bytes']:
                 # If not in log, read the header
                 if response.headers and "Content-Length" in response.headers:
-                    self.downloadTracker['totalDownloadSize']['bytes'] = \
+                    tracker['totalDownloadSize']['bytes'] = \
                                     int(response.headers["Content-Length"])  
-                    self.downloadTracker['totalDownloadSize']['MB'] =  \
+                    tracker['totalDownloadSize']['MB'] =  \
                             Xnat.utils.bytesToMB(\
-                            self.downloadTracker['totalDownloadSize']['bytes'])
+                            tracker['totalDownloadSize']['bytes'])
 
 
             #-------------------- 
             # Start the buffer reading cycle by
             # calling on the buffer_read function above.
             #-------------------- 
-            bytesRead = self.__bufferRead(xnatUrl, dstFile, response)
+            bytesRead = self.__bufferRead(xnatUrl, dstFile, response, tracker)
             dstFile.close()
 
 
 
 
-        def __getFile_requests(self, _src, _dst):
+        def __getFile_requests(self, _src, _dst, tracker):
             """ 
-            Replaces urllib and httplib __getFile methods
+            Replaces urllib and httplib __getFile methods.  Safe to run on a
+            download worker thread: events are routed through '__emit' and 
+            progress is kept in the transfer's own 'tracker'.
+
+            The body is staged in '<_dst>.part' next to a sidecar 
+            ('<_dst>.part.json') recording the URL, the server's validators 
+            (ETag / Last-Modified) and the bytes received.  A later attempt 
+            at the same URL resumes with a 'Range' request, and falls back 
+            to a full fetch if the server ignores the range or the file 
+            changed.  Cancelled or dropped transfers keep their '.part' file.
+            The sidecar is only rewritten every PART_STATE_BYTES or 
+            PART_STATE_INTERVAL, and once more when the transfer stops.
 
             @param _src: The _src url to run the GET request on.
             @type _src: string
 
             @param _dst: The destination path of the GET (for getting files).
             @type _dst: string         
+
+            @param tracker: The size tracking dictionary of this transfer.
+            @type tracker: dict
             """
 
             #-------------------- 
             # Get the content size from scan json
             #-------------------- 
-            self.downloadTracker['downloadedSize']['bytes'] = 0   
-            self.downloadTracker['totalDownloadSize'] = self.getFileSize(_src)
-
-            #-------------------- 
-            # Pre-download callbacks
-            #-------------------- 
-            size = self.downloadTracker['totalDownloadSize']['bytes'] \
-                   if self.downloadTracker['totalDownloadSize']['bytes'] else -1
-            self.runEventCallbacks('downloadStarted', _src, size)
-            self.runEventCallbacks('downloading', _src, 0)
+            tracker['downloadedSize']['bytes'] = 0   
+            tracker['totalDownloadSize'] = self.getFileSize(_src)
 
             #-------------------- 
             # Open the local destination file 
             # so that it can start reading in the buffers.
             #-------------------- 
             try:
-                dstFile = _dst
                 dstDir = os.path.dirname(_dst)        
                 if not os.path.exists(dstDir):
                     os.makedirs(dstDir)
-                # print("dstFile: {}".format(dstFile))
             except Exception as e:
                 print(e)
-                self.__downloadFailed(_src, _dst, dstFile, str(e))
-                self.exceptionPopup.setText(str(e))
+                self.__downloadFailed(_src, _dst, None, str(e))
                 return
 
             #-------------------- 
-            # Construct the request
+            # Construct the request, resuming a previous attempt
+            # if there is one.
             #-------------------- 
             url = Xnat.path.makeXnatUrl(self.host, _src)
-            r = self.__httpsRequest('GET', url, stream=True)
-            f = open(dstFile, 'wb')
+            partPath = _dst + self.PART_SUFFIX
+            partState = self.__readPartState(partPath, url)
+            headers = {}
+            if partState:
+                headers['Range'] = 'bytes=%i-'%(partState['bytes'])
+                headers['If-Range'] = partState.get('etag') or \
+                                      partState.get('lastModified')
+            r = self.__httpsRequest('GET', url, headers=headers, stream=True)
+            if r == None:
+                self.__downloadFailed(_src, _dst, None, 'No response')
+                return
 
-            for chunk in r.iter_content(chunk_size=1024*1024):
-                # Check for cancel event
-                if not self.inDownloadQueue(_src):
-                    f.close()
-                    os.remove(f.name)
-                    self.runEventCallbacks('downloadCancelled', _src)
-                    break
+            #
+            # 206: the server honoured the range, so append.  Anything else
+            # is a full body (or a stale range), so start over.
+            #
+            if partState and r.status_code == 206:
+                offset = partState['bytes']
+                totalBytes = Xnat.path.getContentRangeTotal(r.headers)
+                if totalBytes:
+                    tracker['totalDownloadSize']['bytes'] = totalBytes
+                print("Resuming '%s' at %i bytes."%(_src, offset))
+            elif partState and r.status_code == 416:
+                r.close()
+                self.__removePart(partPath)
+                return self.__getFile_requests(_src, _dst, tracker)
+            elif r.status_code == 200:
+                offset = 0
+            else:
+                #
+                # An error page: don't stage it, or a later range request
+                # would append to it.
+                #
+                r.close()
+                self.__removePart(partPath)
+                self.__downloadFailed(_src, _dst, None, 
+                                      'HTTP %i'%(r.status_code))
+                return
+            partState = {
+                'url': url,
+                'etag': r.headers.get('ETag'),
+                'lastModified': r.headers.get('Last-Modified'),
+                'bytes': offset,
+            }
+            tracker['downloadedSize']['bytes'] = offset
 
-                f.write(chunk)
+            #-------------------- 
+            # Pre-download callbacks
+            #-------------------- 
+            size = tracker['totalDownloadSize']['bytes'] \
+                   if tracker['totalDownloadSize']['bytes'] else -1
+            self.__emit('downloadStarted', _src, size)
+            self.__emit('downloading', _src, offset)
 
-                self.downloadTracker['downloadedSize']['bytes'] += len(chunk)
-                self.runEventCallbacks('downloading', _src, 
-                            self.downloadTracker['downloadedSize']['bytes'])
+            f = open(partPath, 'ab' if offset else 'wb')
+            self.__writePartState(partPath, partState)
+            savedBytes, savedTime = offset, time.time()
+            finished = False
+            try:
+                for chunk in r.iter_content(chunk_size=1024*1024):
+                    # Check for cancel event
+                    if not self.inDownloadQueue(_src):
+                        self.__emit('downloadCancelled', _src)
+                        return
+
+                    f.write(chunk)
+
+                    tracker['downloadedSize']['bytes'] += len(chunk)
+                    partState['bytes'] = tracker['downloadedSize']['bytes']
+                    if partState['bytes'] - savedBytes >= \
+                       self.PART_STATE_BYTES or \
+                       time.time() - savedTime >= self.PART_STATE_INTERVAL:
+                        #
+                        # The sidecar never records more than is on disk.
+                        #
+                        f.flush()
+                        self.__writePartState(partPath, partState)
+                        savedBytes, savedTime = partState['bytes'], \
+                                                time.time()
+                    self.__emit('downloading', _src, 
+                                tracker['downloadedSize']['bytes'])
+                finished = True
+            finally:
+                r.close()
+                f.close()
+                #
+                # Record where a cancelled or dropped transfer stopped.
+                #
+                if not finished and partState['bytes'] != savedBytes:
+                    try:
+                        self.__writePartState(partPath, partState)
+                    except Exception as e:
+                        print("Failed to record '%s': %s"%(partPath, str(e)))
 
-            r.close()
-            f.close()
+            #-------------------- 
+            # Move the completed body into place.
+            #-------------------- 
+            os.replace(partPath, _dst)
+            self.__removePart(partPath, keepBody = True)
 
             #-------------------- 
             # Post-download callbacks
             #--------------------     
             self.removeFromDownloadQueue(_src)
-            self.runEventCallbacks('downloadFinished', _src)
+            self.__emit('downloadFinished', _src)
+
+
+
+        def __getSegmentableSize(self, _src):
+            """ 
+            Determines whether '_src' can be downloaded in segments: its 
+            size must be known and large enough, and the server must 
+            advertise byte ranges.
+
+            @param _src: The source XNAT URL.
+            @type _src: string
+
+            @return: The size in bytes and the validator to send in 
+                'If-Range' (may be None), or None if not segmentable.
+            @rtype: tuple
+            """
+            if '?' in _src:
+                return None
+            #
+            # Files listed as too small don't need the HEAD request.
+            #
+            trackedFile = self.getTrackedFile(_src)
+            if trackedFile and trackedFile.get('Size') and \
+               int(trackedFile['Size']) < self.SEGMENT_MIN_SIZE:
+                return None
+            url = Xnat.path.makeXnatUrl(self.host, _src)
+            r = self.__httpsRequest('HEAD', url)
+            if r == None or r.status_code != 200 or \
+               r.headers.get('Accept-Ranges', '').lower() != 'bytes':
+                return None
+
+            if trackedFile and trackedFile.get('Size'):
+                size = int(trackedFile['Size'])
+            else:
+                size = int(r.headers.get('Content-Length', 0))
+            if size < self.SEGMENT_MIN_SIZE:
+                return None
+            return size, r.headers.get('ETag') or \
+                         r.headers.get('Last-Modified')
+
+
+
+        def __getFile_segmented(self, _src, _dst, tracker, segments, size,
+                                validator):
+            """ 
+            Downloads a file of known 'size' as 'segments' byte ranges 
+            fetched concurrently into a preallocated '.part' file.  Each 
+            segment is retried independently, resuming from its last 
+            written byte; once one fails for good, the others stop too.  
+            Progress of all segments is reported as one 'downloading' event
+            stream.
+
+            Like '__getFile_requests', the '.part' file is kept when the 
+            transfer stops, and its sidecar records how far each range got
+            (see '__readSegmentState'), so a later attempt resumes the 
+            ranges where they stopped.  A '.part' file left by 
+            '__getFile_requests' is resumed as well.
+
+            @param _src: The _src url to run the GET request on.
+            @type _src: string
+
+            @param _dst: The destination path of the GET.
+            @type _dst: string         
+
+            @param tracker: The size tracking dictionary of this transfer.
+            @type tracker: dict
+
+            @param segments: The number of segments.
+            @type segments: integer
+
+            @param size: The size of the file in bytes.
+            @type size: integer
+
+            @param validator: The ETag or Last-Modified value to send in 
+                'If-Range' so that a changed file isn't stitched together.
+            @type validator: string
+            """
+            url = Xnat.path.makeXnatUrl(self.host, _src)
+            partPath = _dst + self.PART_SUFFIX
+            dstDir = os.path.dirname(_dst)
+            if not os.path.exists(dstDir):
+                os.makedirs(dstDir)
+
+            #-------------------- 
+            # Split into ranges, or pick up those of a previous attempt.
+            #-------------------- 
+            ranges = self.__readSegmentState(partPath, url, size, validator,
+                                             segments)
+            if ranges:
+                print("Resuming '%s' at %i bytes."%(
+                    _src, sum(written for start, end, written in ranges)))
+            else:
+                self.__removePart(partPath)
+                ranges = self.__splitRange(0, size, segments)
+
+            #-------------------- 
+            # Preallocate the destination.
+            #-------------------- 
+            with open(partPath, 'r+b' if os.path.exists(partPath) else 'wb') \
+                 as f:
+                f.truncate(size)
+            partState = {
+                'url': url,
+                'etag': validator,
+                'lastModified': None,
+                'size': size,
+                'ranges': ranges,
+            }
+            progress = [written for start, end, written in ranges]
+
+            def savePartState():
+                for i, byteRange in enumerate(ranges):
+                    byteRange[2] = progress[i]
+                partState['bytes'] = self.__getSegmentPrefix(ranges)
+                self.__writePartState(partPath, partState)
+            savePartState()
+
+            tracker['totalDownloadSize'] = {
+                'bytes': size, 'MB': Xnat.utils.bytesToMB(size)}
+            tracker['downloadedSize']['bytes'] = sum(progress)
+            self.__emit('downloadStarted', _src, size)
+            self.__emit('downloading', _src, sum(progress))
+
+            #-------------------- 
+            # Fetch the ranges.  'stopped' is set when the transfer is 
+            # cancelled, or by the first segment that fails for good.
+            #-------------------- 
+            stopped = threading.Event()
+            cancelled = False
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers = len(ranges)) as executor:
+                futures = [executor.submit(self.__getSegment, url, partPath,
+                                           start, end, validator, progress,
+                                           i, stopped) \
+                           for i, (start, end, written) in enumerate(ranges)]
+
+                #
+                # Report aggregate progress, record it in the sidecar and 
+                # watch for cancellation from this (the transfer's) thread.
+                #
+                savedBytes, savedTime = sum(progress), time.time()
+                done = set()
+                while len(done) < len(futures):
+                    done, notDone = concurrent.futures.wait(futures, 
+                                                            timeout = 0.25)
+                    if not self.inDownloadQueue(_src):
+                        cancelled = True
+                        stopped.set()
+                    tracker['downloadedSize']['bytes'] = sum(progress)
+                    if len(done) < len(futures) and \
+                       (sum(progress) - savedBytes >= self.PART_STATE_BYTES\
+                        or time.time() - savedTime >= \
+                        self.PART_STATE_INTERVAL):
+                        savePartState()
+                        savedBytes, savedTime = sum(progress), time.time()
+                    self.__emit('downloading', _src, 
+                                tracker['downloadedSize']['bytes'])
+
+            #-------------------- 
+            # Keep what was fetched of a stopped transfer.
+            #-------------------- 
+            if stopped.is_set():
+                try:
+                    savePartState()
+                except Exception as e:
+                    print("Failed to record '%s': %s"%(partPath, str(e)))
+            if cancelled:
+                self.__emit('downloadCancelled', _src)
+                return
+
+            for future in futures:
+                if future.exception():
+                    self.__downloadFailed(_src, _dst, None, 
+                                          str(future.exception()))
+                    return
+
+            os.replace(partPath, _dst)
+            self.__removePart(partPath, keepBody = True)
+            self.removeFromDownloadQueue(_src)
+            self.__emit('downloadFinished', _src)
+
+
+
+        def __getSegment(self, url, partPath, start, end, validator, 
+                         progress, index, stopped):
+            """ 
+            Fetches the byte range [start, end] of 'url' into the same range
+            of 'partPath', from 'progress[index]' bytes in.  Runs on a 
+            segment thread.  The '.part' file is written unbuffered, so 
+            'progress' never counts bytes that aren't in it.
+
+            @param progress: The shared per-segment byte counts; this 
+                segment updates 'progress[index]'.
+            @type progress: list.<integer>
+
+            @param stopped: Set when the transfer is cancelled or another
+                segment failed.  This segment sets it if it fails.
+            @type stopped: threading.Event
+
+            @raise: Error if the segment still fails after SEGMENT_RETRIES 
+                attempts, or if the server doesn't honour the range.
+            """
+            attempt = 0
+            while True:
+                offset = start + progress[index]
+                if offset > end or stopped.is_set():
+                    return
+                headers = {'Range': 'bytes=%i-%i'%(offset, end)}
+                if validator:
+                    headers['If-Range'] = validator
+                try:
+                    r = self.__requests_worker('GET', url, '', None, headers, 
+                                               True)
+                    try:
+                        if r.status_code != 206:
+                            raise Exception("Range request for bytes " + 
+                                            "%i-%i returned %i"%(offset, end,
+                                                             r.status_code))
+                        with open(partPath, 'r+b', buffering = 0) as f:
+                            f.seek(offset)
+                            for chunk in r.iter_content(chunk_size=1024*1024):
+                                if stopped.is_set():
+                                    return
+                                f.write(chunk[:end + 1 - offset])
+                                offset += len(chunk)
+                                progress[index] = min(offset, end + 1) - start
+                    finally:
+                        r.close()
+                except Exception as e:
+                    attempt += 1
+                    if attempt > self.SEGMENT_RETRIES or stopped.is_set():
+                        stopped.set()
+                        raise
+                    print("Retrying bytes %i-%i of '%s' (%s)"%(
+                        start + progress[index], end, url, str(e)))
+
+
+
+        @staticmethod
+        def __splitRange(first, size, segments):
+            """ 
+            @return: The bytes from 'first' to 'size' split into at most 
+                'segments' ranges, as [start, end, written] lists with 
+                nothing written.
+            @rtype: list.<list>
+            """
+            segmentSize = max(-(-(size - first) // segments), 1)
+            return [[start, min(start + segmentSize, size) - 1, 0] \
+                    for start in range(first, size, segmentSize)]
+
+
+
+        @staticmethod
+        def __getSegmentPrefix(ranges):
+            """ 
+            @return: The number of bytes of the '.part' file written without
+                a gap from its start, which '__getFile_requests' can resume
+                from.
+            @rtype: integer
+            """
+            prefix = 0
+            for start, end, written in sorted(ranges):
+                if start != prefix:
+                    break
+                prefix = start + written
+                if written < end + 1 - start:
+                    break
+            return prefix
+
+
+
+        def __readSegmentState(self, partPath, url, size, validator, 
+                               segments):
+            """ 
+            Returns the ranges to resume a segmented download from: those
+            recorded by a previous segmented attempt, or, for a '.part' file
+            left by '__getFile_requests', its bytes followed by the rest of
+            the file split in as many ranges as there are segments.  The
+            previous attempt must have had the same URL and validator, and 
+            (for segments) size.
+
+            @param partPath: The '.part' path of the download.
+            @type partPath: string
+
+            @param url: The full URL being downloaded.
+            @type url: string
+
+            @param size: The size of the file in bytes.
+            @type size: integer
+
+            @param validator: The current ETag or Last-Modified value.
+            @type validator: string
+
+            @param segments: The number of segments to split the rest of a
+                '__getFile_requests' download in.
+            @type segments: integer
+
+            @return: The [start, end, written] ranges, or None.
+            @rtype: list.<list>
+            """
+            try:
+                with open(partPath + '.json', 'r') as f:
+                    partState = json.load(f)
+            except Exception:
+                return None
+            if not validator or partState.get('url') != url or \
+               (partState.get('etag') or partState.get('lastModified')) != \
+               validator or not os.path.exists(partPath):
+                return None
+
+            if partState.get('ranges'):
+                if partState.get('size') != size or \
+                   os.path.getsize(partPath) != size:
+                    return None
+                return [list(byteRange) for byteRange in partState['ranges']]
+
+            written = partState.get('bytes') or 0
+            if not written or written >= size or \
+               os.path.getsize(partPath) < written:
+                return None
+            return [[0, written - 1, written]] + \
+                self.__splitRange(written, size, segments)
+
+
+
+        def __readPartState(self, partPath, url):
+            """ 
+            Returns the sidecar state of a staged '.part' download if it 
+            can be resumed from: same URL, a validator to send in 'If-Range',
+            and a '.part' file holding at least the recorded bytes.  A 
+            transfer that died between sidecar writes leaves bytes beyond 
+            the recorded ones; they are cut off and fetched again.
+
+            @param partPath: The '.part' path of the download.
+            @type partPath: string
+
+            @param url: The full URL being downloaded.
+            @type url: string
+
+            @return: The sidecar state, or None.
+            @rtype: dict
+            """
+            try:
+                with open(partPath + '.json', 'r') as f:
+                    partState = json.load(f)
+            except Exception:
+                return None
+
+            if partState.get('url') != url or \
+               not (partState.get('etag') or partState.get('lastModified')) \
+               or not os.path.exists(partPath) or not partState.get('bytes') \
+               or os.path.getsize(partPath) < partState['bytes']:
+                return None
+            if os.path.getsize(partPath) > partState['bytes']:
+                try:
+                    with open(partPath, 'r+b') as f:
+                        f.truncate(partState['bytes'])
+                except Exception:
+                    return None
+            return partState
+
+
+
+        def __writePartState(self, partPath, partState):
+            """ 
+            Writes the sidecar of a staged '.part' download.  The sidecar is 
+            replaced atomically so a crash never leaves it half-written.
+
+            @param partPath: The '.part' path of the download.
+            @type partPath: string
+
+            @param partState: The state to record.
+            @type partState: dict
+            """
+            tmpPath = partPath + '.json.tmp'
+            with open(tmpPath, 'w') as f:
+                json.dump(partState, f)
+            os.replace(tmpPath, partPath + '.json')
+
+
+
+        def __removePart(self, partPath, keepBody = False):
+            """ 
+            Removes a staged '.part' download and its sidecar.
+
+            @param partPath: The '.part' path of the download.
+            @type partPath: string
+
+            @param keepBody: Only remove the sidecar.
+            @type keepBody: boolean
+            """
+            paths = [partPath + '.json'] if keepBody else \
+                    [partPath, partPath + '.json']
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
 
 
 
-        def __bufferRead(self, _src, dstFile, response, bufferSize=8192):
+        def __bufferRead(self, _src, dstFile, response, tracker, 
+                         bufferSize=8192):
             """
             Downloads a file by a constant buffer size.
 
@@ -1102,6 +3266,9 @@ class Xnat(object):
             @type response: A file-like object. 
                 @see: U{http://docs.python.org/2/library/urllib.request.html}
 
+            @param tracker: The size tracking dictionary of this transfer.
+            @type tracker: dict
+
             @param bufferSize: Buffer size to read.  Defaults to the standard 
                 8192.
             @type bufferSize: integer
@@ -1114,9 +3281,9 @@ class Xnat(object):
             #--------------------
             # Pre-download callbacks
             #--------------------
-            size = self.downloadTracker['totalDownloadSize']['bytes'] \
-                   if self.downloadTracker['totalDownloadSize']['bytes'] else -1
-            self.runEventCallbacks('downloadStarted', _src, size)
+            size = tracker['totalDownloadSize']['bytes'] \
+                   if tracker['totalDownloadSize']['bytes'] else -1
+            self.__emit('downloadStarted', _src, size)
 
 
 
@@ -1132,7 +3299,7 @@ class Xnat(object):
                     print("Cancelling download of '%s'"%(_src))
                     dstFile.close()
                     os.remove(dstFile.name)
-                    self.runEventCallbacks('downloadCancelled', _src)
+                    self.__emit('downloadCancelled', _src)
                     break
 
 
@@ -1143,7 +3310,7 @@ class Xnat(object):
                 if not buffer: 
                     # Pop from the queue
                     self.removeFromDownloadQueue(_src)
-                    self.runEventCallbacks('downloadFinished', _src)
+                    self.__emit('downloadFinished', _src)
                     break
 
 
@@ -1155,12 +3322,12 @@ class Xnat(object):
                 #
                 # And update progress indicators
                 #
-                self.downloadTracker['downloadedSize']['bytes'] += len(buffer)
-                self.runEventCallbacks('downloading', _src, 
-                            self.downloadTracker['downloadedSize']['bytes'])
+                tracker['downloadedSize']['bytes'] += len(buffer)
+                self.__emit('downloading', _src, 
+                            tracker['downloadedSize']['bytes'])
 
 
-            return self.downloadTracker['downloadedSize']['bytes']
+            return tracker['downloadedSize']['bytes']
 
 
 
@@ -1168,8 +3335,8 @@ class Xnat(object):
 
         def __getJson(self, _uri):
             """ 
-            Returns a json object from a given XNAT URI using
-            the internal method '__httpsRequest'.
+            Returns a json object from a given XNAT URI.  Synchronous 
+            wrapper around 'getJsonAsync'.
 
             @param _uri: The xnat uri to retrieve the JSON object from.
             @type _uri: string
@@ -1177,32 +3344,200 @@ class Xnat(object):
             @return: A dictionary of the JSON result.
             @rtype: dict
             """
+            return self.__jsonResult(self.getJsonAsync(_uri))
 
-            #-------------------- 
-            # Add explicit format=json if not already there
-            #--------------------  
-            if 'format=json' not in _uri:
-                if '?' in _uri:
-                    _uri += '&format=json'
+
+
+    class index(object):
+        """
+        Trigram index of the XNAT metadata an Xnat.io has seen.  Substring 
+        queries are answered locally: the trigrams of the query narrow down 
+        the candidates, which are then checked for the whole query.  Rows 
+        are merged by ID (projects, subjects, experiments) or URI (scans, 
+        files), so a row seen through several listings is indexed once.
+        CASE INSENSITIVE.
+        """
+
+        #
+        # The searchable tags of each level.
+        #
+        SEARCH_TAGS = {
+            'projects': ['ID', 'id', 'secondary_ID', 'name', 'pi_firstname', 
+                         'pi_lastname', 'description'],
+            'subjects': ['ID', 'label'],
+            'experiments': ['ID', 'label'],
+            'scans': ['ID', 'type', 'series_description'],
+            'files': ['Name'],
+        }
+
+        def __init__(self):
+            """ 
+            Initializes an empty index.
+            """
+            self.__lock = threading.Lock()
+            self.__rows = {}
+            self.__texts = {}
+            self.__trigrams = collections.defaultdict(set)
+
+
+
+        def __len__(self):
+            """ 
+            @return: The number of indexed rows.
+            @rtype: integer
+            """
+            return len(self.__rows)
+
+
+
+        @staticmethod
+        def getLevel(_uri):
+            """ 
+            Returns the indexed level listed by a folder uri, i.e. its last
+            path segment.
+
+            @param _uri: The folder uri.
+            @type _uri: string
+
+            @return: The level, or None if the level isn't indexed.
+            @rtype: string
+            """
+            level = _uri.split('?')[0].rstrip('/').rsplit('/', 1)[-1]
+            if level in Xnat.index.SEARCH_TAGS:
+                return level
+
+
+
+        @staticmethod
+        def makeTrigrams(text):
+            """ 
+            @param text: The text to split.
+            @type text: string
+
+            @return: The three-character substrings of 'text'.
+            @rtype: set.<string>
+            """
+            return set(text[i:i+3] for i in range(len(text) - 2))
+
+
+
+        def add(self, level, rows):
+            """ 
+            Indexes (or updates) the rows of a listing.
+
+            @param level: The level of the rows, e.g. 'subjects'.
+            @type level: string
+
+            @param rows: The 'ResultSet' 'Result' rows.
+            @type rows: list.<dict>
+            """
+            if level not in self.SEARCH_TAGS:
+                return
+            with self.__lock:
+                for row in rows:
+                    key = self.__makeKey(level, row)
+                    if key is None:
+                        continue
+                    if key in self.__rows:
+                        row = dict(self.__rows[key][1], **row)
+                        for trigram in self.makeTrigrams(self.__texts[key]):
+                            self.__trigrams[trigram].discard(key)
+                    #
+                    # Fields are joined with a separator that queries can't
+                    # contain, so trigrams never span two fields.
+                    #
+                    text = '\0'.join(str(row[tag]).lower() for tag \
+                                      in self.SEARCH_TAGS[level] \
+                                      if row.get(tag))
+                    self.__rows[key] = (level, row)
+                    self.__texts[key] = text
+                    for trigram in self.makeTrigrams(text):
+                        self.__trigrams[trigram].add(key)
+
+
+
+        def discard(self, _uri = None):
+            """ 
+            Removes the rows at or beneath a uri.
+
+            @param _uri: The XNAT uri of a removed folder or file.  Defaults
+                to None, which empties the index.
+            @type _uri: string
+            """
+            with self.__lock:
+                if _uri is None:
+                    self.__rows.clear()
+                    self.__texts.clear()
+                    self.__trigrams.clear()
+                    return
+                path = Xnat.path.normalizeUrl(_uri).split('?')[0]
+                if '/data/' in path:
+                    path = path[path.find('/data/'):]
+                for key, (level, row) in list(self.__rows.items()):
+                    rowUri = Xnat.path.normalizeUrl(row.get('URI') or '')
+                    if rowUri and rowUri.startswith(path):
+                        for trigram in self.makeTrigrams(self.__texts[key]):
+                            self.__trigrams[trigram].discard(key)
+                        del self.__rows[key]
+                        del self.__texts[key]
+
+
+
+        def query(self, searchString, levels = None):
+            """ 
+            Finds the rows with a searchable tag containing 'searchString'.
+
+            @param searchString: The search query string.
+            @type searchString: string
+
+            @param levels: The levels to search.  Defaults to all of them.
+            @type levels: list.<string>
+
+            @return: Copies of the matching rows by level.
+            @rtype: dict.<string, list.<dict>>
+            """
+            searchString = searchString.strip().lower()
+            levels = levels or list(self.SEARCH_TAGS)
+            results = dict((level, []) for level in levels)
+            if not searchString:
+                return results
+
+            with self.__lock:
+                trigrams = self.makeTrigrams(searchString)
+                if trigrams:
+                    candidates = None
+                    for trigram in sorted(trigrams, key = lambda trigram: \
+                                          len(self.__trigrams.get(trigram, 
+                                                                  ()))):
+                        keys = self.__trigrams.get(trigram, set())
+                        candidates = keys if candidates is None else \
+                                     candidates & keys
+                        if not candidates:
+                            break
                 else:
-                    _uri += '?format=json'
+                    candidates = self.__rows.keys()
 
+                for key in candidates:
+                    level, row = self.__rows[key]
+                    if level in results and searchString in self.__texts[key]:
+                        results[level].append(dict(row))
+            return results
 
-            #-------------------- 
-            # Get the response from httpRequest
-            #--------------------     
-            xnatUrl = Xnat.path.makeXnatUrl(self.host, _uri)
-            r = self.__httpsRequest('GET', xnatUrl)
 
-            #-------------------- 
-            # Try to load the response as a JSON...
-            #-------------------- 
-            try:
-                return r.json()['ResultSet']['Result']
-            except Exception as e:
-                self.exceptionPopup.setText(str(e))
-                self.runEventCallbacks('jsonError', self.host.encode(),
-                                       self.username.encode(), r)
+
+        def __makeKey(self, level, row):
+            """ 
+            @return: The key a row is indexed by, or None if it has no 
+                identifier.
+            @rtype: tuple
+            """
+            if level in ('scans', 'files'):
+                identifier = row.get('URI')
+            else:
+                identifier = row.get('ID') or row.get('id')
+            if identifier:
+                return (level, identifier)
+
 
 
 
@@ -1280,6 +3615,26 @@ class Xnat(object):
 
 
 
+        @staticmethod
+        def getFilesPath(_uri):
+            """
+            Returns the path of a file below its resource's 'files' folder,
+            which keeps the folders the file was uploaded in.
+
+            @param _uri: The file URI.
+            @type _uri: string
+
+            @return: The path below the 'files' folder, or the file name if
+                '_uri' has no 'files' folder.
+            @rtype: string
+            """
+            _uri = _uri.split('?')[0].replace('//', '/')
+            if '/files/' in _uri:
+                return _uri.split('/files/', 1)[1]
+            return os.path.basename(_uri)
+
+
+
         @staticmethod
         def getUriAt(_uri, level):
             """ 
@@ -1366,6 +3721,67 @@ class Xnat(object):
 
 
 
+        @staticmethod
+        def getContentRangeTotal(headers):
+            """
+            Returns the complete length from a 'Content-Range' header 
+            (e.g. 'bytes 100-199/2000').
+
+            @param headers: The response headers.
+            @type headers: dict
+
+            @return: The complete length in bytes, or None if unknown.
+            @rtype: integer
+            """
+            contentRange = headers.get('Content-Range', '')
+            total = contentRange.rsplit('/', 1)[-1].strip()
+            if total.isdigit():
+                return int(total)
+
+
+
+        @staticmethod
+        def applyJsonFormat(_uri):
+            """
+            Adds an explicit 'format=json' query argument to the uri if it 
+            isn't already there.
+
+            @param _uri: The partial or full XNAT query uri
+            @type _uri: string
+
+            @return: The uri with 'format=json' applied.
+            @rtype: string
+            """
+            if 'format=json' not in _uri:
+                if '?' in _uri:
+                    _uri += '&format=json'
+                else:
+                    _uri += '?format=json'
+            return _uri
+
+
+
+        @staticmethod
+        def normalizeUrl(_url):
+            """
+            Normalizes a full XNAT url for use as a cache key: the 
+            '/data/archive' prefix is reduced to its '/data' alias, trailing
+            slashes are dropped and query arguments are sorted.
+
+            @param _url: The full XNAT url.
+            @type _url: string
+
+            @return: The normalized url.
+            @rtype: string
+            """
+            base, sep, query = _url.partition('?')
+            base = base.replace('/data/archive/', '/data/').rstrip('/')
+            if not sep:
+                return base
+            return base + '?' + '&'.join(sorted(query.split('&')))
+
+
+
         @staticmethod
         def makeXnatUrl(host, _url):
             """
@@ -1445,7 +3861,7 @@ class Xnat(object):
              'project_invs',    
              'project_access_img',    
              'user_role_497',    
-             'quarantine_status'
+             'quarantine_status',
              'URI',
          ],
          'subjects' : [
@@ -1453,7 +3869,7 @@ class Xnat(object):
              'label',
              'insert_date',
              'insert_user',
-             'totalRecords'
+             'totalRecords',
              'project',
              'URI',
          ],
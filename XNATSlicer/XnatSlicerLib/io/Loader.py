@@ -11,7 +11,10 @@ __status__ = "Production"
 
 # python
 import os
+import json
+import time
 import shutil
+import hashlib
 import tempfile
 
 # application
@@ -57,20 +60,40 @@ class Loader(object):
         self._dst = ''
         self.fileUris = fileUris
         self.useCached = None
+        self.prepared = False
+        self.downloadSegments = None
         self._dstBase = XnatSlicerGlobals.LOCAL_URIS['downloads']
         
 
         
     @property
     def loadArgs(self):
-        return {'src': self._src, 'dst': self._dst}
+        return {'src': self._src, 'dst': self._dst, 
+                'segments': self.downloadSegments}
 
         
 
-    def extractDst(self):
+    def prepare(self):
+        """
+        To be inherited by the subclass.  Called as soon as the loader's 
+        download has finished, while the rest of the download queue is 
+        still running, to do the work that doesn't need the whole queue 
+        (e.g. extracting and indexing).  It shouldn't block the event loop,
+        so 'load' has to finish whatever is still pending.
+        """
+        pass
+
+
+
+
+    def extractDst(self, onExtracted = None):
         """
         Extracts the downloaded zip file and its contents
         to the appropriate dst.
+
+        @param onExtracted: Called with the path of each file as it's 
+            extracted.
+        @type onExtracted: function
         """
         
 
@@ -107,7 +130,9 @@ class Loader(object):
                 shutil.rmtree(os.path.normpath(self.extractPath))
                 os.makedirs(self.extractPath)
             except Exception as e:
-                # This fails in windows.
+                # This fails in windows.  The files left behind are
+                # replaced, not rewritten, by 'extractAllFiles', so the
+                # cached blobs they're linked to stay intact.
                 #print("LOADER "+str(e))
                 pass
 
@@ -115,7 +140,8 @@ class Loader(object):
         #--------------------
         # Decompress zips.
         #--------------------
-        MokaUtils.file.extractAllFiles(self._dst, self.extractPath)
+        MokaUtils.file.extractAllFiles(self._dst, self.extractPath, 
+                                       onExtracted)
         
 
         #--------------------
@@ -130,6 +156,33 @@ class Loader(object):
                                                         root, relFileName)))
 
 
+        #--------------------
+        # Hand the files to the download cache
+        #--------------------
+        self.addToDownloadCache(self.extractedFiles)
+
+
+
+
+    def addToDownloadCache(self, paths):
+        """
+        Stores downloaded files in the MODULE's DownloadCache, if it has one.
+        The files are hashed on the cache's worker thread (see 
+        'DownloadCache.addFilesAsync'), so loading doesn't wait for it.
+
+        @param paths: The downloaded files.
+        @type paths: list(str)
+        """
+        DownloadCache = getattr(self.MODULE, 'DownloadCache', None)
+        if not DownloadCache:
+            return
+        def onAdded(future):
+            if future.exception():
+                print("Unable to cache the downloaded files: %s"%(
+                    str(future.exception())))
+        DownloadCache.addFilesAsync(paths).add_done_callback(onAdded)
+
+
         
         
 
@@ -138,8 +191,14 @@ class Loader(object):
 class Loader_File(Loader):
     """
     A subclass of the Loader class for downlading individual files.
+
+    Individual files are plain '/files/' resources, so large ones are 
+    fetched as DOWNLOAD_SEGMENTS parallel byte ranges when the host 
+    supports ranges (see 'Xnat.io.getFile').
     """
 
+    DOWNLOAD_SEGMENTS = 4
+
     def __init__(self, MODULE, _src, fileUris = None):
         """
         Init function.
@@ -156,6 +215,7 @@ class Loader_File(Loader):
         """
         super(Loader_File, self).__init__(MODULE, _src, fileUris)
         self._dst = os.path.join(self._dstBase , 'projects' + self._src.split('projects')[1])
+        self.downloadSegments = self.DOWNLOAD_SEGMENTS
         
 
 
@@ -165,6 +225,7 @@ class Loader_File(Loader):
         """
         if not os.path.exists(self._dst): return 
         SlicerUtils.loadNodeFromFile(self._dst)
+        self.addToDownloadCache([self._dst])
 
 
 
@@ -173,8 +234,22 @@ class Loader_File(Loader):
 class Loader_Images(Loader):
     """
     A subclass of the Loader class for downlading image sets (DICOM, Analyze, etc.).
+
+    Every image set that loads gets a manifest in MANIFEST_DIR, which records
+    where each of its files was extracted, their sizes and what the host
+    reported about them.  The cache check answers from the manifest when
+    there is one, without walking the download directory.
     """
 
+    MANIFEST_DIR = '.manifests'
+    MANIFEST_VERSION = 1
+
+    #
+    # The file listing tags compared to tell whether the host's copy changed.
+    #
+    SERVER_STAMP_TAGS = ['Size', 'digest', 'last_modified']
+
+
     def __init__(self, MODULE, _src, fileUris):
         """
         Init function.
@@ -191,6 +266,13 @@ class Loader_Images(Loader):
         """
         super(Loader_Images, self).__init__(MODULE, _src, fileUris)
 
+        #--------------------
+        # Locate the manifest of the image set
+        #--------------------
+        self.manifestPath = self.getManifestPath(self._src)
+        self.manifestHit = False
+
+
         #--------------------
         # Derive a src and dst
         #--------------------
@@ -199,9 +281,12 @@ class Loader_Images(Loader):
 
 
         #--------------------
-        # Perform cache check
+        # Perform cache check: the manifest first, then the 
+        # subclass' own check for sets loaded without one.
         #--------------------
-        self.useCached = self.checkCache(self.fileUris) and \
+        self.manifestHit = self.checkManifest(self.fileUris)
+        self.useCached = (self.manifestHit or \
+                          self.checkCache(self.fileUris)) and \
                          self.isUseCacheChecked()
 
         
@@ -303,6 +388,8 @@ class Loader_Images(Loader):
         self.MODULE.Workflow_Load.XnatDownloadPopup.setProgressBarValue(folderUri, 100)
         self.MODULE.Workflow_Load.XnatDownloadPopup.setEnabled(folderUri, False)
         self.extractedFiles = self.cachedFiles
+        if getattr(self.MODULE, 'DownloadCache', None):
+            self.MODULE.DownloadCache.touch(self.cachedFiles)
         return
 
 
@@ -315,3 +402,157 @@ class Loader_Images(Loader):
         """
         pass
 
+
+
+
+    def getManifestPath(self, _src):
+        """
+        @param _src: The source URI of the image set.
+        @type _src: str
+
+        @return: The path of the image set's manifest.  Sets of different 
+            loader types in the same folder get different manifests.
+        @rtype: str
+        """
+        key = hashlib.md5((self.__class__.__name__ + '|' + _src).\
+                          encode('utf-8')).hexdigest()
+        return os.path.join(self._dstBase, self.MANIFEST_DIR, key + '.json')
+
+
+
+
+    def getServerStamp(self, fileUri):
+        """
+        Returns what the host last reported about a file, from the file 
+        listing the load workflow made before creating the loader.
+
+        @param fileUri: The file URI.
+        @type fileUri: str
+
+        @return: The SERVER_STAMP_TAGS of the file, or None if it wasn't
+            listed.
+        @rtype: dict
+        """
+        fileRow = self.MODULE.XnatIo.getTrackedFile(fileUri)
+        if not fileRow:
+            return None
+        return dict((tag, str(fileRow[tag])) for tag in \
+                    self.SERVER_STAMP_TAGS if tag in fileRow)
+
+
+
+
+    def checkManifest(self, fileUris):
+        """
+        Checks the image set's manifest: the cache is usable if the manifest
+        lists the same files, each of them is still on disk at its recorded 
+        size and the host hasn't reported a different copy since.  Sets 
+        'cachedFiles' if so.
+
+        @param fileUris: The file URIs of the image set.
+        @type fileUris: list(str)
+
+        @return: Whether the cached files can be loaded.
+        @rtype: bool
+        """
+        try:
+            with open(self.manifestPath, 'r') as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+        if manifest.get('version') != self.MANIFEST_VERSION or \
+           sorted(entry['uri'] for entry in manifest['files']) != \
+           sorted(fileUris):
+            return False
+
+        cachedFiles = []
+        for entry in manifest['files']:
+            try:
+                if os.stat(entry['path']).st_size != entry['size']:
+                    return False
+            except OSError:
+                return False
+            serverStamp = self.getServerStamp(entry['uri'])
+            if serverStamp:
+                for tag, value in entry['server'].items():
+                    if tag in serverStamp and serverStamp[tag] != value:
+                        return False
+            cachedFiles.append(entry['path'])
+
+        if not self.checkManifestFiles(cachedFiles):
+            return False
+        self.cachedFiles = cachedFiles
+        return True
+
+
+
+
+    def checkManifestFiles(self, cachedFiles):
+        """
+        To be inherited by the subclass.  Further checks the files listed
+        by the manifest before they're loaded from the cache.
+
+        @param cachedFiles: The cached files.
+        @type cachedFiles: list(str)
+
+        @return: Whether the files can be loaded.
+        @rtype: bool
+        """
+        return True
+
+
+
+
+    def writeManifest(self):
+        """
+        Writes the manifest of the image set after it has loaded, mapping
+        each of 'fileUris' to its file in 'extractedFiles'.  The manifest is
+        replaced atomically, and not written if a file can't be found.
+        """
+        if self.manifestHit:
+            return
+
+        filesByName = {}
+        for extractedFile in self.extractedFiles:
+            extractedFile = MokaUtils.path.adjustPathSlashes(extractedFile)
+            filesByName.setdefault(os.path.basename(extractedFile), []).\
+                append(extractedFile)
+
+        entries = []
+        for fileUri in self.fileUris:
+            #
+            # Extraction flattens the zip's folders, so files are found by
+            # name, and by the folders below the '/files/' level if the
+            # name isn't unique.
+            #
+            matches = filesByName.get(os.path.basename(fileUri), [])
+            if len(matches) > 1:
+                suffix = '/' + fileUri.split('/files/', 1)[-1]
+                matches = [extractedFile for extractedFile in matches \
+                           if extractedFile.endswith(suffix)]
+            if len(matches) != 1:
+                return
+            entries.append({
+                'uri': fileUri,
+                'path': matches[0],
+                'size': os.path.getsize(matches[0]),
+                'server': self.getServerStamp(fileUri) or {}
+            })
+
+        manifest = {
+            'version': self.MANIFEST_VERSION,
+            'src': self._src.replace('?format=zip', ''),
+            'written': time.time(),
+            'files': entries
+        }
+        try:
+            if not os.path.exists(os.path.dirname(self.manifestPath)):
+                os.makedirs(os.path.dirname(self.manifestPath))
+            tmpPath = self.manifestPath + '.tmp'
+            with open(tmpPath, 'w') as f:
+                json.dump(manifest, f)
+            os.replace(tmpPath, self.manifestPath)
+        except (IOError, OSError) as e:
+            print("Unable to write the manifest of '%s': %s"%(
+                manifest['src'], str(e)))
+
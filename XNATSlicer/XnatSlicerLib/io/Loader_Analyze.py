@@ -94,7 +94,9 @@ class Loader_Analyze(Loader_Images):
 
         if headersFound == 0:
             SlicerUtils.loadNodeFromFile(fileName)
-            slicer.app.processEvents()   
+            slicer.app.processEvents()
+
+        self.writeManifest()   
 
         
 
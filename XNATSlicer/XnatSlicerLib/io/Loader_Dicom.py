@@ -11,6 +11,8 @@ __status__ = "Production"
 
 # python
 import os
+import queue
+import threading
 
 # application
 import slicer
@@ -31,6 +33,43 @@ class Loader_Dicom(Loader_Images):
     NOTE: DICOMLoader makes use of Slicer's DICOM database and 
     for parsing.
     """
+
+    #
+    # Extracted files are indexed every INDEX_INTERVAL milliseconds, at most
+    # INDEX_BATCH_SIZE of them at a time, so the event loop keeps running.
+    #
+    INDEX_BATCH_SIZE = 100
+    INDEX_INTERVAL = 250
+
+
+
+    def __init__(self, MODULE, _src, fileUris):
+        """
+        Init function.
+
+        @param MODULE: The XNATSlicer module.
+        @type MODULE: XnatSlicerWidget
+
+        @param _src: The source URI to begin the load from.
+        @type _src: str
+
+        @param fileUris: The fileUrs to download from (in case the download 
+                         is of an entire 'files' folder).
+        @type fileUris: list(str)
+        """
+        super(Loader_Dicom, self).__init__(MODULE, _src, fileUris)
+
+        #--------------------
+        # The extraction 'prepare' started, if any.
+        #--------------------
+        self.__extractThread = None
+        self.__extractedQueue = queue.Queue()
+        self.__extractErrors = []
+        self.__dicomIndexer = None
+        self.__indexTimer = qt.QTimer()
+        self.__indexTimer.setInterval(self.INDEX_INTERVAL)
+        self.__indexTimer.connect('timeout()', self.__indexExtracted)
+
     
 
     def checkCache(self, fileUris):
@@ -61,6 +100,29 @@ class Loader_Dicom(Loader_Images):
 
 
                     
+        #--------------------
+        # Look the files up in the DicomPathIndex, if there is one.  Its
+        # hits are confirmed against the database, and once it's built, 
+        # what it doesn't have isn't cached.  Until then (or without 
+        # one), scan the database below.
+        #--------------------
+        DicomPathIndex = getattr(self.MODULE, 'DicomPathIndex', None)
+        if DicomPathIndex and slicer.dicomDatabase:
+            try:
+                DicomPathIndex.sync(slicer.dicomDatabase)
+                if DicomPathIndex.isReady(slicer.dicomDatabase):
+                    dicomUris = [fileUri for fileUri in fileUris \
+                                 if XnatSlicerUtils.isDICOM(fileUri)]
+                    self.cachedFiles = list(DicomPathIndex.lookup(dicomUris,
+                                            slicer.dicomDatabase).values())
+                    return len(self.cachedFiles) > 0 and \
+                        len(self.cachedFiles) == len(abbrevUris)
+            except Exception as e:
+                print("Unable to use the DICOM path index: %s"%(str(e)))
+                DicomPathIndex = None
+
+
+
         #--------------------
         # Get database files, abbreviate as necessary
         #--------------------
@@ -72,12 +134,13 @@ class Loader_Dicom(Loader_Images):
                 
         #--------------------
         # Check for string matches between the folder URI
-        # and the database files 
+        # and the database files.  Files evicted from the download
+        # cache are still in the database, but don't count.
         #--------------------
         self.cachedFiles = []
         for key, value in fullToAbbrev.items():
             for abbrevUri in abbrevUris:
-                if abbrevUri in key:
+                if abbrevUri in key and os.path.exists(value):
                     self.cachedFiles.append(value)
 
         #print "FULL TO ABBREV", fullToAbbrev
@@ -87,9 +150,16 @@ class Loader_Dicom(Loader_Images):
         #      len(self.cachedFiles) == len(abbrevUris)
          
         #--------------------   
-        # If all URIs are in the database, use cache, exit.
+        # If all URIs are in the database, use cache, exit.  Remember the
+        # files for the next time.
         #--------------------    
         if len(self.cachedFiles) == len(abbrevUris):
+            if DicomPathIndex and self.cachedFiles:
+                try:
+                    DicomPathIndex.addFiles(self.cachedFiles)
+                except Exception as e:
+                    print("Unable to update the DICOM path index: %s"%(
+                        str(e)))
             return True
           
         return False
@@ -98,19 +168,42 @@ class Loader_Dicom(Loader_Images):
                 
 
 
-                
-    def load(self): 
-        """ 
-        Main load function for downloading DICOM files
-        from an XNAT server and loading them into Slicer. 
+
+
+    def checkManifestFiles(self, cachedFiles):
         """
+        Cached DICOMs are loaded through Slicer's DICOM database, so they 
+        have to be in it.
+
+        @param cachedFiles: The cached files.
+        @type cachedFiles: list(str)
+
+        @return: Whether the files are in the database.
+        @rtype: bool
+        """
+        if not slicer.dicomDatabase or not cachedFiles:
+            return False
+        try:
+            return bool(slicer.dicomDatabase.seriesForFile(cachedFiles[0]))
+        except Exception as e:
+            return False
 
-        if self.useCached:
-            return self.loadDicomsFromDatabase(self.extractedFiles)
 
 
-        if not os.path.exists(self._dst):
-            return 
+
+    def prepare(self):
+        """ 
+        Starts extracting the downloaded DICOM files and adding them to 
+        Slicer's DICOM database as soon as the download has finished.  
+        Files are extracted on a worker thread and indexed from 
+        '__indexTimer' in batches as they're written, so extracting and 
+        indexing overlap with each other and with the downloads still 
+        running, without blocking the event loop.  'load' finishes whatever
+        is still pending.
+        """
+        if self.useCached or self.prepared or self.__extractThread or \
+           not os.path.exists(self._dst):
+            return
         
 
         
@@ -131,19 +224,92 @@ class Loader_Dicom(Loader_Images):
 
 
         #--------------------
-        # UNZIP dst
+        # UNZIP dst on a worker thread
         #--------------------
-        self.extractDst()
+        def extract():
+            try:
+                self.extractDst(self.__extractedQueue.put)
+            except Exception as e:
+                self.__extractErrors.append(e)
+        self.__dicomIndexer = ctk.ctkDICOMIndexer()
+        self.__extractThread = threading.Thread(target = extract)
+        self.__extractThread.start()
+        self.__indexTimer.start()
+
+
+
+
+    def __indexExtracted(self, batchSize = None):
+        """
+        Adds up to 'batchSize' of the extracted files to 
+        slicer.dicomDatabase without waiting for more to be extracted.
+        Once the extraction has finished and every file is added, deletes
+        dst and marks the loader prepared.
+
+        @param batchSize: The most files to add.  Defaults to 
+            INDEX_BATCH_SIZE.
+        @type batchSize: int
+        """
+        batch = []
+        while len(batch) < (batchSize or self.INDEX_BATCH_SIZE):
+            try:
+                batch.append(self.__extractedQueue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self.__indexFiles(self.__dicomIndexer, batch)
 
-        
 
         #--------------------
-        # Add DICOM files to slicer.dicomDataase
+        # Finish up once everything is extracted and added.
+        #--------------------
+        if self.__extractThread.is_alive() or \
+           not self.__extractedQueue.empty():
+            return
+        self.__indexTimer.stop()
+        self.__extractThread.join()
+        if self.__extractErrors:
+            return
+        
+        #--------------------
+        # Delete dst
         #--------------------
-        dicomIndexer = ctk.ctkDICOMIndexer()
+        os.remove(self._dst)
+        self.prepared = True
+
+
+
+
+    def __finishPreparing(self):
+        """
+        Waits for the extraction 'prepare' started, and adds the rest of 
+        the extracted files to slicer.dicomDatabase.
+
+        @raise: The error the extraction failed with, if any.
+        """
+        self.__indexTimer.stop()
+        while not self.prepared and not self.__extractErrors:
+            self.__extractThread.join(self.INDEX_INTERVAL / 1000.0)
+            self.__indexExtracted()
+            slicer.app.processEvents()
+        if self.__extractErrors:
+            raise self.__extractErrors[0]
+
+
+
+
+    def __indexFiles(self, dicomIndexer, files):
+        """
+        Adds files to slicer.dicomDatabase and the DicomPathIndex.
+
+        @param dicomIndexer: The indexer.
+        @type dicomIndexer: ctk.ctkDICOMIndexer
+
+        @param files: The files to add.
+        @type files: list(str)
+        """
         try:
-            dicomIndexer.addListOfFiles(slicer.dicomDatabase, \
-                                        self.extractedFiles)
+            dicomIndexer.addListOfFiles(slicer.dicomDatabase, files)
         except Exception as e:
             
             #
@@ -154,19 +320,53 @@ class Loader_Dicom(Loader_Images):
                 #print (MokaUtils.debug.lf(), "The slicer.dicomDabase is " + \
                     #"unitialized (%s).  Initializing it."%(errorString))
                 slicer.dicomDatabase.initialize()
-                dicomIndexer.addListOfFiles(slicer.dicomDatabase, 
-                                            self.extractedFiles)
+                dicomIndexer.addListOfFiles(slicer.dicomDatabase, files)
+
 
         #--------------------
-        # Delete dst
+        # Keep the DicomPathIndex up to date.
         #--------------------
-        os.remove(self._dst)
+        if getattr(self.MODULE, 'DicomPathIndex', None):
+            try:
+                self.MODULE.DicomPathIndex.addFiles(files, 
+                                                    slicer.dicomDatabase)
+            except Exception as e:
+                print("Unable to update the DICOM path index: %s"%(str(e)))
+
+
+
+                
+    def load(self): 
+        """ 
+        Main load function for downloading DICOM files
+        from an XNAT server and loading them into Slicer. 
+        """
+
+        if self.useCached:
+            loaded = self.loadDicomsFromDatabase(self.extractedFiles)
+            if loaded:
+                self.writeManifest()
+            return loaded
+
+
+        #--------------------
+        # Extract and index, unless 'prepare' already has.
+        #--------------------
+        if not self.prepared:
+            if not self.__extractThread:
+                if not os.path.exists(self._dst):
+                    return 
+                self.prepare()
+            self.__finishPreparing()
 
 
         #--------------------
         # Load the 'downloaded' DICOMS from Slicer's database.
         #--------------------
-        return self.loadDicomsFromDatabase(self.extractedFiles)
+        loaded = self.loadDicomsFromDatabase(self.extractedFiles)
+        if loaded:
+            self.writeManifest()
+        return loaded
 
 
 
@@ -195,21 +395,13 @@ class Loader_Dicom(Loader_Images):
 
             
         #--------------------
-        # Parse through the slicer.dicomDatabase
-        # to get all of the files, as determined by series.
+        # Get the files of the series the downloaded files are in.
+        # If some aren't found in the database by path, parse through
+        # the whole slicer.dicomDatabase instead.
         #--------------------
-        matchedDatabaseFiles = []
-        for patient in slicer.dicomDatabase.patients():
-            for study in slicer.dicomDatabase.studiesForPatient(patient):
-                for series in slicer.dicomDatabase.seriesForStudy(study):
-                    seriesFiles = slicer.dicomDatabase.filesForSeries(series)
-                    #
-                    # Compare files in series with what was just downloaded.
-                    # If there's a match, append to 'matchedDatabaseFiles'.
-                    #
-                    for sFile in seriesFiles:
-                       if os.path.basename(sFile) in dlDicomObj: 
-                           matchedDatabaseFiles.append(sFile)
+        matchedDatabaseFiles = self.__getSeriesFiles(dicomFiles, dlDicomObj)
+        if matchedDatabaseFiles == None:
+            matchedDatabaseFiles = self.__findSeriesFiles(dlDicomObj)
 
 
                            
@@ -254,6 +446,73 @@ class Loader_Dicom(Loader_Images):
 
 
 
+
+    def __getSeriesFiles(self, dicomFiles, dlDicomObj):
+        """
+        Gets the files of the series that 'dicomFiles' belong to by asking
+        the slicer.dicomDatabase for the series of each file, skipping the
+        files of series already found.  Only those series are queried, so 
+        this doesn't depend on the size of the database.
+
+        @param dicomFiles: The local dicomFiles to load.
+        @type dicomFiles: list(str)
+
+        @param dlDicomObj: The dicomFiles by basename.
+        @type dlDicomObj: dict
+
+        @return: The database files of the series matching 'dicomFiles', or 
+            None if none of them are in the database under their path.
+        @rtype: list(str)
+        """
+        matchedDatabaseFiles = []
+        matchedNames = set()
+        seriesUids = set()
+        for dlFile in dicomFiles:
+            if os.path.basename(dlFile) in matchedNames:
+                continue
+            series = slicer.dicomDatabase.seriesForFile(dlFile)
+            if not series:
+                # Not a DICOM, or not in the database under this path.
+                continue
+            if series in seriesUids:
+                continue
+            seriesUids.add(series)
+            for sFile in slicer.dicomDatabase.filesForSeries(series):
+                if os.path.basename(sFile) in dlDicomObj:
+                    matchedDatabaseFiles.append(sFile)
+                    matchedNames.add(os.path.basename(sFile))
+        return matchedDatabaseFiles if seriesUids else None
+
+
+
+
+    def __findSeriesFiles(self, dlDicomObj):
+        """
+        Parses through the slicer.dicomDatabase to get all of the files, 
+        as determined by series, that match the downloaded files.
+
+        @param dlDicomObj: The downloaded dicomFiles by basename.
+        @type dlDicomObj: dict
+
+        @return: The matching database files.
+        @rtype: list(str)
+        """
+        matchedDatabaseFiles = []
+        for patient in slicer.dicomDatabase.patients():
+            for study in slicer.dicomDatabase.studiesForPatient(patient):
+                for series in slicer.dicomDatabase.seriesForStudy(study):
+                    seriesFiles = slicer.dicomDatabase.filesForSeries(series)
+                    #
+                    # Compare files in series with what was just downloaded.
+                    # If there's a match, append to 'matchedDatabaseFiles'.
+                    #
+                    for sFile in seriesFiles:
+                       if os.path.basename(sFile) in dlDicomObj: 
+                           matchedDatabaseFiles.append(sFile)
+        return matchedDatabaseFiles
+
+
+
             
     def beginDICOMSession(self):
         """ 
@@ -9,6 +9,9 @@ __email__ = "herrickr@mir.wustl.edu"
 __status__ = "Production"
 
 
+import os
+import time
+
 # application
 from __main__ import qt, slicer
 
@@ -117,6 +120,38 @@ class Workflow_Load(object):
 
 
 
+    def __makeScanLoaders(self, _src, contentUris):
+        """
+        Makes the loaders of a scan's files.
+
+        @param _src: The URI of the scan files.
+        @type _src: str
+
+        @param contentUris: The URIs of the scan's files.
+        @type contentUris: list(str)
+
+        @return: The loader list.
+        @rtype: list(Loader)
+        """
+        loaders = []
+        # get file uris and sort them by type
+        loadables = self.__sortLoadablesByType(contentUris)
+        #print "LOADABLES", loadables
+        # cycle through the loadables and
+        # create the loader for each loadable list.
+        for loadableType, loadableList in loadables.items():
+            if len(loadableList) > 0:
+                if loadableType == 'analyze':
+                    loaders.append(Loader_Analyze(self.MODULE, _src, loadables[loadableType]))
+                if loadableType == 'dicom':      
+                    loaders.append(Loader_Dicom(self.MODULE, _src, loadables[loadableType]))
+                if loadableType == 'misc':
+                    loaders.append(Loader_File(self.MODULE, _src, loadables[loadableType]))
+        return loaders
+
+
+
+
     def __resetIOCallbacks(self):
         """ 
         Clears and sets the IO callbacks for the MODULE.XnatIO.
@@ -161,6 +196,16 @@ class Workflow_Load(object):
             #
             self.XnatDownloadPopup.setFinished(_xnatSrc.split('?format=zip')[0])
             slicer.app.processEvents()
+
+            #
+            # Prepare the loader while the rest of the queue downloads.
+            #
+            for key, loader in self.loaders.items():
+                if loader and _xnatSrc in loader.loadArgs['src']:
+                    try:
+                        loader.prepare()
+                    except Exception as e:
+                        print("Unable to prepare '%s': %s"%(_xnatSrc, str(e)))
         self.MODULE.XnatIo.onEvent('downloadFinished', downloadFinished)
 
 
@@ -286,6 +331,15 @@ class Workflow_Load(object):
             self.postDownloadPopup.hide()
             self.MODULE.XnatIo.clearDownloadQueue()
             self.loaders = {}
+            #
+            # Keep the downloads within the cache quota.
+            #
+            if getattr(self.MODULE, 'DownloadCache', None):
+                try:
+                    self.MODULE.DownloadCache.enforceQuota()
+                except Exception as e:
+                    print("Unable to enforce the download cache quota: %s"%(
+                        str(e)))
 
             
         
@@ -298,11 +352,17 @@ class Workflow_Load(object):
 
         
         #------------------------
-        # Get loaders, add to queue
+        # Get loaders, add to queue.  Planning (listing the files and 
+        # checking the caches) is timed, as it runs before any download.
         #------------------------  
-        for loader in self.loaderFactory(self._src):
+        planStart = time.time()
+        loaders = self.loaderFactory(self._src)
+        print("Planned %i loader(s) for '%s' in %.2f s"%(
+            len(loaders), self._src, time.time() - planStart))
+        for loader in loaders:
             if not loader.useCached:
-                self.MODULE.XnatIo.addToDownloadQueue(loader.loadArgs['src'], loader.loadArgs['dst'])
+                self.MODULE.XnatIo.addToDownloadQueue(loader.loadArgs['src'], loader.loadArgs['dst'],
+                                                      loader.loadArgs['segments'])
             self.loaders[loader.loadArgs['src']] = loader
                          
 
@@ -388,21 +448,9 @@ class Workflow_Load(object):
                 print('Scan has no files')
                 self.preDownloadPopup.setText('No files found. Verify scan resources on XNAT.')
                 return []
-            contentUris = self.MODULE.XnatIo.getFolder(scanSrc, metadata= ['URI'])['URI']
+            contentUris = scan_uri['URI']
             #print "CONTENT URIS", contentUris
-            # get file uris and sort them by type
-            loadables = self.__sortLoadablesByType(contentUris)
-            #print "LOADABLES", loadables
-            # cycle through the loadables and
-            # create the loader for each loadable list.
-            for loadableType, loadableList in loadables.items():
-                if len(loadableList) > 0:
-                    if loadableType == 'analyze':
-                        loaders.append(Loader_Analyze(self.MODULE, _src, loadables[loadableType]))
-                    if loadableType == 'dicom':      
-                        loaders.append(Loader_Dicom(self.MODULE, _src, loadables[loadableType]))
-                    if loadableType == 'misc':
-                        loaders.append(Loader_File(self.MODULE, _src, loadables[loadableType]))
+            loaders += self.__makeScanLoaders(_src, contentUris)
 
 
                         
@@ -418,16 +466,20 @@ class Workflow_Load(object):
             splitExpt = _src.split('/experiments/')
             exptSrc = splitExpt[0] + '/experiments/' + splitExpt[1].split('/')[0] + '/scans'
             #print "SPLIT Expt:", splitExpt, '\n\t',exptSrc
-            # Query for Scan IDs from XNAT.
-            contents = self.MODULE.XnatIo.getFolder(exptSrc, metadata = ['ID'])
-            #print "SCAN IDS", contents
-            # Recurse this function for every scan.
-            
-            if 'ID' in contents:
-                for scanId in contents['ID']:
-                    scanSrc = exptSrc + '/' + scanId + '/files'
-                    #print "\n\nLOADING SCAN SOURCE", scanSrc
-                    loaders += self.loaderFactory(scanSrc)
+            # List the files of every scan at once, and make the
+            # loaders of each scan from them.
+            scanFiles = self.MODULE.XnatIo.getExperimentFiles(\
+                                            os.path.dirname(exptSrc))
+            if scanFiles == None:
+                print('Unable to list the scan files of %s'%(exptSrc))
+                return loaders
+            for scanId, fileRows in scanFiles.items():
+                scanSrc = exptSrc + '/' + scanId + '/files'
+                #print "\n\nLOADING SCAN SOURCE", scanSrc
+                self.XnatDownloadPopup.addDownloadRow(scanSrc)
+                loaders += self.__makeScanLoaders(scanSrc, 
+                            [fileRow['URI'] for fileRow in fileRows \
+                             if 'URI' in fileRow])
 
             # Return loaders
             return loaders
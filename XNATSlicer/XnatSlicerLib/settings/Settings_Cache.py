@@ -39,10 +39,142 @@ class Settings_Cache(CheckBoxSetting, Settings):
     ])
 
 
+    #
+    # The download cache quota, in GB (see 'DownloadCache').
+    #
+    DEFAULT_QUOTA_GB = 20
+    MAX_QUOTA_GB = 10000
+    USAGE_UPDATE_INTERVAL = 2000
+
+
     def setup(self):
         """
         Setup function inherited from parent class.
+            -Adds the download cache quota and usage sections.
             -Adds a checkbox and its relevant callbacks to the widget.
         """   
+        self.DownloadCache = None
+        self.__createQuotaSection()
+        self.__createUsageSection()
         self.createCheckBoxes()
 
+
+
+
+    def setDownloadCache(self, DownloadCache):
+        """
+        Links the DownloadCache that the quota applies to and whose usage is
+        shown.  The quota is one setting for every host, stored by the 
+        DownloadCache itself, since all hosts share its files.
+
+        @param DownloadCache: The download cache.
+        @type DownloadCache: DownloadCache
+        """
+        self.DownloadCache = DownloadCache
+        self.quotaSpinBox.setValue(int(self.DownloadCache.quota // \
+                                       (1024 * 1024 * 1024)))
+        self.__updateUsage()
+
+
+
+
+    def __createQuotaSection(self):
+        """
+        Adds the spin box of the download cache quota.
+        """
+        self.quotaSpinBox = qt.QSpinBox()
+        self.quotaSpinBox.setRange(1, self.MAX_QUOTA_GB)
+        self.quotaSpinBox.setSuffix(' GB')
+        self.quotaSpinBox.setValue(self.DEFAULT_QUOTA_GB)
+        self.quotaSpinBox.setFixedWidth(100)
+        self.quotaSpinBox.connect('editingFinished()', self.__onQuotaChanged)
+        self.addSection('Download Cache Size Limit:', self.quotaSpinBox)
+
+
+
+
+    def __createUsageSection(self):
+        """
+        Adds the live usage of the download cache and its 'Clear' button.
+        """
+        self.usageLabel = qt.QLabel('')
+        self.clearButton = qt.QPushButton('Clear Download Cache')
+        self.clearButton.setFixedWidth(200)
+        self.clearButton.connect('clicked()', self.__onClearClicked)
+
+        self.clearDialog = qt.QMessageBox()
+        self.clearDialog.setIcon(4)
+        self.clearDialog.setText("This deletes every downloaded file, " +
+                                 "for every host.\n" + 
+                                 "Are you sure you want to continue?")
+        self.clearDialog.setStandardButtons(qt.QMessageBox.Yes | 
+                                            qt.QMessageBox.No)
+        self.clearDialog.setDefaultButton(qt.QMessageBox.No)
+        self.clearDialog.connect('buttonClicked(QAbstractButton*)', 
+                                 self.__onClearConfirmed)
+
+        usageLayout = qt.QVBoxLayout()
+        usageLayout.addWidget(self.usageLabel)
+        usageLayout.addWidget(self.clearButton)
+        self.addSection('Download Cache Usage:', usageLayout)
+
+        self.usageTimer = qt.QTimer()
+        self.usageTimer.setInterval(self.USAGE_UPDATE_INTERVAL)
+        self.usageTimer.connect('timeout()', self.__updateUsage)
+        self.usageTimer.start()
+
+
+
+
+    def __updateUsage(self):
+        """
+        Shows the usage of the download cache, while the settings are shown.
+        """
+        if not self.DownloadCache or not self.isVisible():
+            return
+        stats = self.DownloadCache.getStats()
+        toGB = lambda size: size / (1024.0 * 1024.0 * 1024.0)
+        self.usageLabel.setText(
+            '%.2f GB of %.0f GB used by %i files '%(toGB(stats['bytes']), 
+                                                   toGB(stats['quota']), 
+                                                   stats['files']) + 
+            '(%.2f GB saved by identical files).'%(toGB(stats['saved'])))
+
+
+
+
+    def __onQuotaChanged(self):
+        """
+        Stores the quota in the DownloadCache and applies it.
+        """
+        if self.DownloadCache:
+            self.DownloadCache.setQuota(self.quotaSpinBox.value * \
+                                        1024 * 1024 * 1024)
+            self.DownloadCache.enforceQuota()
+        self.__updateUsage()
+
+
+
+
+    def __onClearClicked(self):
+        """
+        Asks for confirmation before emptying the DownloadCache.
+        """
+        if self.DownloadCache:
+            self.clearDialog.show()
+
+
+
+
+    def __onClearConfirmed(self, button):
+        """
+        Empties the DownloadCache if the user confirmed.
+
+        @param button: The button in the dialog that was clicked.
+        @type button: qt.QAbstractButton
+        """
+        if 'yes' in button.text.lower() and self.DownloadCache:
+            self.DownloadCache.clear()
+        self.clearDialog.hide()
+        self.__updateUsage()
+
@@ -35,6 +35,12 @@ class SearchBar(qt.QFrame):
     LABEL_FONT =  qt.QFont(FONT_NAME, FONT_SIZE, 10, False)        
     LABEL_FONT_ITALIC =  qt.QFont(FONT_NAME, FONT_SIZE, 10, True)
 
+    #
+    # Pause in typing (in milliseconds) before the debounced
+    # search runs.  See 'connectDebounced'.
+    #
+    DEBOUNCE_INTERVAL = 400
+
 
     def __init__(self, MODULE):
         """ Init function.
@@ -60,6 +66,18 @@ class SearchBar(qt.QFrame):
         # The search box (qt.QLineEdit)
         #--------------------------------
         self.searchLine = qt.QLineEdit()
+
+
+
+        #--------------------------------
+        # Debounce timer: restarted by every keystroke, 
+        # fires once the user pauses typing.
+        #--------------------------------
+        self.debounceTimer = qt.QTimer()
+        self.debounceTimer.setSingleShot(True)
+        self.debounceTimer.setInterval(self.DEBOUNCE_INTERVAL)
+        self.searchLine.connect("textEdited(QString)", 
+                                lambda text: self.debounceTimer.start())
         
 
         
@@ -223,8 +241,10 @@ class SearchBar(qt.QFrame):
         self.searchLine.setText(self.defaultSearchText)
         self.applyTextStyle('empty')
         self.prevText = None
+        self.debounceTimer.stop()
         
         try:
+            self.MODULE.View.cancelSearch()
             self.MODULE.Viewer.setNoResultsWidgetVisible(False)
             self.MODULE.View.filter_all()
             self.MODULE.View.defaultFilterFunction()
@@ -273,4 +293,26 @@ class SearchBar(qt.QFrame):
         the XnatIo class.
         """
         self.searchLine.connect("returnPressed()", function)
+
+
+
+    
+    def connectTextEdited(self, function):
+        """ 
+        For external classes to link the 'textEdited' signal
+        (i.e. every keystroke) to a given function, for 
+        search-as-you-type.
+        """
+        self.searchLine.connect("textEdited(QString)", function)
+
+
+
+    
+    def connectDebounced(self, function):
+        """ 
+        For external classes to link a function that runs once the
+        user pauses typing for DEBOUNCE_INTERVAL milliseconds, 
+        e.g. a server search.
+        """
+        self.debounceTimer.connect("timeout()", function)
     
@@ -69,6 +69,21 @@ class View(object):
         pass
 
 
+
+
+    def updateProjects(self, projectContents):
+        """ 
+        Brings the loaded projects up to date with a newer listing.  Child 
+        classes should do so in place; by default the projects are 
+        reloaded.
+
+        @param projectContents: The 'getFolder' contents of the projects.
+        @type projectContents: dict
+        """
+        self.clear()
+        self.loadProjects(filters = None, projectContents = projectContents)
+
+
     
     
     def begin(self, skipAnim = False, hardReset = False):
@@ -92,16 +107,34 @@ class View(object):
         # Check projects
         #----------------------
         projectContents = None
-        if hardReset or self.MODULE.XnatIo.projectCache == None:
+        storedContents = None
+        fetchProjects = hardReset or self.MODULE.XnatIo.projectCache == None
+        if fetchProjects:
             #MokaUtils.debug.lf()
             self.clear()
             projectContents = None
 
+            #
+            # Warm start: paint the projects stored at the last login 
+            # right away and refresh them in the background (below).  Only
+            # once the host has accepted the credentials.
+            #
+            if not hardReset and self.MODULE.XnatIo.authenticated:
+                storedProjects = self.MODULE.XnatIo.\
+                                  getFolder('projects', 
+                                  Xnat.metadata.DEFAULT_TAGS['projects'], 
+                                            'accessible', fromStore = True)
+                if storedProjects:
+                    projectContents = storedProjects
+                    storedContents = dict((key, list(val)) for key, val \
+                                          in storedProjects.items())
+
+        if fetchProjects and storedContents == None:
             try:
                 projectContents = self.MODULE.XnatIo.\
                                   getFolder('projects', 
                                   Xnat.metadata.DEFAULT_TAGS['projects'], 
-                                            'accessible')
+                                            'accessible', store = True)
 
             #
             # Error: SERVER ISSUES
@@ -133,6 +166,69 @@ class View(object):
         slicer.app.processEvents()
         self.MODULE.Buttons.setEnabled(buttonKey='addFolder', enabled=True) 
 
+        if storedContents != None:
+            self.runWhenDone(self.MODULE.XnatIo.getFolderAsync('projects', 
+                                  Xnat.metadata.DEFAULT_TAGS['projects'], 
+                                                               'accessible',
+                                                               store = True),
+                             lambda future: self.__onProjectsRefreshed(
+                                 future, storedContents))
+
+
+
+
+    def __onProjectsRefreshed(self, future, storedContents):
+        """
+        Callback of the background project refresh of a warm start. 
+        Updates the projects if they changed since they were stored (see
+        'updateProjects'), leaving the branches the user has opened 
+        meanwhile alone.
+
+        @param future: The 'getFolderAsync' future.
+        @type future: concurrent.futures.Future
+
+        @param storedContents: The stored projects that were painted.
+        @type storedContents: dict
+        """
+        try:
+            projectContents = future.result()
+        except Exception as e:
+            print("Project refresh failed: %s"%(str(e)))
+            return
+
+        if projectContents == None:
+            self.showError("Login error", 
+                "Login failed on XNAT host 'HOST_NAME' (HOST_URL)." + 
+                "Please check your username and password")
+            return
+
+        if projectContents != storedContents:
+            self.updateProjects(projectContents)
+
+
+
+
+    def runWhenDone(self, future, callback, interval = 50):
+        """
+        Runs a callback on the UI thread once a future completes, polling
+        with a Qt timer so that the UI stays responsive meanwhile.
+
+        @param future: The future to wait on.
+        @type future: concurrent.futures.Future
+
+        @param callback: Called with the future once it is done.
+        @type callback: function
+
+        @param interval: The polling interval in milliseconds.
+        @type interval: int
+        """
+        def poll():
+            if not future.done():
+                qt.QTimer.singleShot(interval, poll)
+                return
+            callback(future)
+        poll()
+
 
 
 
@@ -11,6 +11,10 @@ __status__ = "Production"
 
 # python
 import os
+import time
+import hashlib
+import itertools
+import threading
 
 # application
 from __main__ import qt, slicer
@@ -42,6 +46,44 @@ class View_Tree(View, qt.QTreeWidget):
     """  
 
     DEFAULT_FONT_SIZE = 10
+
+    #
+    # Shortest search string searched on the server while typing.
+    #
+    SEARCH_MIN_LENGTH = 2
+
+    #
+    # Children are added CHILD_PAGE_SIZE at a time.  The rest wait behind
+    # an item of the MORE_LEVEL level.  See 'makeTreeItems'.
+    #
+    CHILD_PAGE_SIZE = 500
+    MORE_LEVEL = 'more'
+
+    #
+    # Fetched children are kept on collapse.  On re-expansion they are
+    # shown as they are and, if older than CHILDREN_FRESH_TIME (seconds),
+    # checked against the server in the background.  The item data
+    # roles hold the fetch time and a signature of the fetched listing.
+    #
+    CHILDREN_FRESH_TIME = 30
+    FETCHED_TIME_ROLE = 33
+    FETCHED_SIGNATURE_ROLE = 34
+
+    #
+    # Expanding a project gets its whole subject/experiment hierarchy (see
+    # 'Xnat.io.getProjectHierarchy'), from which its subjects' experiments
+    # are made for HIERARCHY_MAX_AGE seconds.
+    #
+    HIERARCHY_MAX_AGE = 300
+
+    #
+    # Items of these levels are listed with their label tags only, and 
+    # get their other columns afterwards (see 'queueHydration'): those in
+    # view once the tree has been idle for HYDRATION_DELAY milliseconds, 
+    # a selected one at once.
+    #
+    TWO_PHASE_LEVELS = Xnat.io.PROJECTION_LEVELS
+    HYDRATION_DELAY = 250
     
     def setup(self):
         """ 
@@ -89,6 +131,58 @@ class View_Tree(View, qt.QTreeWidget):
 
 
         
+        #----------------------
+        # Background search state: the last search string,
+        # the cancel token of the running search and a 
+        # counter identifying the newest search.
+        #----------------------
+        self.searchString = None
+        self.searchCancelToken = None
+        self.searchGeneration = 0
+
+
+        
+        #----------------------
+        # Children not yet added to the tree, by parent item and 
+        # page token (see 'makeTreeItems'), and the MERGED_INFO tags 
+        # by level (see 'getInfoMetadata').
+        #----------------------
+        self.pendingPages = {}
+        self.pageCount = 0
+
+
+
+        #----------------------
+        # Background fetches of branches (see 'getChildren').
+        #----------------------
+        self.pendingFetches = {}
+        self.projectHierarchies = {}
+        self.infoMetadataCache = {}
+
+
+
+        #----------------------
+        # The metadata requested per level (see 'getQueryMetadata'),
+        # and when the column settings last changed.
+        #----------------------
+        self.queryMetadataCache = {}
+        self.columnsChangedTime = 0
+
+
+
+        #----------------------
+        # Branches waiting for their detail columns (see 
+        # 'queueHydration').
+        #----------------------
+        self.pendingHydrations = {}
+        self.hydrating = False
+        self.hydrationTimer = qt.QTimer()
+        self.hydrationTimer.setSingleShot(True)
+        self.hydrationTimer.setInterval(self.HYDRATION_DELAY)
+        self.hydrationTimer.connect('timeout()', self.hydrateVisible)
+
+
+        
         #----------------------
         # Scene globals
         #----------------------
@@ -117,6 +211,10 @@ class View_Tree(View, qt.QTreeWidget):
         # bar.  Have yet to pinpoint why this happens.
         #--------------------
         self.verticalScrollBar().setStyleSheet('width: 15px')
+        self.verticalScrollBar().connect('valueChanged(int)', 
+                                         self.onScrolled)
+        self.connect("itemCollapsed(QTreeWidgetItem *)", 
+                     self.onTreeItemCollapsed)
         self.updateFromSettings()
 
 
@@ -298,6 +396,89 @@ class View_Tree(View, qt.QTreeWidget):
 
 
         
+    def getInfoMetadata(self, xnatLevel):
+        """ 
+        Returns the metadata tags shown in the MERGED_INFO column
+        of a given XNAT level.  The tags are read from the settings once 
+        per batch of items (see 'makeTreeItems' and 'refreshColumns').
+
+        @param xnatLevel: The XNAT level.
+        @type xnatLevel: str
+
+        @return: The metadata tags.
+        @rtype: list.<str>
+        """
+        if not xnatLevel in self.infoMetadataCache:
+            self.infoMetadataCache[xnatLevel] = self.Setting.getStoredMetadata(
+                self.Setting.LABEL_METADATA, xnatLevel, True)
+        return self.infoMetadataCache[xnatLevel]
+
+
+
+
+    def getQueryMetadata(self, xnatLevel):
+        """ 
+        Returns the metadata tags to request for the items of a given XNAT 
+        level: the tags of the label and the uri, plus whatever the 
+        'Info. Metadata' (Settings_View) and details (Settings_Details) 
+        selections show.  Xnat.io leaves the other columns out of the 
+        listings it can project (see 'Xnat.io.getFolder').
+
+        @param xnatLevel: The XNAT level.
+        @type xnatLevel: str
+
+        @return: The metadata tags.
+        @rtype: list.<str>
+        """
+        if not xnatLevel in self.queryMetadataCache:
+            tags = [self.getMergedLabelTagByLevel(xnatLevel), 'ID', 'URI']
+            tags += self.getInfoMetadata(xnatLevel)
+            Settings = getattr(self.MODULE, 'Settings', None)
+            if Settings and 'DETAILS' in Settings:
+                tags += Settings['DETAILS'].getStoredMetadata(
+                    Settings['DETAILS'].LABEL_METADATA, xnatLevel, True)
+            self.queryMetadataCache[xnatLevel] = \
+                MokaUtils.list.uniqify([tag for tag in tags if tag])
+        return self.queryMetadataCache[xnatLevel]
+
+
+
+
+    def getListingMetadata(self, xnatLevel):
+        """ 
+        Returns the metadata tags to list the items of a given XNAT level 
+        with: only those of the label for the TWO_PHASE_LEVELS, whose other
+        columns are hydrated later (see 'queueHydration'), otherwise the 
+        'getQueryMetadata' tags.
+
+        @param xnatLevel: The XNAT level.
+        @type xnatLevel: str
+
+        @return: The metadata tags.
+        @rtype: list.<str>
+        """
+        if xnatLevel in self.TWO_PHASE_LEVELS:
+            return [self.getMergedLabelTagByLevel(xnatLevel), 'ID', 'URI']
+        return self.getQueryMetadata(xnatLevel)
+
+
+
+
+    def applyColumnVisibility(self):
+        """ 
+        Hides the columns that aren't part of the 'visibleColumnKeys' 
+        group.
+        """
+        visibleHeaders = [self.columns[key]['displayname'] \
+                          for key in self.visibleColumnKeys] 
+        headerItem = self.headerItem()
+        for i in range(0, self.columnCount):
+            setHidden = not headerItem.text(i) in visibleHeaders
+            self.setColumnHidden(i, setHidden)
+
+
+
+
     def getMergedLabelTagByLevel(self, level):
         """ 
         Points the MERGED_LABEL column tag to the relevant
@@ -389,10 +570,8 @@ class View_Tree(View, qt.QTreeWidget):
         mergedInfoColumnNumber = self.columns['MERGED_INFO']['location']
         xnatLevelColumnNumber = self.columns['XNAT_LEVEL']['location']
 
-        storedMetadata = self.Setting.getStoredMetadata( \
-                                      self.Setting.LABEL_METADATA, 
-                                      widgetItem.text(xnatLevelColumnNumber),
-                                      True)
+        storedMetadata = self.getInfoMetadata(\
+                                      widgetItem.text(xnatLevelColumnNumber))
 
 
         #MokaUtils.debug.lf("Info metadata: ", storedMetadata)
@@ -404,14 +583,6 @@ class View_Tree(View, qt.QTreeWidget):
         #
         widgetItem.setText(mergedInfoColumnNumber, '')
 
-        def debugPrint():
-            printStr = ''
-            for i in range(0, 40):
-                printStr += '\n\t' + self.headerItem().text(i) + ": " +  \
-                widgetItem.text(i)
-            #MokaUtils.debug.lf(printStr)
-
-        debugPrint()
 
         
         #
@@ -484,20 +655,6 @@ class View_Tree(View, qt.QTreeWidget):
 
             
             
-        #-------------------
-        # Hide columns that aren't part of the 'visibleColumnKeys' 
-        # group.
-        #-------------------
-        visibleHeaders = [self.columns[key]['displayname'] \
-                          for key in self.visibleColumnKeys] 
-        headerItem = self.headerItem()
-        for i in range(0, self.columnCount):
-            setHidden = not headerItem.text(i) in visibleHeaders
-            self.setColumnHidden(i, setHidden)
-
-                
-
-                
         return widgetItem
 
 
@@ -544,6 +701,7 @@ class View_Tree(View, qt.QTreeWidget):
         """ 
         Returns the currentItem
         """
+        self.dropPendingPages(self.currentItem())
         try:
             self.currentItem().parent().removeChild(self.currentItem())
         except Exception as e:
@@ -701,6 +859,83 @@ class View_Tree(View, qt.QTreeWidget):
 
 
 
+    def updateProjects(self, projectContents):
+        """ 
+        Brings the project items up to date with a newer 'projects' 
+        listing, in place.  Projects are matched on their label tag: those
+        no longer listed are removed, new ones are added, and the columns
+        of the others are refilled if their row changed.  Their branches,
+        and what the user has expanded, are kept.
+
+        @param projectContents: The 'getFolder' contents of the projects.
+        @type projectContents: dict
+        """
+        labelTag = self.getMergedLabelTagByLevel('projects')
+        if not projectContents or not labelTag in projectContents:
+            return
+        rows = {}
+        for i, projectId in enumerate(projectContents[labelTag]):
+            row = dict((key, values[i]) for key, values in \
+                       projectContents.items() if i < len(values))
+            row['XNAT_LEVEL'] = 'projects'
+            row['MERGED_LABEL'] = projectId
+            rows[projectId] = row
+
+
+
+        #--------------------
+        # Projects that haven't been added yet (see 'makeMoreItem')
+        # are made again from the new listing, below.
+        #--------------------
+        levelColumn = self.columns['XNAT_LEVEL']['location']
+        labelColumn = self.columns['MERGED_LABEL']['location']
+        for page in self.pendingPages.pop(self, {}).values():
+            self.takeTopLevelItem(self.indexOfTopLevelItem(page['item']))
+
+
+
+        #--------------------
+        # Remove or refill the items shown.
+        #--------------------
+        shown = set()
+        self.infoMetadataCache = {}
+        for i in reversed(range(self.topLevelItemCount)):
+            item = self.topLevelItem(i)
+            if item.text(levelColumn) != 'projects':
+                continue
+            projectId = item.text(labelColumn)
+            row = rows.get(projectId)
+            if row == None:
+                self.cancelFetches(item)
+                self.dropPendingPages(item)
+                self.projectHierarchies.pop(projectId, None)
+                self.takeTopLevelItem(i)
+                continue
+            shown.add(projectId)
+            if any(item.text(self.columns[key]['location']) != value \
+                   for key, value in row.items() if key in self.columns \
+                   and 'location' in self.columns[key]):
+                self.populateColumns(item, row)
+
+
+
+        #--------------------
+        # Add the new ones.
+        #--------------------
+        added = [projectId for projectId in rows if not projectId in shown]
+        if added:
+            metadata = dict((key, [rows[projectId].get(key, '') \
+                                   for projectId in added]) \
+                            for key in projectContents)
+            metadata['XNAT_LEVEL'] = ['projects'] * len(added)
+            metadata['MERGED_LABEL'] = added
+            self.makeTreeItems(parentItem = self, children = added, 
+                               metadata = metadata, 
+                               expandible = [0] * len(added))
+
+
+
+
     def getParentItemByXnatLevel(self, item, xnatLevel):
         """
         """
@@ -735,7 +970,7 @@ class View_Tree(View, qt.QTreeWidget):
         """
         if not item and self.currentItem():
             item = self.currentItem()
-        self.onTreeItemExpanded(item)
+        self.onTreeItemExpanded(item, background = False)
         
 
 
@@ -946,10 +1181,18 @@ class View_Tree(View, qt.QTreeWidget):
 
 
             
-    def onTreeItemExpanded(self, item):
+    def onTreeItemExpanded(self, item, background = True):
         """ When the user interacts with the treeView, 
             this is a hook method that gets the branches 
             of a treeItem and expands them.
+
+            @param item: The expanded item.
+            @type item: qt.QTreeWidgetItem
+
+            @param background: Whether to get the branches in the 
+                background (see 'getChildren').  Callers that need the 
+                branches on return pass False.
+            @type background: bool
         """ 
         self.manageTreeNode(item, 0)
         self.setCurrentItem(item)
@@ -957,10 +1200,29 @@ class View_Tree(View, qt.QTreeWidget):
         if not 'files' in item.text(self.columns['XNAT_LEVEL']['location']) \
            and \
           not 'Slicer' in item.text(self.columns['XNAT_LEVEL']['location']):
-            self.getChildren(item, expanded = True) 
+            self.getChildren(item, expanded = True, background = background) 
         self.resizeColumns()
 
 
+
+
+    def onTreeItemCollapsed(self, item):
+        """ 
+        Cancels the background fetch of the collapsed item's branches, if 
+        there is one.
+
+        @param item: The collapsed item.
+        @type item: qt.QTreeWidgetItem
+        """
+        for fetchKey, fetch in list(self.pendingFetches.items()):
+            if fetch['item'] is item:
+                fetch['cancelToken'].set()
+                del self.pendingFetches[fetchKey]
+                if not fetch['refresh']:
+                    self.dropPendingPages(item)
+                    item.takeChildren()
+
+
             
             
     def getChildrenNotExpanded(self, item):
@@ -995,6 +1257,15 @@ class View_Tree(View, qt.QTreeWidget):
         itemLevel = item.text(xnatLevelColumnNumber).strip(" ")
 
 
+
+        #------------------------
+        # Placeholder of more children: add them.
+        #------------------------
+        if itemLevel == self.MORE_LEVEL:
+            self.fetchMore(item)
+            return
+
+
         #------------------------
         # Set the value of 'item'
         #------------------------        
@@ -1043,6 +1314,7 @@ class View_Tree(View, qt.QTreeWidget):
         # the node level to construct the dictionary that
         # feeds the 'Details' GroupBox.
         #------------------------
+        self.hydrateItem(item)
         detailsDict = self.getRowValues(item)  
         detailsDict['XNAT_LEVEL'] = itemLevel
 
@@ -1290,7 +1562,8 @@ class View_Tree(View, qt.QTreeWidget):
             #
             if self.currentItem() == None:
                 self.setCurrentItem(foundProjects[0])
-                self.onTreeItemExpanded(self.currentItem())
+                self.onTreeItemExpanded(self.currentItem(), 
+                                        background = False)
                 self.selectItem_byUri(pathStr)
                 return
                 
@@ -1319,9 +1592,18 @@ class View_Tree(View, qt.QTreeWidget):
 
     
         
-    def getChildren(self, item, expanded, setCurrItem = True):
+    def getChildren(self, item, expanded, setCurrItem = True, 
+                    background = False):
         """ Gets the branches of a particular treeItem 
             via an XnatIo.   
+
+            @param background: Fetch the branches in the background, 
+                showing a 'Loading...' child meanwhile.  Overlapping 
+                fetches of the same item are merged, and collapsing the 
+                item cancels its fetch (see 'onTreeItemCollapsed').
+                Branches that were already fetched are kept, and only 
+                replaced if the server listing has changed.
+            @type background: bool
         """       
 
         #--------------------
@@ -1333,18 +1615,31 @@ class View_Tree(View, qt.QTreeWidget):
 
 
         
-        #--------------------
-        # Remove existing children for reload
-        #--------------------
-        item.takeChildren()
-
-        
-            
         #--------------------
         # Get path 
         #--------------------           
         pathObj = self.getXnatUriObject(item)
         currXnatLevel = pathObj['currLevel']
+        fetchKey = '|'.join(pathObj['childQueryUris'])
+        if background and fetchKey in self.pendingFetches:
+            return
+
+
+        
+        #--------------------
+        # Keep already fetched children, checking them against
+        # the server once they are no longer fresh.  Otherwise remove
+        # the existing children for reload.
+        #--------------------
+        fetchedTime = item.data(0, self.FETCHED_TIME_ROLE)
+        refresh = background and bool(fetchedTime) and item.childCount() > 0
+        if refresh:
+            if time.time() - float(fetchedTime) < self.CHILDREN_FRESH_TIME \
+               and float(fetchedTime) > self.columnsChangedTime:
+                return
+        else:
+            self.dropPendingPages(item)
+            item.takeChildren()
 
         
             
@@ -1357,15 +1652,271 @@ class View_Tree(View, qt.QTreeWidget):
             queryArguments = ['imagesonly']
 
 
+
+        #--------------------
+        # The experiments of a subject are made from the project
+        # hierarchy, if there is one.  Synchronous callers (e.g. 
+        # folder creation) need the current listing.
+        #--------------------
+        if background and currXnatLevel == 'experiments' and not refresh:
+            metadata = self.getHierarchyExperiments(pathObj)
+            if metadata != None:
+                signature = self.makeChildrenSignature(metadata, None, 
+                                        self.getQueryMetadata(currXnatLevel),
+                                        self.getListingMetadata(currXnatLevel))
+                self.populateChildren(item, pathObj, metadata, None, 
+                                      hydrated = True)
+                self.markChildrenFetched(item, signature)
+                return
+
+
+                
+        #--------------------
+        # Children with Slicer URIs are queried alongside
+        # the folder contents (see below).
+        #--------------------
+        cancelToken = threading.Event()
+        slicerFuture = None
+        if 'slicerQueryUris' in pathObj:
+            slicerFuture = self.MODULE.XnatIo.\
+                           getFolderAsync(pathObj['slicerQueryUris'], \
+                                          Xnat.metadata.getTagsByLevel('files'),
+                                          cancelToken = cancelToken)
+
+
                 
         #--------------------
-        # Get folder contents via metadata.  
-        # Set nodeNames from metadata.
+        # Get folder contents via metadata, in the background
+        # if requested.
         #-------------------- 
-        metadata = self.MODULE.XnatIo.getFolder(pathObj['childQueryUris'], 
-                                                Xnat.metadata.\
-                                                getTagsByLevel(currXnatLevel), \
-                                                queryArguments)
+        if not background:
+            metadata = self.MODULE.XnatIo.getFolder(pathObj['childQueryUris'], 
+                                    self.getListingMetadata(currXnatLevel), 
+                                    queryArguments)
+            slicerMetadata = slicerFuture.result() if slicerFuture else None
+            if metadata == None:
+                return
+            signature = self.makeChildrenSignature(metadata, slicerMetadata, 
+                                        self.getQueryMetadata(currXnatLevel),
+                                        self.getListingMetadata(currXnatLevel))
+            self.populateChildren(item, pathObj, metadata, slicerMetadata)
+            self.markChildrenFetched(item, signature)
+            return
+
+        if not refresh:
+            loadingItem = qt.QTreeWidgetItem()
+            loadingItem.setText(self.columns['MERGED_LABEL']['location'], 
+                                'Loading...')
+            loadingItem.setChildIndicatorPolicy(1)
+            loadingItem.setFont(self.columns['MERGED_LABEL']['location'], 
+                                self.itemFonts['category'])
+            item.addChild(loadingItem)
+
+        projectId = pathObj['pathDict']['projects']
+        if currXnatLevel == 'subjects':
+            future = self.MODULE.XnatIo.getProjectHierarchyAsync(projectId, 
+                cancelToken = cancelToken, 
+                subjectMetadata = self.getListingMetadata('subjects'), 
+                experimentMetadata = self.getQueryMetadata('experiments'))
+        else:
+            future = self.MODULE.XnatIo.getFolderAsync(
+                pathObj['childQueryUris'], 
+                self.getListingMetadata(currXnatLevel), 
+                queryArguments, cancelToken = cancelToken)
+        fetch = {'item': item, 'cancelToken': cancelToken, 
+                 'refresh': refresh}
+        self.pendingFetches[fetchKey] = fetch
+
+        def onFetched(future):
+            if self.pendingFetches.get(fetchKey) is not fetch or \
+               cancelToken.is_set():
+                return
+            del self.pendingFetches[fetchKey]
+            try:
+                metadata = future.result()
+                slicerMetadata = slicerFuture.result() if slicerFuture \
+                                 else None
+                if currXnatLevel == 'subjects':
+                    metadata = self.storeHierarchy(projectId, metadata)
+            except Exception as e:
+                print("Failed to get the children of '%s': %s"%(
+                    pathObj['childQueryUris'], str(e)))
+                metadata = None
+            #
+            # A failed or unchanged refresh leaves the children as 
+            # they are.
+            #
+            if refresh and metadata == None:
+                return
+            signature = self.makeChildrenSignature(metadata, slicerMetadata, 
+                                        self.getQueryMetadata(currXnatLevel),
+                                        self.getListingMetadata(currXnatLevel))
+            if refresh and signature == \
+               str(item.data(0, self.FETCHED_SIGNATURE_ROLE)):
+                self.markChildrenFetched(item, signature)
+                return
+            self.dropPendingPages(item)
+            item.takeChildren()
+            if metadata == None:
+                #
+                # Leave the branch to be fetched on the next expansion.
+                #
+                item.setData(0, self.FETCHED_TIME_ROLE, None)
+                item.setData(0, self.FETCHED_SIGNATURE_ROLE, None)
+                item.setChildIndicatorPolicy(0)
+                item.setExpanded(False)
+                return
+            #
+            # The selection may have moved on since the expansion.
+            #
+            currentItem = self.currentItem()
+            self.populateChildren(item, pathObj, metadata, slicerMetadata)
+            self.markChildrenFetched(item, signature)
+            self.setCurrentItem(currentItem)
+            self.resizeColumns()
+
+        self.runWhenDone(future, lambda future: self.runWhenDone(
+            slicerFuture or future, lambda slicerFuture: onFetched(future)))
+
+
+
+
+    def storeHierarchy(self, projectId, hierarchy):
+        """ 
+        Keeps a project hierarchy for 'getHierarchyExperiments'.
+
+        @param projectId: The ID of the project.
+        @type projectId: str
+
+        @param hierarchy: The 'Xnat.io.getProjectHierarchy' result.
+        @type hierarchy: dict
+
+        @return: The subjects of the project, as 'getFolder' contents, or 
+            None if there is no hierarchy.  A hierarchy without experiments
+            (see 'Xnat.io.getProjectHierarchy') only gives its subjects.
+        @rtype: dict
+        """
+        if hierarchy == None or hierarchy['experiments'] == None:
+            self.projectHierarchies.pop(projectId, None)
+            return hierarchy and hierarchy['subjects']
+        self.projectHierarchies[projectId] = {'stored': time.time(), 
+                                              'hierarchy': hierarchy}
+        return hierarchy['subjects']
+
+
+
+
+    def getHierarchyExperiments(self, pathObj):
+        """ 
+        Returns the experiments of a subject from its project hierarchy 
+        (see 'storeHierarchy').
+
+        @param pathObj: The 'getXnatUriObject' of the subject.
+        @type pathObj: dict
+
+        @return: A copy of the experiments, as 'getFolder' contents, or 
+            None if there is no recent hierarchy for the subject.
+        @rtype: dict
+        """
+        stored = self.projectHierarchies.get(pathObj['pathDict']['projects'])
+        if not stored or \
+           time.time() - stored['stored'] > self.HIERARCHY_MAX_AGE:
+            return None
+        experiments = stored['hierarchy']['experiments'].\
+                      get(pathObj['pathDict']['subjects'])
+        if experiments == None:
+            return None
+        return dict((key, list(value)) for key, value in experiments.items())
+
+
+
+
+    @staticmethod
+    def makeChildrenSignature(metadata, slicerMetadata, columns = None, 
+                              tags = None):
+        """ 
+        Returns a digest of the folder contents that 'getChildren' made 
+        the branches of an item from, for comparing with later fetches.
+
+        @param metadata: The 'getFolder' contents of the children.
+        @type metadata: dict
+
+        @param slicerMetadata: The 'getFolder' contents of the Slicer 
+            files, or None.
+        @type slicerMetadata: dict
+
+        @param columns: The metadata tags shown of the children, so that 
+            hydrated branches (see 'queueHydration') are rebuilt when 
+            they change.
+        @type columns: list.<str>
+
+        @param tags: The tags of 'metadata' to sign, in any row order.  
+            Branches made with more tags than a refetch lists (e.g. from 
+            a project hierarchy) then sign the same as the refetch.  
+            Defaults to all of them.
+        @type tags: list.<str>
+
+        @rtype: str
+        """
+        metadata = metadata or {}
+        if tags != None:
+            keys = sorted(key for key in metadata if key in tags)
+            metadata = {'rows': sorted(itertools.zip_longest(
+                *[metadata[key] for key in keys], fillvalue = ''), 
+                                       key = repr), 
+                        'keys': keys}
+        contents = [sorted(metadata.items()), 
+                    sorted((slicerMetadata or {}).items()), 
+                    list(columns or [])]
+        return hashlib.md5(repr(contents).encode('utf-8')).hexdigest()
+
+
+
+
+    def markChildrenFetched(self, item, signature):
+        """ 
+        Records when the branches of an item were fetched, and from 
+        which listing (see 'makeChildrenSignature').
+
+        @param item: The item whose branches were fetched.
+        @type item: qt.QTreeWidgetItem
+
+        @param signature: The signature of the fetched listing.
+        @type signature: str
+        """
+        item.setData(0, self.FETCHED_TIME_ROLE, time.time())
+        item.setData(0, self.FETCHED_SIGNATURE_ROLE, signature)
+
+
+
+
+    def populateChildren(self, item, pathObj, metadata, slicerMetadata, 
+                         hydrated = False):
+        """ 
+        Makes the branches of a treeItem from the folder contents 
+        retrieved by 'getChildren'.
+
+        @param item: The item to add the branches to.
+        @type item: qt.QTreeWidgetItem
+
+        @param pathObj: The 'getXnatUriObject' of the item.
+        @type pathObj: dict
+
+        @param metadata: The 'getFolder' contents of the children.
+        @type metadata: dict
+
+        @param slicerMetadata: The 'getFolder' contents of the Slicer 
+            files, for items that have them (otherwise None).
+        @type slicerMetadata: dict
+
+        @param hydrated: Whether 'metadata' already has every column 
+            (e.g. from a project hierarchy), so that the branches don't
+            need hydrating (see 'queueHydration').
+        @type hydrated: bool
+        """
+        if metadata == None:
+            return
+        currXnatLevel = pathObj['currLevel']
 
 
 
@@ -1400,9 +1951,7 @@ class View_Tree(View, qt.QTreeWidget):
         # Special case for children with Slicer URIs
         #--------------------
         if 'slicerQueryUris' in pathObj:
-            slicerMetadata = self.MODULE.XnatIo.\
-                             getFolder(pathObj['slicerQueryUris'], \
-                                       Xnat.metadata.getTagsByLevel('files'))
+            slicerMetadata = slicerMetadata or {}
             #print "SLICER METADATA", slicerMetadata
             #
             # Proceed only if the relevant metadata to retrieve Slicer
@@ -1461,12 +2010,175 @@ class View_Tree(View, qt.QTreeWidget):
         #-------------------- 
         self.makeTreeItems(parentItem = item, children = childNames, \
                            metadata = metadata, expandible = expandible)
+        if currXnatLevel in self.TWO_PHASE_LEVELS and not hydrated:
+            self.queueHydration(item, pathObj)
         item.setExpanded(True)
         self.setCurrentItem(item) 
             
 
         
             
+    def queueHydration(self, item, pathObj):
+        """ 
+        Registers the branches of an item, listed with their label tags 
+        only (see 'getListingMetadata'), for getting their other columns.
+
+        @param item: The item whose branches were made.
+        @type item: qt.QTreeWidgetItem
+
+        @param pathObj: The 'getXnatUriObject' of the item.
+        @type pathObj: dict
+        """
+        queryArguments = ['imagesonly'] \
+                         if pathObj['currLevel'] == 'experiments' else None
+        self.pendingHydrations['|'.join(pathObj['childQueryUris'])] = {
+            'item': item,
+            'uris': pathObj['childQueryUris'],
+            'level': pathObj['currLevel'],
+            'queryArguments': queryArguments
+        }
+        self.hydrationTimer.start()
+
+
+
+
+    def hydrateVisible(self):
+        """ 
+        Hydrates one queued branch with children in view, in the 
+        background, then waits for the tree to be idle again.
+        """
+        if self.hydrating:
+            return
+        viewportHeight = self.viewport().height
+        for key, pending in list(self.pendingHydrations.items()):
+            item = pending['item']
+            try:
+                if item.treeWidget() is None:
+                    del self.pendingHydrations[key]
+                    continue
+                if not item.isExpanded() or item.childCount() == 0:
+                    continue
+                top = self.visualItemRect(item.child(0))
+                bottom = self.visualItemRect(item.child(item.childCount() - 1))
+            except RuntimeError:
+                del self.pendingHydrations[key]
+                continue
+            if top.height() > 0 and bottom.height() > 0 and \
+               top.top() < viewportHeight and bottom.bottom() > 0:
+                self.hydrate(key, background = True)
+                return
+
+
+
+
+    def hydrateItem(self, item):
+        """ 
+        Hydrates the branch of an item at once, if it is queued (see 
+        'queueHydration').
+
+        @param item: The item.
+        @type item: qt.QTreeWidgetItem
+        """
+        parentItem = item.parent()
+        if parentItem is None:
+            return
+        for key, pending in list(self.pendingHydrations.items()):
+            if pending['item'] is parentItem:
+                self.hydrate(key, background = False)
+                return
+
+
+
+
+    def hydrate(self, key, background = False):
+        """ 
+        Gets the 'getQueryMetadata' columns of a queued branch and fills 
+        them into its items.
+
+        @param key: The 'pendingHydrations' key of the branch.
+        @type key: str
+
+        @param background: Whether to get the columns in the background.
+        @type background: bool
+        """
+        pending = self.pendingHydrations.pop(key, None)
+        if not pending:
+            return
+        args = (pending['uris'], self.getQueryMetadata(pending['level']), 
+                pending['queryArguments'])
+        if not background:
+            self.applyHydration(pending, 
+                                self.MODULE.XnatIo.getFolder(*args))
+            return
+
+        self.hydrating = True
+        def onHydrated(future):
+            self.hydrating = False
+            try:
+                metadata = future.result()
+            except Exception as e:
+                print("Failed to get the columns of '%s': %s"%(
+                    pending['uris'], str(e)))
+                metadata = None
+            self.applyHydration(pending, metadata)
+            self.hydrationTimer.start()
+        self.runWhenDone(self.MODULE.XnatIo.getFolderAsync(*args), onHydrated)
+
+
+
+
+    def applyHydration(self, pending, metadata):
+        """ 
+        Fills the columns of a hydrated branch, including those of the 
+        children that haven't been added yet (see 'makeMoreItem').
+
+        @param pending: The 'pendingHydrations' entry of the branch.
+        @type pending: dict
+
+        @param metadata: The 'getFolder' contents of the branch.
+        @type metadata: dict
+        """
+        level = pending['level']
+        labelTag = self.getMergedLabelTagByLevel(level)
+        if not metadata or not labelTag in metadata:
+            return
+        rowIndices = dict((label, i) for i, label in \
+                          enumerate(metadata[labelTag]))
+        def getRow(label):
+            i = rowIndices.get(label)
+            if i == None:
+                return None
+            row = dict((key, values[i]) for key, values in metadata.items() \
+                       if i < len(values))
+            row['XNAT_LEVEL'] = level
+            return row
+
+        item = pending['item']
+        labelColumn = self.columns['MERGED_LABEL']['location']
+        levelColumn = self.columns['XNAT_LEVEL']['location']
+        try:
+            self.infoMetadataCache = {}
+            self.setUpdatesEnabled(False)
+            for i in range(0, item.childCount()):
+                child = item.child(i)
+                if child.text(levelColumn).strip(" ") != level:
+                    continue
+                row = getRow(child.text(labelColumn))
+                if row:
+                    self.populateColumns(child, row)
+        except RuntimeError:
+            return
+        finally:
+            self.setUpdatesEnabled(True)
+
+        for page in self.pendingPages.get(item, {}).values():
+            rows = [getRow(label) or {} for label in page['children']]
+            for key in metadata:
+                page['metadata'][key] = [row.get(key, '') for row in rows]
+
+
+
+
     def condenseDicomsToOneName(self, names):
         """ Takes a list of DICOM files and condenses 
             them into one name.
@@ -1533,7 +2245,24 @@ class View_Tree(View, qt.QTreeWidget):
         # Refresh all of the column values in the 
         # visible nodes.
         #--------------------
+        self.infoMetadataCache = {}
+        self.setUpdatesEnabled(False)
         self.loopVisible(self.populateColumns)
+        self.setUpdatesEnabled(True)
+        self.applyColumnVisibility()
+
+
+
+
+    def onColumnSettingsChanged(self):
+        """
+        Forgets what was fetched for the previous column settings: the 
+        metadata requested per level and the project hierarchies.  Kept 
+        branches are refreshed the next time they're expanded.
+        """
+        self.queryMetadataCache = {}
+        self.projectHierarchies = {}
+        self.columnsChangedTime = time.time()
 
 
 
@@ -1548,6 +2277,7 @@ class View_Tree(View, qt.QTreeWidget):
         unhighlighted.
         """
         ##print self.browser.utils.lf(), "Begin"
+        self.infoMetadataCache = {}
         root = self.invisibleRootItem()
         childCount = root.childCount()
         for i in range(childCount):
@@ -1610,14 +2340,34 @@ class View_Tree(View, qt.QTreeWidget):
         
         
         #------------------------
-        # Add children to parentItem
+        # Only the first CHILD_PAGE_SIZE children are added now.
+        # The rest wait for 'fetchMore'.
+        #------------------------
+        remainingPage = None
+        if len(children) > self.CHILD_PAGE_SIZE:
+            remainingPage = {
+                'parent': parentItem,
+                'children': children[self.CHILD_PAGE_SIZE:],
+                'metadata': dict((key, val[self.CHILD_PAGE_SIZE:]) \
+                                 for key, val in metadata.items()),
+                'expandible': expandible[self.CHILD_PAGE_SIZE:] \
+                              if expandible else None
+            }
+            children = children[:self.CHILD_PAGE_SIZE]
+
+
+
+        #------------------------
+        # Make the children without a parent, so that
+        # they can be added as one batch below.
         #------------------------
+        self.infoMetadataCache = {}
         treeItems = []
         for i in range(0, len(children)):
             ##print "\n\nCHILDREN: ", children[i]
 
             
-            treeNode = qt.QTreeWidgetItem(parentItem)
+            treeNode = qt.QTreeWidgetItem()
             #
             # Set expanded (0 = expandable, 1 = not)
             #
@@ -1655,23 +2405,184 @@ class View_Tree(View, qt.QTreeWidget):
                 treeItems.append(treeNode) 
 
 
+
+        #------------------------
+        # Add the remaining children's placeholder.
+        #------------------------
+        if remainingPage:
+            treeItems.append(self.makeMoreItem(remainingPage))
+
+
                 
         #------------------------    
+        # Add the batch with sorting and painting suspended.
         # SPECIAL CASE: If at project level, set parents accordingly.
         #------------------------
-        if str(parentItem.__class__) == "<class 'View_Tree.View_Tree'>":
+        sortingEnabled = self.isSortingEnabled()
+        self.setSortingEnabled(False)
+        self.setUpdatesEnabled(False)
+        if parentItem is self:
             parentItem.addTopLevelItems(treeItems)
+        else:
+            parentItem.addChildren(treeItems)
+        self.setUpdatesEnabled(True)
+        self.setSortingEnabled(sortingEnabled)
+        self.applyColumnVisibility()
+
+
+
+
+    def makeMoreItem(self, page):
+        """ 
+        Makes the placeholder item of children that haven't been added yet.
+
+        @param page: The remaining 'children', 'metadata' and 'expandible' 
+            arguments of 'makeTreeItems', and their 'parent'.
+        @type page: dict
+
+        @return: The placeholder item.
+        @rtype: qt.QTreeWidgetItem
+        """
+        self.pageCount += 1
+        token = str(self.pageCount)
+        moreItem = qt.QTreeWidgetItem()
+        moreItem.setText(self.columns['MERGED_LABEL']['location'], 
+                         'Show %i more...'%(len(page['children'])))
+        moreItem.setText(self.columns['XNAT_LEVEL']['location'], 
+                         self.MORE_LEVEL)
+        moreItem.setData(0, 32, token)
+        moreItem.setChildIndicatorPolicy(1)
+        moreItem.setFont(self.columns['MERGED_LABEL']['location'], 
+                         self.itemFonts['category'])
+        self.changeFontColor(moreItem, False, "grey", 
+                             self.columns['MERGED_LABEL']['location'])
+        page['item'] = moreItem
+        self.pendingPages.setdefault(page['parent'], {})[token] = page
+        return moreItem
+
+
+
+
+    def dropPendingPages(self, item):
+        """ 
+        Forgets the pages of 'item's children and of their descendants.  
+        Called before the children are taken.
+
+        @param item: The item whose children are taken, or the tree.
+        @type item: qt.QTreeWidgetItem | View_Tree
+        """
+        if item is self:
+            self.pendingPages = {}
             return
-        
+        for parentItem in list(self.pendingPages):
+            ancestor = parentItem
+            while ancestor and ancestor is not self and ancestor is not item:
+                ancestor = ancestor.parent()
+            if ancestor is item:
+                del self.pendingPages[parentItem]
+
+
+
+
+    def cancelFetches(self, item):
+        """ 
+        Cancels the background fetches of the branches of 'item' and of its
+        descendants (see 'getChildren').  Called before the items are 
+        removed, so that no fetch fills them in afterwards.
+
+        @param item: The item whose branches are removed, or the tree.
+        @type item: qt.QTreeWidgetItem | View_Tree
+        """
+        for fetchKey, fetch in list(self.pendingFetches.items()):
+            ancestor = fetch['item']
+            try:
+                while ancestor and ancestor is not item:
+                    ancestor = ancestor.parent()
+            except RuntimeError:
+                ancestor = item
+            if item is self or ancestor is item:
+                fetch['cancelToken'].set()
+                del self.pendingFetches[fetchKey]
+
+
+
+
+    def clear(self):
+        """ 
+        Removes every item, the pages of their children, and the fetches
+        and hydrations of their branches.
+        """
+        self.cancelFetches(self)
+        self.pendingHydrations = {}
+        self.dropPendingPages(self)
+        qt.QTreeWidget.clear(self)
+
+
+
+
+    def fetchMore(self, moreItem):
+        """ 
+        Replaces a placeholder item made by 'makeMoreItem' with the 
+        next page of children.
+
+        @param moreItem: The placeholder item.
+        @type moreItem: qt.QTreeWidgetItem
+        """
+        token = str(moreItem.data(0, 32))
+        page = None
+        for parentItem, pages in list(self.pendingPages.items()):
+            if token in pages:
+                page = pages.pop(token)
+                if not pages:
+                    del self.pendingPages[parentItem]
+                break
+        if not page:
+            return
+
+        parentItem = page['parent']
+        if parentItem is self:
+            self.takeTopLevelItem(self.indexOfTopLevelItem(moreItem))
+        else:
+            parentItem.removeChild(moreItem)
+
+        self.makeTreeItems(parentItem = parentItem, 
+                           children = page['children'], 
+                           metadata = page['metadata'], 
+                           expandible = page['expandible'])
 
-        
-        #------------------------    
-        # Items array gets added to parentItem.
-        #------------------------
-        parentItem.addChildren(treeItems)
 
 
 
+    def onScrolled(self, value):
+        """ 
+        Adds the next page of children of the placeholder items in 
+        view once the tree is scrolled to the bottom, and restarts the 
+        idle timer of 'hydrateVisible'.
+
+        @param value: The scroll bar value.
+        @type value: int
+        """
+        self.hydrationTimer.start()
+        if value < self.verticalScrollBar().maximum:
+            return
+        viewportHeight = self.viewport().height
+        for pages in list(self.pendingPages.values()):
+            for page in list(pages.values()):
+                #
+                # Skip placeholders that were removed with their branch.
+                #
+                try:
+                    if page['item'].treeWidget() is None:
+                        continue
+                    rect = self.visualItemRect(page['item'])
+                    inView = not page['item'].isHidden() and \
+                             rect.height() > 0 and rect.top() < viewportHeight
+                except RuntimeError:
+                    continue
+                if inView:
+                    self.fetchMore(page['item'])
+
+
 
 
             
@@ -1714,21 +2625,6 @@ class View_Tree(View, qt.QTreeWidget):
         Qt::MatchRecursive	64	Searches the entire hierarchy.
         """
 
-        ##print MokaUtils.debug.lf(), "Disconnecting item expanded."
-        self.disconnect("itemExpanded(QTreeWidgetItem *)", \
-                        self.onTreeItemExpanded)
-        #SEARCH_TIMER = Timer(self.MODULE)
-
-
-        
-        #------------------------
-        # Deslect any selected items.
-        #------------------------  
-        for selectedItem in self.selectedItems():
-            selectedItem.setSelected(False)
-
-
-            
         #------------------------
         # Get searchString from MODULE.  Remove starting 
         # and ending white spaces via '.strip()'
@@ -1739,12 +2635,26 @@ class View_Tree(View, qt.QTreeWidget):
         
         #------------------------
         # Return out if searchString is all
-        # white spaces. 
+        # white spaces.
         # NOTE: .strip() is called on it above.
         #------------------------
-        if len(searchString) == 0:
+        if len(searchString) == 0 or \
+           searchString == self.MODULE.SearchBar.defaultSearchText:
             return
 
+        ##print MokaUtils.debug.lf(), "Disconnecting item expanded."
+        self.disconnect("itemExpanded(QTreeWidgetItem *)", \
+                        self.onTreeItemExpanded)
+        #SEARCH_TIMER = Timer(self.MODULE)
+
+
+        
+        #------------------------
+        # Deslect any selected items.
+        #------------------------  
+        for selectedItem in self.selectedItems():
+            selectedItem.setSelected(False)
+
 
         
         #------------------------
@@ -1819,14 +2729,83 @@ class View_Tree(View, qt.QTreeWidget):
 
         
         #------------------------
-        # Run the search method in the
-        # XnatIo.
+        # Run the search method of the XnatIo in the
+        # background, abandoning any previous search.
+        # Only the newest search reaches the tree 
+        # (see 'onServerSearchDone').
         #------------------------
-        #SEARCH_TIMER.start("Server search")
-        serverQueryResults = self.MODULE.XnatIo.search(searchString)
-        #SEARCH_TIMER.stop()
+        self.cancelSearch()
+        self.searchString = searchString
+        self.searchCancelToken = threading.Event()
+        generation = self.searchGeneration
+        future = self.MODULE.XnatIo.searchAsync(searchString, 
+                                                self.searchCancelToken)
+        self.runWhenDone(future, lambda future: \
+                         self.onServerSearchDone(future, searchString, 
+                                                 generation))
+
+        self.connect("itemExpanded(QTreeWidgetItem *)", self.onTreeItemExpanded)
+
+
+
+
+    def searchDebounced(self):
+        """ 
+        Runs 'searchEntered' once the user pauses typing (see 
+        'SearchBar.connectDebounced'), for search strings of at least
+        SEARCH_MIN_LENGTH characters that weren't just searched.
+        """
+        searchString = self.MODULE.SearchBar.getText()
+        if len(searchString) >= self.SEARCH_MIN_LENGTH and \
+           searchString != self.searchString:
+            self.searchEntered()
+
+
+
+
+    def cancelSearch(self):
+        """ 
+        Abandons the running background search, if any.
+        """
+        if self.searchCancelToken:
+            self.searchCancelToken.set()
+        self.searchCancelToken = None
+        self.searchGeneration += 1
+        self.searchString = None
+
+
+
+
+    def onServerSearchDone(self, future, searchString, generation):
+        """ 
+        Adds the results of a background server search to the tree. 
+        Runs on the UI thread.  Results of searches that have been 
+        superseded or cancelled are dropped.
+
+        @param future: The 'searchAsync' future.
+        @type future: concurrent.futures.Future
+
+        @param searchString: The search query string.
+        @type searchString: str
+
+        @param generation: The 'searchGeneration' the search was started 
+            with.
+        @type generation: int
+        """
+        if generation != self.searchGeneration or future.cancelled():
+            return
+        try:
+            serverQueryResults = future.result()
+        except Exception as e:
+            print("Search for '%s' failed: %s"%(searchString, str(e)))
+            return
+        if serverQueryResults == None:
+            return
+
+        self.disconnect("itemExpanded(QTreeWidgetItem *)", \
+                        self.onTreeItemExpanded)
+
 
-        
 
         #------------------------
         # Establish searchable levels: 
@@ -2008,6 +2987,97 @@ class View_Tree(View, qt.QTreeWidget):
     
         
 
+    def searchAsYouType(self, text = None):
+        """ 
+        Filters the tree as the user types, using the local search index of
+        the XnatIo (i.e. everything retrieved so far) instead of the 
+        server.  Pressing enter still runs the full search 
+        ('searchEntered').
+
+        @param text: The current search text (from the 'textEdited' 
+            signal).
+        @type text: str
+        """
+        searchString = self.MODULE.SearchBar.getText()
+        if not self.MODULE.XnatIo or \
+           searchString == self.MODULE.SearchBar.defaultSearchText:
+            return
+
+        self.disconnect("itemExpanded(QTreeWidgetItem *)", \
+                        self.onTreeItemExpanded)
+
+        #------------------------
+        # Show everything again if the search line was cleared.
+        #------------------------
+        if len(searchString) == 0:
+            self.cancelSearch()
+            def showAll(child):
+                child.setHidden(False)
+            self.loopVisible(showAll)
+            self.MODULE.Viewer.setNoResultsWidgetVisible(False)
+            self.connect("itemExpanded(QTreeWidgetItem *)", \
+                         self.onTreeItemExpanded)
+            return
+
+
+
+        #------------------------
+        # Query the index.  Projects, subjects and experiments
+        # are matched by ID, scans and files by URI.
+        #------------------------
+        results = self.MODULE.XnatIo.searchLocal(searchString)
+        matchedIds = set()
+        matchedUris = set()
+        for level, rows in results.items():
+            for row in rows:
+                if level in ('scans', 'files'):
+                    matchedUris.add(row.get('URI'))
+                else:
+                    matchedIds.add(row.get('ID') or row.get('id'))
+
+
+
+        #------------------------
+        # One pass over the tree: show the matches, hide the rest.
+        #------------------------
+        matchedItems = []
+        def showMatched(child):
+            if self.getItemLevel(child) in ('scans', 'files'):
+                matched = child.text(self.getColumn('URI')) in matchedUris
+            else:
+                matched = child.text(self.getColumn('ID')) in matchedIds or \
+                          child.text(self.getColumn('id')) in matchedIds
+            child.setHidden(not matched)
+            if matched:
+                matchedItems.append(child)
+        self.loopVisible(showMatched)
+
+        for item in matchedItems:
+            parent = item.parent()
+            while parent:
+                parent.setHidden(False)
+                parent.setExpanded(True)
+                parent = parent.parent()
+
+
+
+        #------------------------
+        # For no results found...
+        #------------------------
+        if len(matchedItems) == 0:
+            self.MODULE.Viewer.noSearchResultsFound.setText(\
+                    "No results for '%s' yet.  "%(searchString) + 
+                    "Press enter to search the server.")
+            self.MODULE.Viewer.setNoResultsWidgetVisible(True)
+        else:
+            self.MODULE.Viewer.setNoResultsWidgetVisible(False)
+
+        self.connect("itemExpanded(QTreeWidgetItem *)", \
+                     self.onTreeItemExpanded)
+
+
+
+
     def searchAndShowExisting(self, searchString):
         """ Searches through all columns using 'Qt::MatchContains'
             for a match.  Highlights and selects treeItems that
@@ -0,0 +1,261 @@
+__author__ = "Sunil Kumar (kumar.sunil.p@gmail.com)"
+__copyright__ = "Copyright 2014, Washington University in St. Louis"
+__credits__ = ["Sunil Kumar", "Steve Pieper", "Dan Marcus"]
+__license__ = "XNAT Software License Agreement " + \
+              "(see: http://xnat.org/about/license.php)"
+__version__ = "2.1.1"
+__maintainer__ = "Rick Herrick"
+__email__ = "herrickr@mir.wustl.edu"
+__status__ = "Production"
+
+
+import os
+import sqlite3
+import threading
+
+# module
+from XnatSlicerGlobals import *
+
+
+
+class DicomPathIndex(object):
+    """
+    DicomPathIndex maps the XNAT paths of downloaded DICOM files to the
+    files in Slicer's DICOM database, so that checking whether a scan is
+    already in the database takes one indexed lookup per file instead of
+    a pass over the whole database.
+
+    The index is built once from the database, on a worker thread that 
+    reads the database file itself, and persists between sessions.  From 
+    then on it is kept up to date as files are added to the database, and
+    every hit is confirmed against the database when it is looked up, so
+    files removed from it drop out one by one.  It is rebuilt if Slicer 
+    switches to a different database.  Once it is built ('isReady'), a 
+    miss means the file isn't in the database.
+
+    index = DicomPathIndex()
+    index.sync(slicer.dicomDatabase)
+    index.addFiles(extractedFiles, slicer.dicomDatabase)
+    if index.isReady(slicer.dicomDatabase):
+        dbFiles = index.lookup(fileUris, slicer.dicomDatabase)
+    """
+
+    INDEX_NAME = 'dicomPathIndex.db'
+    SPLITTER = '/experiments/'
+
+
+    def __init__(self, indexPath = None):
+        """
+        @param indexPath: The path of the index file.  Defaults to
+            INDEX_NAME in the cache directory.
+        @type indexPath: str
+        """
+        self.indexPath = indexPath or \
+                         os.path.join(XnatSlicerGlobals.CACHE_URI,
+                                      self.INDEX_NAME)
+        if not os.path.exists(os.path.dirname(self.indexPath)):
+            os.makedirs(os.path.dirname(self.indexPath))
+
+        self.__lock = threading.Lock()
+        self.__buildThread = None
+        self.__db = sqlite3.connect(self.indexPath,
+                                    check_same_thread = False)
+        with self.__db:
+            self.__db.execute("CREATE TABLE IF NOT EXISTS paths ("
+                              "key TEXT PRIMARY KEY, path TEXT)")
+            self.__db.execute("CREATE TABLE IF NOT EXISTS info ("
+                              "name TEXT PRIMARY KEY, value TEXT)")
+
+
+
+
+    @staticmethod
+    def makeKey(path):
+        """
+        Returns the key of an XNAT file URI or a downloaded file path: its
+        path from the experiment to the (first) 'files' folder, and its
+        name.  Downloaded files nest the zip's own folders below that, so
+        both reduce to the same key.
+
+        @param path: The file URI or path.
+        @type path: str
+
+        @return: The key, or None if the path has no experiment.
+        @rtype: str
+        """
+        path = path.replace('\\', '/')
+        if not DicomPathIndex.SPLITTER in path:
+            return None
+        abbrevPath = path.split(DicomPathIndex.SPLITTER, 1)[1]
+        if '/files/' in abbrevPath:
+            return abbrevPath.split('/files/', 1)[0] + '/files/' + \
+                os.path.basename(abbrevPath)
+        return abbrevPath
+
+
+
+
+    def __getInfo(self, name):
+        """
+        @param name: The name of an 'info' value.
+        @type name: str
+
+        @return: The value, or None.
+        @rtype: str
+        """
+        with self.__lock:
+            row = self.__db.execute("SELECT value FROM info WHERE name = ?",
+                                    (name,)).fetchone()
+        return row[0] if row else None
+
+
+
+
+    def isReady(self, database):
+        """
+        @param database: The DICOM database (slicer.dicomDatabase).
+        @type database: ctk.ctkDICOMDatabase
+
+        @return: Whether the index was built from 'database'.
+        @rtype: bool
+        """
+        return self.__getInfo('built') == str(database.databaseFilename)
+
+
+
+
+    def sync(self, database):
+        """
+        Starts building the index from 'database' on a worker thread, 
+        unless it was already built from it or is being built.  A 
+        different database than the index was kept for empties it first.
+
+        @param database: The DICOM database (slicer.dicomDatabase).
+        @type database: ctk.ctkDICOMDatabase
+        """
+        databaseName = str(database.databaseFilename)
+        if self.isReady(database) or (self.__buildThread and \
+                                      self.__buildThread.is_alive()):
+            return
+        with self.__lock, self.__db:
+            row = self.__db.execute("SELECT value FROM info WHERE name = "
+                                    "'database'").fetchone()
+            if not row or row[0] != databaseName:
+                self.__db.execute("DELETE FROM paths")
+                self.__db.execute("INSERT OR REPLACE INTO info VALUES "
+                                  "('database', ?)", (databaseName,))
+        self.__buildThread = threading.Thread(target = self.__build,
+                                              args = (databaseName,))
+        self.__buildThread.daemon = True
+        self.__buildThread.start()
+
+
+
+
+    def __build(self, databaseName):
+        """
+        Indexes every file of the database at 'databaseName', read from 
+        its 'Images' table.  Runs on a worker thread, hence its own 
+        read-only connection to the database.  Files indexed meanwhile by 
+        'addFiles' are kept.
+
+        @param databaseName: The database file.
+        @type databaseName: str
+        """
+        try:
+            database = sqlite3.connect('file:%s?mode=ro'%(databaseName),
+                                       uri = True)
+            try:
+                rows = [(self.makeKey(path), path) for (path,) in \
+                        database.execute("SELECT Filename FROM Images") \
+                        if self.makeKey(path)]
+            finally:
+                database.close()
+        except Exception as e:
+            print("Unable to build the DICOM path index: %s"%(str(e)))
+            return
+        with self.__lock, self.__db:
+            row = self.__db.execute("SELECT value FROM info WHERE name = "
+                                    "'database'").fetchone()
+            if not row or row[0] != databaseName:
+                return
+            self.__db.executemany("INSERT OR IGNORE INTO paths VALUES "
+                                  "(?, ?)", rows)
+            self.__db.execute("INSERT OR REPLACE INTO info VALUES "
+                              "('built', ?)", (databaseName,))
+
+
+
+
+    def addFiles(self, paths, database = None):
+        """
+        Indexes files that are in the DICOM database.
+
+        @param paths: The file paths.
+        @type paths: list.<str>
+
+        @param database: The DICOM database the files are in.  Defaults to
+            the one the index is kept for.
+        @type database: ctk.ctkDICOMDatabase
+        """
+        if database is not None:
+            self.sync(database)
+        rows = [(self.makeKey(path), path) for path in paths \
+                if self.makeKey(path)]
+        with self.__lock, self.__db:
+            self.__db.executemany("INSERT OR REPLACE INTO paths VALUES "
+                                  "(?, ?)", rows)
+
+
+
+
+    def lookup(self, fileUris, database = None):
+        """
+        @param fileUris: The XNAT file URIs.
+        @type fileUris: list.<str>
+
+        @param database: The DICOM database to confirm each indexed file 
+            against.  Files that it no longer has, or that are gone from 
+            disk, are dropped from the index.
+        @type database: ctk.ctkDICOMDatabase
+
+        @return: The database file of each indexed URI, by URI.
+        @rtype: dict
+        """
+        dbFiles = {}
+        with self.__lock:
+            for fileUri in fileUris:
+                key = self.makeKey(fileUri)
+                if not key:
+                    continue
+                row = self.__db.execute("SELECT path FROM paths WHERE "
+                                        "key = ?", (key,)).fetchone()
+                if row:
+                    dbFiles[fileUri] = row[0]
+        if database is None:
+            return dbFiles
+
+        stale = [fileUri for fileUri, dbFile in dbFiles.items() \
+                 if not os.path.exists(dbFile) or \
+                 not database.seriesForFile(dbFile)]
+        if stale:
+            with self.__lock, self.__db:
+                self.__db.executemany("DELETE FROM paths WHERE key = ?",
+                                      [(self.makeKey(fileUri),) \
+                                       for fileUri in stale])
+            for fileUri in stale:
+                del dbFiles[fileUri]
+        return dbFiles
+
+
+
+
+    def close(self):
+        """
+        Waits for the index to be built, if it is being built, then closes
+        it.
+        """
+        if self.__buildThread:
+            self.__buildThread.join()
+        with self.__lock:
+            self.__db.close()
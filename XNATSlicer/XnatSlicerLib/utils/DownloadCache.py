@@ -0,0 +1,401 @@
+__author__ = "Sunil Kumar (kumar.sunil.p@gmail.com)"
+__copyright__ = "Copyright 2014, Washington University in St. Louis"
+__credits__ = ["Sunil Kumar", "Steve Pieper", "Dan Marcus"]
+__license__ = "XNAT Software License Agreement " + \
+              "(see: http://xnat.org/about/license.php)"
+__version__ = "2.1.1"
+__maintainer__ = "Rick Herrick"
+__email__ = "herrickr@mir.wustl.edu"
+__status__ = "Production"
+
+
+import os
+import time
+import errno
+import hashlib
+import sqlite3
+import threading
+import concurrent.futures
+
+# module
+from XnatSlicerGlobals import *
+
+
+
+class DownloadCache(object):
+    """
+    DownloadCache manages the files the loaders leave in the downloads
+    directory.  Every file is stored once, as a blob named by the digest of
+    its contents, and hardlinked back to the path the loaders expect, so the
+    same file reached through different projects or subjects only takes its
+    disk space once.  Blobs are evicted least recently used first once they
+    take more than 'quota' bytes, along with every path linked to them.
+    The quota is stored with the index, as it applies to the whole store 
+    whatever host the files came from.
+
+    A linked path shares its data with the blob, so whatever writes to the
+    downloads directory must replace existing files (remove, then write)
+    rather than rewrite them in place.
+
+    cache = DownloadCache()
+    cache.addFilesAsync(extractedFiles)
+    cache.touch(cachedFiles)
+    cache.enforceQuota()
+    """
+
+    BLOB_DIR = '.blobs'
+    INDEX_NAME = 'index.db'
+    HASH_CHUNK_SIZE = 1024 * 1024
+    DEFAULT_QUOTA = 20 * 1024 * 1024 * 1024
+
+    #
+    # Blobs used less than this many seconds ago are never evicted, so
+    # that enforcing the quota doesn't take the files just loaded.
+    #
+    EVICTION_GRACE = 300
+
+    #
+    # The errors of linking that mean the filesystem doesn't have hardlinks
+    # (or not across the downloads directory).  Any other error only skips
+    # the file.
+    #
+    LINKING_UNSUPPORTED = (errno.EXDEV, errno.EPERM, errno.ENOTSUP, 
+                           errno.EOPNOTSUPP)
+
+
+    def __init__(self, rootDir = None, quota = None):
+        """
+        @param rootDir: The managed directory.  Defaults to the downloads
+            directory.
+        @type rootDir: str
+
+        @param quota: The byte quota of the blobs.  Defaults to the stored
+            quota, or DEFAULT_QUOTA.
+        @type quota: int
+        """
+        self.rootDir = os.path.abspath(rootDir or \
+                            XnatSlicerGlobals.LOCAL_URIS['downloads'])
+        self.blobDir = os.path.join(self.rootDir, self.BLOB_DIR)
+        self.linkingSupported = True
+        if not os.path.exists(self.blobDir):
+            os.makedirs(self.blobDir)
+
+        self.__lock = threading.Lock()
+        #
+        # Files are hashed one batch at a time, off the event loop (see
+        # 'addFilesAsync').
+        #
+        self.__executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers = 1)
+        self.__db = sqlite3.connect(os.path.join(self.blobDir,
+                                                 self.INDEX_NAME),
+                                    check_same_thread = False)
+        with self.__db:
+            self.__db.execute("CREATE TABLE IF NOT EXISTS blobs ("
+                              "digest TEXT PRIMARY KEY, size INTEGER, "
+                              "used REAL, uses INTEGER)")
+            self.__db.execute("CREATE TABLE IF NOT EXISTS links ("
+                              "path TEXT PRIMARY KEY, digest TEXT)")
+            self.__db.execute("CREATE INDEX IF NOT EXISTS linksByDigest "
+                              "ON links (digest)")
+            self.__db.execute("CREATE TABLE IF NOT EXISTS info ("
+                              "name TEXT PRIMARY KEY, value TEXT)")
+            row = self.__db.execute("SELECT value FROM info WHERE name = "
+                                    "'quota'").fetchone()
+        self.quota = quota or (int(row[0]) if row else self.DEFAULT_QUOTA)
+
+
+
+
+    def setQuota(self, quota):
+        """
+        Sets and stores the byte quota of the blobs.  See 'enforceQuota'.
+
+        @param quota: The byte quota.
+        @type quota: int
+        """
+        self.quota = quota
+        with self.__lock, self.__db:
+            self.__db.execute("INSERT OR REPLACE INTO info VALUES "
+                              "('quota', ?)", (str(quota),))
+
+
+
+
+    def getBlobPath(self, digest):
+        """
+        @param digest: The digest of a blob.
+        @type digest: str
+
+        @return: The path of the blob.
+        @rtype: str
+        """
+        return os.path.join(self.blobDir, digest[:2], digest)
+
+
+
+
+    def addFiles(self, paths):
+        """
+        Moves files into the cache: each is replaced by a hardlink to the
+        blob of its contents, which is made if there isn't one yet.  Files
+        outside of 'rootDir' are left alone.
+
+        @param paths: The file paths.
+        @type paths: list.<str>
+
+        @return: The bytes saved by files whose contents were already
+            stored.
+        @rtype: int
+        """
+        saved = 0
+        for path in paths:
+            if not self.linkingSupported:
+                break
+            try:
+                saved += self.__addFile(os.path.abspath(path))
+            except OSError as e:
+                #
+                # Hardlinks need a filesystem that has them.  Other errors
+                # (e.g. a file that's open elsewhere) only skip the file.
+                #
+                print("Unable to cache '%s': %s"%(path, str(e)))
+                if e.errno in self.LINKING_UNSUPPORTED and \
+                   os.path.exists(path):
+                    self.linkingSupported = False
+        return saved
+
+
+
+
+    def addFilesAsync(self, paths):
+        """
+        Runs 'addFiles' on the cache's worker thread, after the files 
+        added before.  Hashing large files takes a while, and the loaders
+        don't need to wait for it.
+
+        @param paths: The file paths.
+        @type paths: list.<str>
+
+        @return: The future of the 'addFiles' result.
+        @rtype: concurrent.futures.Future
+        """
+        return self.__executor.submit(self.addFiles, list(paths))
+
+
+
+
+    def __addFile(self, path):
+        """
+        See 'addFiles'.
+
+        @param path: The absolute path of the file.
+        @type path: str
+
+        @return: The size of the file if its blob already existed,
+            otherwise 0.
+        @rtype: int
+        """
+        if not path.startswith(self.rootDir + os.sep) or \
+           path.startswith(self.blobDir + os.sep) or \
+           not os.path.isfile(path):
+            return 0
+
+        with self.__lock:
+            row = self.__db.execute("SELECT digest FROM links WHERE path = ?",
+                                    (path,)).fetchone()
+        if row and os.path.exists(self.getBlobPath(row[0])) and \
+           os.path.samefile(path, self.getBlobPath(row[0])):
+            self.touch([path])
+            return 0
+
+        digest = self.__hashFile(path)
+        blobPath = self.getBlobPath(digest)
+        size = os.path.getsize(path)
+        saved = 0
+        if os.path.exists(blobPath):
+            if not os.path.samefile(path, blobPath):
+                linkPath = path + '.link'
+                if os.path.exists(linkPath):
+                    os.remove(linkPath)
+                os.link(blobPath, linkPath)
+                os.replace(linkPath, path)
+                saved = size
+        else:
+            if not os.path.exists(os.path.dirname(blobPath)):
+                os.makedirs(os.path.dirname(blobPath))
+            os.link(path, blobPath)
+
+        with self.__lock, self.__db:
+            self.__db.execute("INSERT OR IGNORE INTO blobs VALUES "
+                              "(?, ?, 0, 0)", (digest, size))
+            self.__db.execute("UPDATE blobs SET used = ?, uses = uses + 1 "
+                              "WHERE digest = ?", (time.time(), digest))
+            self.__db.execute("INSERT OR REPLACE INTO links VALUES (?, ?)",
+                              (path, digest))
+        return saved
+
+
+
+
+    def __hashFile(self, path):
+        """
+        @param path: The file path.
+        @type path: str
+
+        @return: The SHA-1 digest of the file's contents.
+        @rtype: str
+        """
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+
+
+    def touch(self, paths):
+        """
+        Marks the blobs of the given paths as used now.
+
+        @param paths: The file paths.
+        @type paths: list.<str>
+        """
+        now = time.time()
+        with self.__lock, self.__db:
+            for path in paths:
+                self.__db.execute("UPDATE blobs SET used = ?, uses = uses + 1"
+                                  " WHERE digest = (SELECT digest FROM links "
+                                  "WHERE path = ?)",
+                                  (now, os.path.abspath(path)))
+
+
+
+
+    def getStats(self):
+        """
+        Returns the usage of the cache.
+
+        @return: 'bytes' and 'blobs' stored, the 'files' linked to them,
+            the 'saved' bytes of files sharing a blob and the 'quota'.
+        @rtype: dict
+        """
+        with self.__lock:
+            stored, blobs = self.__db.execute("SELECT COALESCE(SUM(size), 0),"
+                                              " COUNT(*) FROM blobs").\
+                                              fetchone()
+            files, linked = self.__db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM links "
+                "JOIN blobs ON links.digest = blobs.digest").fetchone()
+        return {'bytes': stored, 'blobs': blobs, 'files': files,
+                'saved': max(linked - stored, 0), 'quota': self.quota}
+
+
+
+
+    def enforceQuota(self, quota = None):
+        """
+        Evicts the least recently used blobs, and the files linked to them,
+        until the blobs fit the quota.  Blobs used within EVICTION_GRACE
+        seconds are kept regardless.
+
+        @param quota: The byte quota.  Defaults to 'quota'.
+        @type quota: int
+
+        @return: The bytes freed.
+        @rtype: int
+        """
+        quota = self.quota if quota is None else quota
+        with self.__lock:
+            total = self.__db.execute("SELECT COALESCE(SUM(size), 0) "
+                                      "FROM blobs").fetchone()[0]
+            if total <= quota:
+                return 0
+            candidates = self.__db.execute("SELECT digest, size FROM blobs "
+                                           "WHERE used < ? ORDER BY used",
+                                           (time.time() -
+                                            self.EVICTION_GRACE,)).fetchall()
+        freed = 0
+        for digest, size in candidates:
+            if total - freed <= quota:
+                break
+            self.__evict(digest)
+            freed += size
+        return freed
+
+
+
+
+    def clear(self):
+        """
+        Evicts every blob and the files linked to them.
+
+        @return: The bytes freed.
+        @rtype: int
+        """
+        with self.__lock:
+            blobs = self.__db.execute("SELECT digest, size FROM blobs").\
+                    fetchall()
+        for digest, size in blobs:
+            self.__evict(digest)
+        return sum(size for digest, size in blobs)
+
+
+
+
+    def __evict(self, digest):
+        """
+        Removes a blob, the files linked to it and the directories that
+        they leave empty.
+
+        @param digest: The digest of the blob.
+        @type digest: str
+        """
+        blobPath = self.getBlobPath(digest)
+        with self.__lock:
+            paths = [row[0] for row in self.__db.execute(
+                "SELECT path FROM links WHERE digest = ?", (digest,))]
+        for path in paths:
+            try:
+                if os.path.exists(path) and os.path.exists(blobPath) and \
+                   os.path.samefile(path, blobPath):
+                    os.remove(path)
+                    self.__removeEmptyDirs(os.path.dirname(path))
+            except OSError as e:
+                print("Unable to evict '%s': %s"%(path, str(e)))
+        try:
+            if os.path.exists(blobPath):
+                os.remove(blobPath)
+                self.__removeEmptyDirs(os.path.dirname(blobPath))
+        except OSError as e:
+            print("Unable to evict '%s': %s"%(blobPath, str(e)))
+        with self.__lock, self.__db:
+            self.__db.execute("DELETE FROM links WHERE digest = ?", (digest,))
+            self.__db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+
+
+
+
+    def __removeEmptyDirs(self, dirPath):
+        """
+        Removes 'dirPath' and its parents, up to 'rootDir', while empty.
+
+        @param dirPath: The directory.
+        @type dirPath: str
+        """
+        while dirPath.startswith(self.rootDir + os.sep) and \
+              os.path.isdir(dirPath) and not os.listdir(dirPath):
+            os.rmdir(dirPath)
+            dirPath = os.path.dirname(dirPath)
+
+
+
+
+    def close(self):
+        """
+        Waits for the files being added, then closes the index.
+        """
+        self.__executor.shutdown(wait = True)
+        with self.__lock:
+            self.__db.close()
@@ -0,0 +1,164 @@
+__author__ = "Sunil Kumar (kumar.sunil.p@gmail.com)"
+__copyright__ = "Copyright 2014, Washington University in St. Louis"
+__credits__ = ["Sunil Kumar", "Steve Pieper", "Dan Marcus"]
+__license__ = "XNAT Software License Agreement " + \
+              "(see: http://xnat.org/about/license.php)"
+__version__ = "2.1.1"
+__maintainer__ = "Rick Herrick"
+__email__ = "herrickr@mir.wustl.edu"
+__status__ = "Production"
+
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# module
+from XnatSlicerGlobals import *
+
+
+
+class MetadataStore(object):
+    """
+    MetadataStore persists the JSON listings that Xnat.io is asked to store
+    (see 'getFolder') in an SQLite database in the settings directory, so 
+    that the View can be painted at login before the server has answered.
+    Listings older than MAX_AGE are deleted whenever a store is opened.
+
+    A MetadataStore is bound to one host and username.  Xnat.io talks to it
+    through its 'metadataStore' attribute:
+
+    store = MetadataStore(host, username)
+    XnatIo.metadataStore = store
+    XnatIo.getFolder('projects', store = True)
+    projects = XnatIo.getFolder('projects', fromStore = True)
+    """
+
+    FILE_NAME = 'metadata.db'
+
+    #
+    # Listings older than this (in seconds) are not used for warm starts.
+    #
+    MAX_AGE = 30 * 24 * 60 * 60
+
+
+    def __init__(self, host, username, dbPath = None):
+        """
+        @param host: The XNAT host the listings belong to.
+        @type host: str
+
+        @param username: The user the listings were retrieved as.
+        @type username: str
+
+        @param dbPath: The database file.  Defaults to FILE_NAME in
+            the settings directory.
+        @type dbPath: str
+        """
+        self.host = host.rstrip('/')
+        self.username = username
+        self.dbPath = dbPath or \
+            os.path.join(XnatSlicerGlobals.LOCAL_URIS['settings'],
+                         self.FILE_NAME)
+
+        dbDir = os.path.dirname(self.dbPath)
+        if dbDir and not os.path.exists(dbDir):
+            os.makedirs(dbDir)
+
+        #--------------------
+        # Xnat.io saves from its request threads, hence the shared
+        # connection and lock.
+        #--------------------
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(self.dbPath, check_same_thread = False)
+        with self.__db:
+            self.__db.execute("CREATE TABLE IF NOT EXISTS listings ("
+                              "host TEXT, username TEXT, url TEXT, "
+                              "result TEXT, stored REAL, "
+                              "PRIMARY KEY (host, username, url))")
+            self.__db.execute("DELETE FROM listings WHERE stored < ?",
+                              (time.time() - self.MAX_AGE,))
+
+
+
+
+    def load(self, url):
+        """
+        Returns a stored listing.
+
+        @param url: The normalized XNAT url of the listing.
+        @type url: str
+
+        @return: The stored 'ResultSet' 'Result' list, or None if there
+            isn't one (or it is older than MAX_AGE).
+        @rtype: list.<dict>
+        """
+        with self.__lock:
+            row = self.__db.execute("SELECT result, stored FROM listings "
+                                    "WHERE host = ? AND username = ? AND "
+                                    "url = ?",
+                                    (self.host, self.username, url)).fetchone()
+        if not row or time.time() - row[1] > self.MAX_AGE:
+            return None
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            return None
+
+
+
+
+    def save(self, url, result):
+        """
+        Stores (or replaces) a listing.
+
+        @param url: The normalized XNAT url of the listing.
+        @type url: str
+
+        @param result: The 'ResultSet' 'Result' list.
+        @type result: list.<dict>
+        """
+        with self.__lock, self.__db:
+            self.__db.execute("INSERT OR REPLACE INTO listings "
+                              "VALUES (?, ?, ?, ?, ?)",
+                              (self.host, self.username, url,
+                               json.dumps(result), time.time()))
+
+
+
+
+    def invalidate(self, url = None):
+        """
+        Removes the stored listings of a changed url, its children and its
+        parent folders.
+
+        @param url: The normalized XNAT url that changed, without query
+            arguments.  Defaults to None, which removes every listing of
+            the host and user.
+        @type url: str
+        """
+        with self.__lock, self.__db:
+            if url is None:
+                self.__db.execute("DELETE FROM listings WHERE host = ? AND "
+                                  "username = ?", (self.host, self.username))
+                return
+            rows = self.__db.execute("SELECT url FROM listings WHERE "
+                                     "host = ? AND username = ?",
+                                     (self.host, self.username)).fetchall()
+            for (storedUrl,) in rows:
+                storedPath = storedUrl.split('?')[0]
+                if url.startswith(storedPath) or storedPath.startswith(url):
+                    self.__db.execute("DELETE FROM listings WHERE host = ? "
+                                      "AND username = ? AND url = ?",
+                                      (self.host, self.username, storedUrl))
+
+
+
+
+    def close(self):
+        """
+        Closes the database.
+        """
+        with self.__lock:
+            self.__db.close()